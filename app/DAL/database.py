@@ -1,6 +1,6 @@
 import os
 
-from sqlalchemy import create_engine, orm
+from sqlalchemy import create_engine, inspect, orm, text
 from contextlib import contextmanager, AbstractContextManager
 from sqlalchemy.orm import declarative_base, Session
 from sqlalchemy_utils import database_exists, create_database, drop_database
@@ -29,6 +29,26 @@ class Database:
 
     def create_tables(self) -> None:
         Base.metadata.create_all(self._engine)
+        self.add_missing_columns()
+
+    # create_all does not alter existing tables, add the nullable columns introduced after the table was created
+    def add_missing_columns(self) -> None:
+        inspector = inspect(self._engine)
+        preparer = self._engine.dialect.identifier_preparer
+
+        with self._engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+
+                existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns or not column.nullable:
+                        continue
+
+                    column_type = column.type.compile(dialect=self._engine.dialect)
+                    logger.info(f"Adding missing column '{column.name}' ({column_type}) to table '{table.name}'")
+                    connection.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"))
 
     # Add code to recreate the database here using sqlalchemy_utils
     def recreate_database(self) -> None:
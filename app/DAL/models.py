@@ -3,7 +3,7 @@ import json
 import os
 from datetime import datetime
 
-from sqlalchemy import Column, String, ForeignKey, DateTime, Enum, Boolean, Integer, Date
+from sqlalchemy import Column, String, ForeignKey, DateTime, Enum, Boolean, Integer, Date, LargeBinary
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -59,6 +59,12 @@ class DogImage(Base):
     createdAt = Column(DateTime, default=datetime.utcnow)
     updatedAt = Column(DateTime, onupdate=datetime.utcnow)
 
+    ## stored embedding, reused by the vectordb indexer instead of running segmentation and embedding again
+    embedding = Column(LargeBinary)
+    embeddingDtype = Column(String) # float32 / float16
+    embeddingModel = Column(String) # model name, precision and version of the embedding model
+    embeddingSettings = Column(String) # segmentation settings used before embedding
+
     dog = relationship('Dog', back_populates='images')
 
 
@@ -59,11 +59,13 @@ class DogWithImagesRepository:
             dog_id (int): The ID of the dog.
 
         Returns:
-            DogDTO: The dog data transfer object with the retrieved dog and images.
+            DogDTO: The dog data transfer object with the retrieved dog and images, or None if there is no such dog.
         """
         try:
             with self.session_factory() as session:
                 dog = session.query(Dog).options(subqueryload(Dog.images)).filter(Dog.id == dog_id).first()
+                if dog is None:
+                    return None
                 
                 dogDTO = mapper.to(DogDTO).map(dog, fields_mapping={ "images": [] })
                 dogDTO.images = [mapper.to(DogImageDTO).map(image) for image in dog.images]
@@ -138,6 +140,36 @@ class DogWithImagesRepository:
         except SQLAlchemyError as e:
             raise e
 
+    def update_dog_images_embeddings(self, dogImageDTOs: list[DogImageDTO]) -> None:
+        """
+        Store the computed embeddings of dog images in the database.
+
+        Args:
+            dogImageDTOs (list[DogImageDTO]): The dog images with their embedding fields set.
+        """
+        try:
+            with self.session_factory() as session:
+                session.bulk_update_mappings(DogImage, [
+                    {
+                        "id": image.id,
+                        "embedding": image.embedding,
+                        "embeddingDtype": image.embeddingDtype,
+                        "embeddingModel": image.embeddingModel,
+                        "embeddingSettings": image.embeddingSettings,
+                    }
+                    for image in dogImageDTOs if image.id is not None
+                ])
+
+                session.commit()
+        except SQLAlchemyError as e:
+            logger.exception(f"DB Error while updating dog images embeddings: {e}")
+            session.rollback()
+            raise e
+        except Exception as e:
+            logger.exception(f"Error while updating dog images embeddings: {e}")
+            session.rollback()
+            raise e
+
     def update_dog_is_resolved(self, dog_id: int, is_resolved: bool) -> None:
         """
         Update the isResolved property of a dog in the database.
@@ -1,6 +1,6 @@
 from enum import Enum
 from typing import List, Optional
-from pydantic import BaseModel, field_serializer
+from pydantic import BaseModel, Field, field_serializer
 from datetime import date
 
 from app.viewmodels.data_types import DogAgeGroup, DogSex, DogType
@@ -10,6 +10,12 @@ class DogImageDTO(BaseModel):
     base64Image: str
     imageContentType: Optional[str] = "webp"
 
+    ## stored embedding, internal only and never serialized
+    embedding: Optional[bytes] = Field(default=None, exclude=True)
+    embeddingDtype: Optional[str] = Field(default=None, exclude=True)
+    embeddingModel: Optional[str] = Field(default=None, exclude=True)
+    embeddingSettings: Optional[str] = Field(default=None, exclude=True)
+
 class DogDTO(BaseModel):
     id: Optional[int] = None
     reporterId: str 
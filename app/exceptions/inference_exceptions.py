@@ -0,0 +1,23 @@
+from fastapi import HTTPException, status
+
+
+class InferenceException(HTTPException):
+    pass
+
+
+class InferenceQueueFullException(InferenceException):
+    def __init__(self, detail: str = "The inference queue is full, please try again later"):
+        """Returns HTTP 503"""
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+
+
+class ComponentNotReadyException(InferenceException):
+    def __init__(self, detail: str = "The service is still starting up, please try again later"):
+        """Returns HTTP 503"""
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+
+
+class InferenceServiceUnavailableException(InferenceException):
+    def __init__(self, detail: str = "The inference service is unavailable, please try again later"):
+        """Returns HTTP 503"""
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
@@ -0,0 +1,29 @@
+from fastapi import HTTPException, status
+
+
+class SearchException(HTTPException):
+    pass
+
+
+class InvalidSearchCursorException(SearchException):
+    def __init__(self, detail: str = "The search cursor is malformed"):
+        """Returns HTTP 400"""
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+class SearchCursorExpiredException(SearchException):
+    def __init__(self, detail: str = "The search cursor expired, please search with the image again"):
+        """Returns HTTP 410"""
+        super().__init__(status_code=status.HTTP_410_GONE, detail=detail)
+
+
+class DogNotFoundException(SearchException):
+    def __init__(self, detail: str = "The dog was not found"):
+        """Returns HTTP 404"""
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+class NoStoredEmbeddingException(SearchException):
+    def __init__(self, detail: str = "The dog has no up to date stored embedding, reindex it first"):
+        """Returns HTTP 409"""
+        super().__init__(status_code=status.HTTP_409_CONFLICT, detail=detail)
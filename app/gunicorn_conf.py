@@ -0,0 +1,46 @@
+# Preload-and-fork server mode: the master loads the models once, the workers share the weights copy-on-write.
+#
+# Run with:
+#     gunicorn -c app/gunicorn_conf.py app.main:app
+import gc
+import multiprocessing
+import os
+import secrets
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+
+# Import the app, and load the models, in the master before forking the workers
+preload_app = True
+
+# The workers verify the search cursors signed by each other, give them the same key when none is configured
+os.environ.setdefault("SEARCH_CURSOR_SECRET", secrets.token_hex(32))
+
+# Torch threads per worker, by default the cores are split between the workers
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", max(1, multiprocessing.cpu_count() // workers)))
+
+def on_starting(server):
+    # The local vectordb lives in each worker, it can't be shared by several of them
+    if os.environ.get("VECTORDB_BACKEND", "weaviate") == "local":
+        from app.services.local_vectordb_client import require_single_process
+
+        require_single_process(server.cfg.workers)
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before the workers are forked.
+    # No inference runs here, torch must not start its thread pools before the fork.
+    from app.helpers.model_helper import INFERENCE_BACKEND, preload_models
+
+    if INFERENCE_BACKEND == "local":
+        preload_models()
+
+    # Keep the preloaded objects out of the garbage collector so it never touches (and copies) their pages in the workers
+    gc.freeze()
+
+def post_fork(server, worker):
+    import torch
+
+    torch.set_num_threads(TORCH_NUM_THREADS)
+    server.log.info(f"Worker {worker.pid} uses {TORCH_NUM_THREADS} torch threads")
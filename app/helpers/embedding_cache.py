@@ -0,0 +1,227 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+from cachetools import TTLCache
+from app.MyLogger import logger
+
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", 60 * 60))
+# The on-disk tier is only used when a directory is configured
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR")
+EMBEDDING_CACHE_DISK_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+EMBEDDING_CACHE_DISK_TTL_SECONDS = float(os.environ.get("EMBEDDING_CACHE_DISK_TTL_SECONDS", 7 * 24 * 60 * 60))
+
+# How many disk writes happen between two disk budget checks
+DISK_PRUNE_INTERVAL = 256
+
+class EmbeddingCache:
+    def __init__(self, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, ttl_seconds: float = EMBEDDING_CACHE_TTL_SECONDS, disk_dir: Optional[str] = EMBEDDING_CACHE_DIR, disk_max_bytes: int = EMBEDDING_CACHE_DISK_MAX_BYTES, disk_ttl_seconds: float = EMBEDDING_CACHE_DISK_TTL_SECONDS) -> None:
+        """
+        Cache of embedding vectors addressed by the hash of the image content.
+
+        The in-memory tier is bounded by the total size of the stored vectors and evicts expired entries first, then the least recently used ones.
+        The optional on-disk tier keeps the vectors across restarts, namespaced by the embedding identity.
+
+        Args:
+            max_bytes (int, optional): The memory budget of the in-memory tier. Defaults to EMBEDDING_CACHE_MAX_BYTES.
+            ttl_seconds (float, optional): How long a vector stays in the in-memory tier. Defaults to EMBEDDING_CACHE_TTL_SECONDS.
+            disk_dir (Optional[str], optional): The directory of the on-disk tier, None disables it. Defaults to EMBEDDING_CACHE_DIR.
+            disk_max_bytes (int, optional): The size budget of the on-disk tier. Defaults to EMBEDDING_CACHE_DISK_MAX_BYTES.
+            disk_ttl_seconds (float, optional): How long a vector stays in the on-disk tier. Defaults to EMBEDDING_CACHE_DISK_TTL_SECONDS.
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl_seconds = disk_ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory = TTLCache(maxsize=max_bytes, ttl=ttl_seconds, getsizeof=lambda vector: vector.nbytes)
+        self._identity: Optional[str] = None
+        self._disk_namespace: Optional[str] = None
+        self._disk_writes = 0
+
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def set_identity(self, identity: str) -> None:
+        """
+        Set the identity of the embedding pipeline the cached vectors belong to.
+        When the identity changes every cached vector is dropped, including the on-disk vectors of the previous identities.
+        """
+        with self._lock:
+            if identity == self._identity:
+                return
+
+            if self._identity is not None:
+                logger.info(f"Embedding identity changed from '{self._identity}' to '{identity}', invalidating the embedding cache")
+                self._invalidations += 1
+
+            self._identity = identity
+            self._memory.clear()
+
+            if self.disk_dir:
+                self._disk_namespace = os.path.join(self.disk_dir, hashlib.sha256(identity.encode()).hexdigest()[:16])
+                self._remove_stale_disk_namespaces()
+                os.makedirs(self._disk_namespace, exist_ok=True)
+
+    def get(self, content_hash: str) -> Optional[List[float]]:
+        """
+        Return the cached vector of an image content hash, or None on a miss.
+        """
+        with self._lock:
+            vector = self._memory.get(content_hash)
+            if vector is not None:
+                self._memory_hits += 1
+                return vector.tolist()
+
+        vector = self._read_from_disk(content_hash)
+
+        with self._lock:
+            if vector is None:
+                self._misses += 1
+                return None
+
+            self._disk_hits += 1
+            self._memory[content_hash] = vector
+
+        return vector.tolist()
+
+    def put(self, content_hash: str, embedding: List[float]) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+
+        with self._lock:
+            if vector.nbytes <= self.max_bytes:
+                self._memory[content_hash] = vector
+
+        self._write_to_disk(content_hash, vector)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._disk_namespace and os.path.isdir(self._disk_namespace):
+                shutil.rmtree(self._disk_namespace, ignore_errors=True)
+                os.makedirs(self._disk_namespace, exist_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._memory_hits + self._disk_hits + self._misses
+
+            return {
+                "identity": self._identity,
+                "entries": len(self._memory),
+                "bytes": self._memory.currsize,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": round((self._memory_hits + self._disk_hits) / lookups, 4) if lookups else 0.0,
+                "invalidations": self._invalidations,
+                "disk_enabled": self._disk_namespace is not None,
+            }
+
+    def _disk_path(self, content_hash: str) -> str:
+        return os.path.join(self._disk_namespace, content_hash[:2], f"{content_hash}.npy")
+
+    def _read_from_disk(self, content_hash: str) -> Optional[np.ndarray]:
+        if self._disk_namespace is None:
+            return None
+
+        path = self._disk_path(content_hash)
+        try:
+            if time.time() - os.path.getmtime(path) > self.disk_ttl_seconds:
+                os.remove(path)
+                return None
+
+            return np.load(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error while reading cached embedding {path}: {e}")
+            return None
+
+    def _write_to_disk(self, content_hash: str, vector: np.ndarray) -> None:
+        if self._disk_namespace is None:
+            return
+
+        path = self._disk_path(content_hash)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write to a temporary file first so readers never see a partial vector
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, vector)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Error while writing cached embedding {path}: {e}")
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            should_prune = self._disk_writes % DISK_PRUNE_INTERVAL == 0
+
+        if should_prune:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        # Drop the expired vectors, then the oldest ones until the disk tier fits its budget
+        entries = []
+        total_bytes = 0
+        now = time.time()
+
+        for root, _, files in os.walk(self._disk_namespace):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                if now - stat.st_mtime > self.disk_ttl_seconds:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def _remove_stale_disk_namespaces(self) -> None:
+        if not os.path.isdir(self.disk_dir):
+            return
+
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            # Only touch the directories created as identity namespaces
+            is_namespace = len(name) == 16 and all(c in "0123456789abcdef" for c in name)
+            if is_namespace and path != self._disk_namespace and os.path.isdir(path):
+                logger.info(f"Removing stale embedding cache namespace {path}")
+                shutil.rmtree(path, ignore_errors=True)
+
+def create_embedding_cache() -> Optional[EmbeddingCache]:
+    if not EMBEDDING_CACHE_ENABLED:
+        logger.info("Embedding cache is disabled")
+        return None
+
+    logger.info(f"Creating embedding cache with max_bytes: {EMBEDDING_CACHE_MAX_BYTES}, ttl_seconds: {EMBEDDING_CACHE_TTL_SECONDS}, disk_dir: {EMBEDDING_CACHE_DIR}")
+
+    return EmbeddingCache()
@@ -0,0 +1,85 @@
+import os
+from typing import List, Optional
+import numpy as np
+
+# The precision the embeddings are stored with in the relational db, float16 halves the size of the blobs
+EMBEDDING_STORAGE_DTYPE = os.environ.get("EMBEDDING_STORAGE_DTYPE", "float32")
+
+SUPPORTED_STORAGE_DTYPES = ("float32", "float16")
+
+def serialize_embedding(embedding: List[float], dtype: str = EMBEDDING_STORAGE_DTYPE) -> bytes:
+    """
+    Serialize an embedding vector into a compact little-endian binary blob.
+
+    Args:
+        embedding (List[float]): The embedding vector.
+        dtype (str, optional): The storage precision, float32 or float16. Defaults to EMBEDDING_STORAGE_DTYPE.
+
+    Returns:
+        bytes: The raw vector bytes.
+    """
+    if dtype not in SUPPORTED_STORAGE_DTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype '{dtype}', expected one of {SUPPORTED_STORAGE_DTYPES}")
+
+    return np.asarray(embedding, dtype=np.dtype(dtype).newbyteorder("<")).tobytes()
+
+def deserialize_embedding(blob: bytes, dtype: str = "float32") -> np.ndarray:
+    """
+    Deserialize a binary blob created by serialize_embedding back into a float32 vector.
+
+    Args:
+        blob (bytes): The raw vector bytes.
+        dtype (str, optional): The precision the blob was stored with. Defaults to float32.
+
+    Returns:
+        numpy.ndarray: The float32 embedding vector.
+    """
+    return np.frombuffer(blob, dtype=np.dtype(dtype or "float32").newbyteorder("<")).astype(np.float32)
+
+def is_embedding_fresh(embedding: Optional[bytes], embedding_model: Optional[str], embedding_settings: Optional[str], model_id: str, settings_id: str) -> bool:
+    """
+    Check whether a stored embedding was computed by the current model with the current segmentation settings.
+    """
+    return embedding is not None and embedding_model == model_id and embedding_settings == settings_id
+
+def compute_dog_profile(embeddings: np.ndarray, mode: str = "centroid", max_medoids: int = 3) -> List[tuple]:
+    """
+    Aggregate the image embeddings of a dog into its profile vectors, one vector per dog or a few.
+
+    Args:
+        embeddings (np.ndarray): The [n, d] image embeddings of the dog.
+        mode (str, optional): "centroid" for the normalized mean of the embeddings, or "medoids" for up to max_medoids
+            of the embeddings, chosen so every image is close to one of them. Defaults to "centroid".
+        max_medoids (int, optional): The maximum number of medoids. Defaults to 3.
+
+    Returns:
+        List[tuple]: The profile vectors, each with the index of its representative image (the image nearest to the centroid, or the medoid itself).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+
+    if mode == "centroid":
+        centroid = normalized.mean(axis=0)
+        centroid /= max(np.linalg.norm(centroid), 1e-12)
+        return [(int(np.argmax(normalized @ centroid)), centroid)]
+
+    if mode != "medoids":
+        raise ValueError(f"Unsupported dog profile mode '{mode}', expected 'centroid' or 'medoids'")
+
+    if len(normalized) <= max_medoids:
+        return [(i, normalized[i]) for i in range(len(normalized))]
+
+    # Greedily add the image that most improves how close every image is to its nearest medoid,
+    # the first pick is the medoid of the whole set
+    similarities = normalized @ normalized.T
+    medoids = []
+    coverage = np.full(len(normalized), -np.inf, dtype=np.float32)
+    for _ in range(max_medoids):
+        gains = np.maximum(similarities, coverage).sum(axis=1)
+        gains[medoids] = -np.inf
+        medoid = int(np.argmax(gains))
+        medoids.append(medoid)
+        coverage = np.maximum(coverage, similarities[medoid])
+
+    return [(i, normalized[i]) for i in medoids]
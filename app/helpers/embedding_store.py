@@ -0,0 +1,187 @@
+# EmbeddingStore keeps a matrix of embeddings on disk in a raw, memory-mappable format:
+#     <path>/header.json   format version, model, dimension, dtype and row count
+#     <path>/vectors.bin   the rows, C-contiguous, no framing
+#     <path>/index.jsonl   one JSON object per row, its id and metadata
+# Opening a store maps the vectors instead of reading them, so a multi-GB gallery opens instantly
+# and the pages are shared by every process mapping the same file.
+import json
+import os
+from typing import Any, Dict, List, Optional
+import numpy as np
+from app.MyLogger import logger
+
+EMBEDDING_STORE_FORMAT_VERSION = 1
+
+HEADER_FILE_NAME = "header.json"
+VECTORS_FILE_NAME = "vectors.bin"
+INDEX_FILE_NAME = "index.jsonl"
+
+class EmbeddingStore:
+    def __init__(self, path: str, header: dict, ids: List[Any], metadata: List[dict]) -> None:
+        """
+        Use EmbeddingStore.create or EmbeddingStore.open.
+        """
+        self.path = path
+        self.header = header
+        self.ids = ids
+        self.metadata = metadata
+        self._vectors: Optional[np.ndarray] = None
+
+    @property
+    def model(self) -> str:
+        return self.header["model"]
+
+    @property
+    def dim(self) -> int:
+        return self.header["dim"]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.header["dtype"])
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    @classmethod
+    def create(cls, path: str, model: str, dim: int, dtype: str = "float32", overwrite: bool = False) -> "EmbeddingStore":
+        """
+        Create an empty store.
+
+        Args:
+            path (str): The directory of the store.
+            model (str): The identity of the model that produced the embeddings, checked when the store is opened.
+            dim (int): The dimension of the embeddings.
+            dtype (str, optional): The dtype of the stored embeddings. Defaults to "float32".
+            overwrite (bool, optional): Replace an existing store. Defaults to False.
+
+        Returns:
+            EmbeddingStore: The empty store.
+        """
+        if os.path.exists(os.path.join(path, HEADER_FILE_NAME)) and not overwrite:
+            raise FileExistsError(f"An embedding store already exists in {path}")
+
+        os.makedirs(path, exist_ok=True)
+
+        # The empty header goes first, so a concurrent open never reads the rows of the replaced store
+        header = { "format_version": EMBEDDING_STORE_FORMAT_VERSION, "model": model, "dim": int(dim), "dtype": np.dtype(dtype).name, "count": 0 }
+        store = cls(path, header, [], [])
+        store._write_header()
+
+        # The files of a replaced store may still be mapped (by a previous Gallery or another process), truncating them
+        # in place would crash those readers with SIGBUS. New files are swapped in instead, the mappings keep the old ones.
+        for file_name in (VECTORS_FILE_NAME, INDEX_FILE_NAME):
+            file_path = os.path.join(path, file_name)
+            open(file_path + ".tmp", "wb").close()
+            os.replace(file_path + ".tmp", file_path)
+
+        return store
+
+    @classmethod
+    def open(cls, path: str, model: Optional[str] = None, dim: Optional[int] = None) -> "EmbeddingStore":
+        """
+        Open an existing store, the vectors are memory-mapped on first access.
+
+        Args:
+            path (str): The directory of the store.
+            model (Optional[str], optional): The expected model identity, a mismatch raises ValueError. Defaults to None (not checked).
+            dim (Optional[int], optional): The expected dimension, a mismatch raises ValueError. Defaults to None (not checked).
+
+        Returns:
+            EmbeddingStore: The store.
+        """
+        with open(os.path.join(path, HEADER_FILE_NAME)) as f:
+            header = json.load(f)
+
+        if header.get("format_version") != EMBEDDING_STORE_FORMAT_VERSION:
+            raise ValueError(f"Embedding store {path} has format version {header.get('format_version')}, expected {EMBEDDING_STORE_FORMAT_VERSION}")
+        if model is not None and header["model"] != model:
+            raise ValueError(f"Embedding store {path} holds embeddings of model '{header['model']}', expected '{model}'")
+        if dim is not None and header["dim"] != dim:
+            raise ValueError(f"Embedding store {path} holds embeddings of dimension {header['dim']}, expected {dim}")
+
+        # The header is written last on append, rows past its count belong to an interrupted append
+        ids = []
+        metadata = []
+        with open(os.path.join(path, INDEX_FILE_NAME)) as f:
+            for line, _ in zip(f, range(header["count"])):
+                entry = json.loads(line)
+                ids.append(entry.pop("id"))
+                metadata.append(entry)
+
+        if len(ids) != header["count"]:
+            raise ValueError(f"Embedding store {path} index has {len(ids)} rows, the header {header['count']}")
+
+        return cls(path, header, ids, metadata)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        The [count, dim] embeddings, memory-mapped copy-on-write: writes to the array never reach the file.
+        """
+        if self._vectors is None:
+            if len(self) == 0:
+                self._vectors = np.empty((0, self.dim), dtype=self.dtype)
+            else:
+                self._vectors = np.memmap(os.path.join(self.path, VECTORS_FILE_NAME), dtype=self.dtype, mode="c", shape=(len(self), self.dim))
+
+        return self._vectors
+
+    def as_tensor(self):
+        """
+        The embeddings as a torch tensor sharing the memory map, no copy is made.
+        """
+        import torch
+
+        return torch.from_numpy(self.vectors)
+
+    def append(self, vectors, ids: List[Any], metadata: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Append rows to the store.
+
+        Args:
+            vectors: The [B, dim] embeddings, a numpy array or anything np.asarray accepts.
+            ids (List[Any]): The JSON-serializable id of each row.
+            metadata (Optional[List[Dict[str, Any]]], optional): The JSON-serializable metadata of each row. Defaults to None.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        metadata = metadata if metadata is not None else [{} for _ in ids]
+        if not len(vectors) == len(ids) == len(metadata):
+            raise ValueError(f"Got {len(vectors)} vectors, {len(ids)} ids and {len(metadata)} metadata entries")
+        if len(vectors) == 0:
+            return
+
+        # Drop the rows of an interrupted append before writing after them
+        vectors_path = os.path.join(self.path, VECTORS_FILE_NAME)
+        with open(vectors_path, "r+b") as f:
+            f.truncate(len(self) * self.dim * self.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(vectors.tobytes())
+
+        index_lines = [json.dumps({ "id": row_id, **row_metadata }) + "\n" for row_id, row_metadata in zip(ids, metadata)]
+        self._truncate_index()
+        with open(os.path.join(self.path, INDEX_FILE_NAME), "a") as f:
+            f.writelines(index_lines)
+
+        self.ids.extend(ids)
+        self.metadata.extend(metadata)
+        self.header["count"] += len(vectors)
+        self._write_header()
+
+        # The mapping covers the previous rows only, map again on next access
+        self._vectors = None
+
+        logger.info(f"Appended {len(vectors)} embeddings to the store {self.path}, {len(self)} in total")
+
+    def _truncate_index(self) -> None:
+        index_path = os.path.join(self.path, INDEX_FILE_NAME)
+        with open(index_path, "rb+") as f:
+            for _ in range(len(self)):
+                f.readline()
+            f.truncate()
+
+    def _write_header(self) -> None:
+        # Replace the header atomically, it commits the appended rows
+        header_path = os.path.join(self.path, HEADER_FILE_NAME)
+        with open(header_path + ".tmp", "w") as f:
+            json.dump(self.header, f)
+        os.replace(header_path + ".tmp", header_path)
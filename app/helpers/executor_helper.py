@@ -0,0 +1,44 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from app.MyLogger import logger
+
+# Blocking I/O: SQLAlchemy sessions and vector db requests
+IO_POOL_SIZE = int(os.environ.get("IO_POOL_SIZE", 16))
+# CPU-bound work: image decoding/encoding, segmentation and embedding
+INFERENCE_POOL_SIZE = int(os.environ.get("INFERENCE_POOL_SIZE", 2))
+# Long-running background jobs (reindexing), kept off the inference pool so they never hold a query slot
+INDEXING_POOL_SIZE = int(os.environ.get("INDEXING_POOL_SIZE", 1))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="dogfinder-io")
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_POOL_SIZE, thread_name_prefix="dogfinder-inference")
+indexing_executor = ThreadPoolExecutor(max_workers=INDEXING_POOL_SIZE, thread_name_prefix="dogfinder-indexing")
+
+logger.info(f"Created executors with IO_POOL_SIZE: {IO_POOL_SIZE}, INFERENCE_POOL_SIZE: {INFERENCE_POOL_SIZE}, INDEXING_POOL_SIZE: {INDEXING_POOL_SIZE}")
+
+async def run_in_io_pool(func, *args, **kwargs):
+    """
+    Run a blocking I/O function on the I/O thread pool without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+async def run_in_inference_pool(func, *args, **kwargs):
+    """
+    Run a CPU-bound function on the inference thread pool without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, functools.partial(func, *args, **kwargs))
+
+async def run_in_indexing_pool(func, *args, **kwargs):
+    """
+    Run a long-running background job on the indexing thread pool, without taking an inference slot from the queries.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(indexing_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown_executors():
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    inference_executor.shutdown(wait=False, cancel_futures=True)
+    indexing_executor.shutdown(wait=False, cancel_futures=True)
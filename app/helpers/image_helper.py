@@ -30,7 +30,11 @@ def pil_image_to_base64(pil_image):
     return img_str.decode('utf-8')
 
 def hash_image(image):
-    return hashlib.md5(image.encode()).hexdigest()
+    # Accept both the base64 string and the raw image bytes
+    if isinstance(image, str):
+        image = image.encode()
+
+    return hashlib.sha256(image).hexdigest()
 
 # def resize_image(img: Image, max_size: tuple[int, int]) -> Image:
 #     """
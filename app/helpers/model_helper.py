@@ -3,9 +3,26 @@ from app.MyLogger import logger
 from app.helpers.helper import timeit
 from cachetools import cached, LRUCache
 from sentence_transformers import SentenceTransformer
+from ultralytics import YOLO
 import os
-from app.model_optimization.features_extractor import FeatureExtractor
-from app.model_optimization.remove_background import process_pil_image, process_pil_image_YOLO
+import threading
+import numpy as np
+from PIL import Image
+from app.model_optimization.features_extractor import DINO_QUANTIZATION_MODE, FeatureExtractor, QuantizedFeatureExtractor
+from app.services.inference_client import InferenceClient
+from app.model_optimization.remove_background import get_segmentation_settings_id, process_pil_image, process_pil_image_YOLO, process_pil_images_YOLO, segmentation_settings
+
+# Number of synthetic images run through the models once they are loaded
+MODEL_WARMUP_IMAGES = int(os.environ.get("MODEL_WARMUP_IMAGES", 2))
+# "local" loads the models in this process, "remote" uses the inference service (app/services/inference_service.py)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "local")
+# The embedding models whose creation starts no thread pool, the only ones loaded before the fork of the preload server
+FORK_SAFE_EMBEDDING_MODELS = ("dino", "sentence-transformers")
+
+# The models are cached singletons shared by the inference threads, and neither the Ultralytics predictor nor the
+# embedding models are thread-safe. Each model runs one call at a time, one batch can still be segmented while another is embedded.
+segmentation_model_lock = threading.Lock()
+embedding_model_lock = threading.Lock()
 
 @timeit
 def create_embedding_model():
@@ -17,8 +34,14 @@ def create_embedding_model():
         embedding_model = create_sentence_transformer_embedding_model(), create_sentence_transformer_embedding_model.cache_info()
     elif embedding_model_name == "dino":
         embedding_model = create_dino_embedding_model(), create_dino_embedding_model.cache_info()
+    elif embedding_model_name == "dino-int8":
+        embedding_model = create_dino_int8_embedding_model(), create_dino_int8_embedding_model.cache_info()
+    elif embedding_model_name == "dino-onnx":
+        embedding_model = create_dino_onnx_embedding_model(), create_dino_onnx_embedding_model.cache_info()
+    else:
+        raise ValueError(f"Unknown EMBEDDING_MODEL_NAME '{embedding_model_name}'")
     
-    logger.info("Returning SentenceTransformer embedding model")
+    logger.info(f"Returning {embedding_model_name} embedding model")
 
     return embedding_model
 
@@ -40,17 +63,106 @@ def create_dino_embedding_model():
 
     return embedding_model
 
+@cached(cache=LRUCache(maxsize=8), info=True)
+def create_dino_int8_embedding_model():
+    logger.info("Creating INT8 quantized DINO embedding model")
+
+    embedding_model = QuantizedFeatureExtractor()
+
+    return embedding_model
+
+@cached(cache=LRUCache(maxsize=8), info=True)
+def create_dino_onnx_embedding_model():
+    logger.info("Creating DINO ONNX Runtime embedding model")
+
+    # onnxruntime is only imported when the ONNX backend is selected
+    from app.model_optimization.onnx_features_extractor import OnnxFeatureExtractor
+
+    embedding_model = OnnxFeatureExtractor()
+
+    return embedding_model
+
+@cached(cache=LRUCache(maxsize=8), info=True)
+def create_segmentation_model():
+    logger.info(f"Creating segmentation model {segmentation_settings.model_path} with imgsz: {segmentation_settings.imgsz}, mask_resolution: {segmentation_settings.mask_resolution}, mode: {segmentation_settings.mode}")
+
+    return YOLO(segmentation_settings.model_path)
+
+@cached(cache=LRUCache(maxsize=8), info=True)
+def create_inference_client():
+    logger.info("Creating inference service client")
+
+    inference_client = InferenceClient()
+
+    # The vectors stored by this process must match the ones the service computes
+    if inference_client.segmentation_settings_id != get_segmentation_settings_id():
+        raise ValueError(f"The inference service segmentation settings '{inference_client.segmentation_settings_id}' differ from the local ones '{get_segmentation_settings_id()}'")
+
+    # The vectordb class is picked from the local configuration, vectors of another precision must never be written to it or searched in it
+    if inference_client.precision != get_embedding_precision():
+        raise ValueError(f"The inference service model '{inference_client.model_id}' has precision '{inference_client.precision}', but the local EMBEDDING_MODEL_NAME configures '{get_embedding_precision()}', set the same EMBEDDING_MODEL_NAME on both")
+
+    return inference_client
+
+def get_embedding_model_id(embedding_model) -> str:
+    # SentenceTransformer models have no model_id, fall back to the configured model name
+    if hasattr(embedding_model, "model_id"):
+        return embedding_model.model_id
+
+    return f"{type(embedding_model).__name__}:{os.environ.get('SENTENCE_TRANSFORMER_EMBEDDING_MODEL_NAME', 'clip-ViT-B-32')}"
+
+def get_embedding_precision(embedding_model=None) -> str:
+    """
+    Return the precision of an embedding model, or of the configured embedding model without loading it when none is given.
+    """
+    if embedding_model is not None:
+        return getattr(embedding_model, "precision", "fp32")
+
+    if os.environ.get('EMBEDDING_MODEL_NAME', "dino") == "dino-int8":
+        return f"int8-{DINO_QUANTIZATION_MODE}"
+
+    return "fp32"
+
+def get_embedding_identity(embedding_model) -> str:
+    """
+    Identify the whole query/document embedding pipeline: the embedding model and the segmentation settings applied before it.
+    Vectors computed under different identities must not be mixed.
+    """
+    if isinstance(embedding_model, InferenceClient):
+        return embedding_model.identity
+
+    return f"{get_embedding_model_id(embedding_model)}|{get_segmentation_settings_id()}"
+
+def to_embedding_inputs(masked_images, embedding_model):
+    # The DINO extractors take the segmentation arrays as is, the other models expect PIL images
+    if isinstance(embedding_model, FeatureExtractor):
+        return masked_images
+
+    return [Image.fromarray(masked_image) for masked_image in masked_images]
+
+def segment_images(pil_images, image_segmentation_model):
+    # Remove the background from the images with a single segmentation call
+    with segmentation_model_lock:
+        return process_pil_images_YOLO(pil_images=pil_images, image_segmentation_model=image_segmentation_model)
+
+def encode_images(masked_images, embedding_model):
+    inputs = to_embedding_inputs(masked_images, embedding_model)
+    with embedding_model_lock:
+        return embedding_model.encode(inputs)
 
 @timeit
 def embed_documents(documents, embedding_model, image_segmentation_model):
     logger.info(f"Embedding documents {len(documents)} documents: '{documents}'")
 
+    if isinstance(embedding_model, InferenceClient):
+        return embedding_model.embed_documents(documents)
+
     # Remove background from images
     # masked_documents = [process_pil_image(pil_image=document, image_segmentation_model=image_segmentation_model) for document in documents]
-    masked_documents = [process_pil_image_YOLO(pil_image=document, image_segmentation_model=image_segmentation_model) for document in documents]
+    masked_documents = segment_images(documents, image_segmentation_model)
     
     # Embed the documents
-    documents_embedding = embedding_model.encode(masked_documents)
+    documents_embedding = encode_images(masked_documents, embedding_model)
     logger.info(f"Documents embedding: {documents_embedding} Dimensions: [{len(documents_embedding)},{len(documents_embedding[0])}]")
 
     return documents_embedding
@@ -59,11 +171,73 @@ def embed_documents(documents, embedding_model, image_segmentation_model):
 def embed_query(query_image, embedding_model, image_segmentation_model):
     logger.info(f"Embedding query: '{query_image}'")
 
+    if isinstance(embedding_model, InferenceClient):
+        return embedding_model.embed_queries([query_image])[0]
+
     # masked_query_image = process_pil_image(pil_image=query_image, image_segmentation_model=image_segmentation_model)
-    masked_query_image = process_pil_image_YOLO(pil_image=query_image, image_segmentation_model=image_segmentation_model)
+    masked_query_image = segment_images([query_image], image_segmentation_model)[0]
 
     # Embed the query
-    query_embedding = embedding_model.encode(masked_query_image)
+    query_embedding = encode_images([masked_query_image], embedding_model)[0]
     logger.info(f"Query embedding: {query_embedding} Dimensions: [{len(query_embedding)}]")
 
-    return query_embedding
\ No newline at end of file
+    return query_embedding
+
+@timeit
+def embed_queries(query_images, embedding_model, image_segmentation_model):
+    logger.info(f"Embedding {len(query_images)} queries")
+
+    if isinstance(embedding_model, InferenceClient):
+        return embedding_model.embed_queries(query_images)
+
+    # Remove the background from all the query images with a single segmentation call
+    masked_query_images = segment_images(query_images, image_segmentation_model)
+
+    # Embed the queries in one batch
+    queries_embedding = encode_images(masked_query_images, embedding_model)
+    logger.info(f"Queries embedding Dimensions: [{len(queries_embedding)},{len(queries_embedding[0]) if queries_embedding else 0}]")
+
+    return queries_embedding
+
+@timeit
+def warm_up_models(embedding_model, image_segmentation_model, count: int = MODEL_WARMUP_IMAGES):
+    """
+    Run the query pipeline over synthetic images so the first real request does not pay for the lazy kernel initialization.
+    """
+    if count <= 0:
+        return
+
+    rng = np.random.default_rng(0)
+    synthetic_images = [Image.fromarray(rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)) for _ in range(count)]
+
+    embed_queries(query_images=synthetic_images, embedding_model=embedding_model, image_segmentation_model=image_segmentation_model)
+
+def share_module_memory(module) -> None:
+    # Move the weights to shared memory so the forked workers map the same pages instead of copying them on write
+    module.eval()
+    module.share_memory()
+
+def preload_models():
+    """
+    Load the embedding and segmentation models in a master process before it forks its workers (see app/gunicorn_conf.py).
+    The workers get the same objects from the model factory caches.
+
+    The ONNX Runtime session starts its thread pool when it is created (and exports the model with a forward pass on first use),
+    and the int8 quantization runs torch kernels, so those embedding models are left to each worker: a forked worker would
+    inherit dead thread pools.
+    """
+    embedding_model_name = os.environ.get('EMBEDDING_MODEL_NAME', "dino")
+    if embedding_model_name in FORK_SAFE_EMBEDDING_MODELS:
+        embedding_model, _ = create_embedding_model()
+        if hasattr(embedding_model, "dino"):
+            share_module_memory(embedding_model.dino)
+    else:
+        logger.info(f"Not preloading the '{embedding_model_name}' embedding model, each worker loads its own after the fork")
+
+    image_segmentation_model = create_segmentation_model()
+
+    # YOLO fuses its layers on the first prediction, fuse them once here so the workers never rewrite the weights
+    image_segmentation_model.fuse()
+    share_module_memory(image_segmentation_model.model)
+
+    logger.info(f"Preloaded the models in process {os.getpid()}")
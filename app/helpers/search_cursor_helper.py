@@ -0,0 +1,100 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+import zlib
+from typing import Tuple
+import numpy as np
+from app.MyLogger import logger
+
+SEARCH_CURSOR_TTL_SECONDS = float(os.environ.get("SEARCH_CURSOR_TTL_SECONDS", 15 * 60))
+# The key the cursors are signed with, every worker of a deployment must share it
+SEARCH_CURSOR_SECRET = os.environ.get("SEARCH_CURSOR_SECRET")
+
+SEARCH_CURSOR_VERSION = 1
+
+class ExpiredCursorError(ValueError):
+    pass
+
+class SearchCursorCodec:
+    def __init__(self, secret: bytes, ttl_seconds: float = SEARCH_CURSOR_TTL_SECONDS) -> None:
+        """
+        Self-contained cursors of paginated searches: the query embedding and the filter of a search travel in the
+        signed cursor itself, so the next pages are queried by any worker without decoding nor embedding the query image again.
+
+        Args:
+            secret (bytes): The HMAC key of the cursors.
+            ttl_seconds (float, optional): How long a cursor can be used, every page issues a cursor valid for another TTL. Defaults to SEARCH_CURSOR_TTL_SECONDS.
+        """
+        self.secret = secret
+        self.ttl_seconds = ttl_seconds
+
+    def encode(self, search: dict, offset: int) -> str:
+        """
+        Encode the cursor of a page of a search.
+
+        Args:
+            search (dict): The dog type, query_embedding, class_name, filter, properties, top, search mode and aggregate of the search.
+            offset (int): The number of results of the previous pages.
+
+        Returns:
+            str: The URL-safe cursor.
+        """
+        state = dict(search, query_embedding=base64.b64encode(np.asarray(search["query_embedding"], dtype=np.float32).tobytes()).decode())
+        payload = {
+            "version": SEARCH_CURSOR_VERSION,
+            "expires_at": time.time() + self.ttl_seconds,
+            "offset": offset,
+            "search": state,
+        }
+        body = base64.urlsafe_b64encode(zlib.compress(json.dumps(payload, separators=(",", ":")).encode())).decode().rstrip("=")
+
+        return f"{body}.{self._sign(body)}"
+
+    def decode(self, cursor: str) -> Tuple[dict, int]:
+        """
+        Decode a cursor into its search and the offset of its page.
+
+        Raises:
+            ExpiredCursorError: If the cursor expired.
+            ValueError: If the cursor is malformed or was not signed with the secret.
+        """
+        body, _, signature = cursor.partition(".")
+        # Compared as bytes, compare_digest refuses non-ASCII strings
+        if not hmac.compare_digest(signature.encode(), self._sign(body).encode()):
+            raise ValueError("Malformed search cursor")
+
+        try:
+            payload = json.loads(zlib.decompress(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))))
+            search = payload["search"]
+            search["query_embedding"] = np.frombuffer(base64.b64decode(search["query_embedding"]), dtype=np.float32).tolist()
+        except (binascii.Error, zlib.error, UnicodeDecodeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Malformed search cursor: {e}") from e
+
+        if payload.get("version") != SEARCH_CURSOR_VERSION:
+            raise ValueError(f"Search cursor version {payload.get('version')} is not supported")
+        if payload["expires_at"] < time.time():
+            raise ExpiredCursorError("The search cursor expired")
+
+        return search, payload["offset"]
+
+    def _sign(self, body: str) -> str:
+        return base64.urlsafe_b64encode(hmac.new(self.secret, body.encode(), hashlib.sha256).digest()[:16]).decode().rstrip("=")
+
+def create_search_cursor_codec() -> SearchCursorCodec:
+    if SEARCH_CURSOR_SECRET:
+        secret = SEARCH_CURSOR_SECRET.encode()
+    elif int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+        # Separately started workers would each sign with their own key and reject the cursors of the others
+        raise ValueError("SEARCH_CURSOR_SECRET must be set when running several workers, the search cursors are verified by whichever worker serves the next page")
+    else:
+        logger.warning("SEARCH_CURSOR_SECRET is not set, signing the search cursors with a random key that only this process knows")
+        secret = secrets.token_bytes(32)
+
+    logger.info(f"Creating search cursor codec with ttl_seconds: {SEARCH_CURSOR_TTL_SECONDS}")
+
+    return SearchCursorCodec(secret)
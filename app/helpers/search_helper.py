@@ -0,0 +1,200 @@
+import math
+import os
+from itertools import chain
+from typing import Any, Callable, Dict, List
+import numpy as np
+from app.MyLogger import logger
+
+# The adaptive over-fetch of a grouped search stops after these many rounds, or once a round asks for this many hits
+GROUPED_SEARCH_MAX_ROUNDS = int(os.environ.get("GROUPED_SEARCH_MAX_ROUNDS", 4))
+GROUPED_SEARCH_MAX_LIMIT = int(os.environ.get("GROUPED_SEARCH_MAX_LIMIT", 2000))
+
+GROUP_SCORE_AGGREGATES = ("max", "mean")
+
+# The group scores mean the same on every backend:
+# - the top groups are the groups with the best hits, ranked by their best hit (the max aggregate),
+# - each top group is scored over its best GROUP_SCORE_MAX_HITS hits above the certainty floor: maxScore,
+#   meanScore and matchedImages (the number of those hits),
+# - with the mean aggregate the top groups are then re-ranked by meanScore, it never brings in other groups.
+GROUP_SCORE_MAX_HITS = int(os.environ.get("GROUP_SCORE_MAX_HITS", 10))
+
+def group_hits(hits: List[dict], group_by: str, groups: int, aggregate: str = "max") -> List[dict]:
+    """
+    Group search hits by a property and score each group across its hits.
+
+    Args:
+        hits (List[dict]): The hits, sorted by score in descending order, as returned by IVectorDBClient.query.
+        group_by (str): The property to group by, e.g. dogId.
+        groups (int): The number of groups to return.
+        aggregate (str, optional): How the group score is computed from the scores of its hits, "max" or "mean". Defaults to "max".
+
+    Returns:
+        List[dict]: The best hit of each of the top groups, with "score" set to the group score, "maxScore", "meanScore" and "matchedImages" (the number of hits of the group).
+    """
+    if aggregate not in GROUP_SCORE_AGGREGATES:
+        raise ValueError(f"Unsupported group score aggregate '{aggregate}', expected one of {GROUP_SCORE_AGGREGATES}")
+
+    if len(hits) == 0:
+        return []
+
+    group_values = np.array([hit[group_by] for hit in hits])
+    scores = np.array([hit["score"] for hit in hits], dtype=np.float64)
+
+    top_groups = aggregate_group_scores(group_values, scores, groups, aggregate)
+
+    return [set_group_scores(dict(hits[best_hit]), *group_scores) for best_hit, *group_scores in top_groups]
+
+def aggregate_group_scores(group_values: np.ndarray, scores: np.ndarray, groups: int, aggregate: str = "max", max_hits: int = GROUP_SCORE_MAX_HITS) -> List[tuple]:
+    """
+    Score groups of hits with vectorized ops, see GROUP_SCORE_MAX_HITS for the meaning of the scores.
+
+    Args:
+        group_values (np.ndarray): The group of each hit.
+        scores (np.ndarray): The score of each hit, sorted in descending order.
+        groups (int): The number of groups to return.
+        aggregate (str, optional): "max" or "mean". Defaults to "max".
+        max_hits (int, optional): The number of best hits of a group its mean score is computed over. Defaults to GROUP_SCORE_MAX_HITS.
+
+    Returns:
+        List[tuple]: For each of the top groups, by group score: the index of its best hit, its group score, max score, mean score and number of scored hits.
+    """
+    # The hits are sorted by score, so the first hit of a group is its best one
+    _, first_hits, inverse, counts = np.unique(group_values, return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    max_scores = scores[first_hits]
+
+    # The top groups by their best hit, ties keep the order of the best hits
+    top_groups = np.lexsort((first_hits, -max_scores))[:groups]
+
+    # The rank of each hit in its group, a stable sort keeps the hits of a group in score order
+    by_group = np.argsort(inverse, kind="stable")
+    group_starts = np.cumsum(counts) - counts
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[by_group] = np.arange(len(scores)) - np.repeat(group_starts, counts)
+
+    scored = ranks < max_hits
+    scored_counts = np.minimum(counts, max_hits)
+    mean_scores = np.bincount(inverse[scored], weights=scores[scored], minlength=len(first_hits)) / scored_counts
+
+    if aggregate == "mean":
+        top_groups = top_groups[np.lexsort((first_hits[top_groups], -mean_scores[top_groups]))]
+
+    group_scores = max_scores if aggregate == "max" else mean_scores
+
+    return [(int(first_hits[group]), float(group_scores[group]), float(max_scores[group]), float(mean_scores[group]), int(scored_counts[group])) for group in top_groups]
+
+def set_group_scores(hit: dict, group_score: float, max_score: float, mean_score: float, count: int) -> dict:
+    hit["score"] = round(group_score, 4)
+    hit["maxScore"] = round(max_score, 4)
+    hit["meanScore"] = round(mean_score, 4)
+    hit["matchedImages"] = count
+
+    return hit
+
+def merge_group_results(group_results: List[List[dict]], group_by: str, groups: int) -> List[dict]:
+    """
+    Merge the grouped results of several query vectors of the same subject (e.g. the images of a dog) into one ranking.
+
+    Args:
+        group_results (List[List[dict]]): The results of IVectorDBClient.query_grouped of each query vector.
+        group_by (str): The property the results are grouped by, e.g. dogId.
+        groups (int): The number of groups to return.
+
+    Returns:
+        List[dict]: The top groups by their best score over the query vectors, with the fields of their best result
+        and "matchedQueryImages" set to the number of query vectors that matched the group.
+    """
+    hits = sorted(chain.from_iterable(group_results), key=lambda hit: hit["score"], reverse=True)
+    if len(hits) == 0:
+        return []
+
+    group_values = np.array([hit[group_by] for hit in hits])
+    scores = np.array([hit["score"] for hit in hits], dtype=np.float64)
+
+    # Each query vector has at most one hit per group, so every matching query vector is counted
+    merged = []
+    for best_hit, group_score, _, _, count in aggregate_group_scores(group_values, scores, groups, "max", max_hits=len(group_results)):
+        hit = dict(hits[best_hit])
+        hit["score"] = round(group_score, 4)
+        hit["matchedQueryImages"] = count
+        merged.append(hit)
+
+    return merged
+
+def get_filter_value_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "valueBoolean"
+    if isinstance(value, (int, np.integer)):
+        return "valueInt"
+    if isinstance(value, (float, np.floating)):
+        return "valueNumber"
+
+    return "valueText"
+
+def restrict_filter_to_groups(filter: Dict[str, Any], group_by: str, group_values: List[Any]) -> Dict[str, Any]:
+    """
+    Narrow a where filter down to the hits of some groups.
+    """
+    groups_filter = {
+        "operator": "Or",
+        "operands": [{ "path": [group_by], "operator": "Equal", get_filter_value_type(value): value } for value in group_values],
+    }
+    if not filter:
+        return groups_filter
+
+    return { "operator": "And", "operands": [filter, groups_filter] }
+
+def query_grouped_by_overfetch(query: Callable[..., List[dict]], group_by: str, groups: int, aggregate: str = "max", max_rounds: int = GROUPED_SEARCH_MAX_ROUNDS, max_limit: int = GROUPED_SEARCH_MAX_LIMIT, **query_kwargs: Any) -> List[dict]:
+    """
+    Collect the top groups of a backend without server-side grouping: query for more hits in rounds until the hits
+    hold enough distinct groups, or the backend runs out of hits above the certainty floor. Then query the hits of
+    the top groups only, so their scores cover the same hits as on the other backends (see GROUP_SCORE_MAX_HITS).
+
+    Args:
+        query (Callable[..., List[dict]]): The IVectorDBClient.query of the backend.
+        group_by (str): The property to group by, e.g. dogId.
+        groups (int): The number of groups to collect.
+        aggregate (str, optional): "max" or "mean", see group_hits. Defaults to "max".
+        max_rounds (int, optional): The maximum number of queries. Defaults to GROUPED_SEARCH_MAX_ROUNDS.
+        max_limit (int, optional): The maximum number of hits of a query. Defaults to GROUPED_SEARCH_MAX_LIMIT.
+        query_kwargs: The class_name, query_embedding, filter, certainty and properties of the query.
+
+    Returns:
+        List[dict]: The top groups, see group_hits.
+
+    The groups are collected by their best hit, so the returned groups are the exact top groups by max score.
+    The scores of a group are exact as long as the top groups hold at most max_limit hits.
+    """
+    properties = query_kwargs.get("properties")
+    if properties is not None and group_by not in properties:
+        query_kwargs["properties"] = properties + [group_by]
+
+    limit = min(2 * groups, max_limit)
+    hits = []
+    for round_index in range(max_rounds):
+        hits = query(limit=limit, offset=None, **query_kwargs)
+        distinct_groups = len(np.unique([hit[group_by] for hit in hits])) if hits else 0
+
+        # Enough groups, or no more hits above the certainty floor
+        if distinct_groups >= groups or len(hits) < limit or limit >= max_limit:
+            break
+
+        # Fetch enough hits for the observed number of hits per group, at least twice as many
+        hits_per_group = len(hits) / max(distinct_groups, 1)
+        limit = min(max(2 * limit, math.ceil(1.5 * groups * hits_per_group)), max_limit)
+        logger.info(f"Grouped search round {round_index + 1}: {distinct_groups} of {groups} groups in {len(hits)} hits, fetching {limit} hits")
+
+    if len(hits) == 0:
+        return []
+
+    # The hits of the rounds only hold the best hits of some groups, fetch all the hits of the top groups
+    top_group_values = [hits[best_hit][group_by] for best_hit, *_ in aggregate_group_scores(np.array([hit[group_by] for hit in hits]), np.array([hit["score"] for hit in hits], dtype=np.float64), groups)]
+    group_filter = restrict_filter_to_groups(query_kwargs.pop("filter", None), group_by, top_group_values)
+    group_hits_by_id = { hit["_additional"]["id"]: hit for hit in query(limit=max_limit, offset=None, filter=group_filter, **query_kwargs) }
+
+    # Keep the best hits of the rounds in case the top groups hold more than max_limit hits
+    for hit in hits:
+        group_hits_by_id.setdefault(hit["_additional"]["id"], hit)
+    hits = sorted(group_hits_by_id.values(), key=lambda hit: hit["score"], reverse=True)
+
+    return group_hits(hits, group_by, groups, aggregate)
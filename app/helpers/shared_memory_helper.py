@@ -0,0 +1,56 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple
+import numpy as np
+from app.model_optimization.preprocessing import to_rgb_array
+
+# Every image starts on a cache line boundary
+ALIGNMENT = 64
+
+def write_images_to_shared_memory(images) -> Tuple[SharedMemory, List[dict]]:
+    """
+    Decode images into a single shared memory block, so they can be handed to another process without pickling the pixels.
+
+    Args:
+        images (list): PIL images or uint8 RGB arrays.
+
+    Returns:
+        Tuple[SharedMemory, List[dict]]: The shared memory block, owned by the caller who must close and unlink it,
+        and the offset and shape of every image in the block.
+    """
+    arrays = [to_rgb_array(image) for image in images]
+
+    image_refs = []
+    size = 0
+    for array in arrays:
+        image_refs.append({ "offset": size, "shape": array.shape })
+        size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    shm = SharedMemory(create=True, size=max(size, 1))
+    for array, image_ref in zip(arrays, image_refs):
+        np.copyto(np.ndarray(image_ref["shape"], dtype=np.uint8, buffer=shm.buf, offset=image_ref["offset"]), array)
+
+    return shm, image_refs
+
+def attach_images_from_shared_memory(name: str, image_refs: List[dict]) -> Tuple[SharedMemory, List[np.ndarray]]:
+    """
+    Map the images written by write_images_to_shared_memory in another process, without copying them.
+
+    Args:
+        name (str): The name of the shared memory block.
+        image_refs (List[dict]): The offset and shape of every image in the block.
+
+    Returns:
+        Tuple[SharedMemory, List[numpy.ndarray]]: The attached block, to close once the views are no longer used, and a read-only view per image.
+    """
+    shm = SharedMemory(name=name)
+    # The block belongs to the writer, don't let the resource tracker of this process unlink it on exit
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+    views = []
+    for image_ref in image_refs:
+        view = np.ndarray(tuple(image_ref["shape"]), dtype=np.uint8, buffer=shm.buf, offset=image_ref["offset"])
+        view.flags.writeable = False
+        views.append(view)
+
+    return shm, views
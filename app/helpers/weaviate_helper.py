@@ -8,3 +8,45 @@ class FilterValueTypes(Enum):
     valueDate = "valueDate"
     valueBoolean = "valueBoolean"
     valueGeoRange = "valueGeoRange"
+
+
+DOG_CLASS_NAME = "Dog"
+
+def get_dog_class_name(precision: str = "fp32") -> str:
+    """
+    Return the vectordb class holding the dog image vectors of an embedding precision.
+    Vectors of different precisions live in separate classes so a query is never compared with vectors of another precision.
+    """
+    if precision == "fp32":
+        return DOG_CLASS_NAME
+
+    # e.g. int8-dynamic -> DogInt8Dynamic
+    return DOG_CLASS_NAME + "".join(part.capitalize() for part in precision.replace("_", "-").split("-"))
+
+
+def get_dog_partition_class_name(class_name: str, dog_type: str, is_resolved: bool) -> str:
+    """
+    Return the vectordb class of a partition of the dog image vectors, one partition per dog type and resolution state.
+    Searches only look at the active dogs of one type, so they go straight to a single partition instead of filtering the whole class.
+
+    e.g. Dog, lost, False -> DogLostActive
+    """
+    dog_type = dog_type.value if isinstance(dog_type, Enum) else dog_type
+
+    return f"{class_name}{dog_type.capitalize()}{'Resolved' if is_resolved else 'Active'}"
+
+
+def get_dog_profile_class_name(class_name: str) -> str:
+    """
+    Return the vectordb class holding the per-dog profile vectors (centroid or medoids) of a class of dog image vectors.
+
+    e.g. DogLostActive -> DogLostActiveProfile
+    """
+    return f"{class_name}Profile"
+
+
+def is_dog_profile_class_name(class_name: str) -> bool:
+    """
+    Return whether a vectordb class holds per-dog profile vectors, see get_dog_profile_class_name.
+    """
+    return class_name.endswith("Profile")
@@ -5,6 +5,7 @@ from pydantic_settings import BaseSettings
 
 from app.MyLogger import logger
 from app.routers.dogfinder import router as dogfinder_router
+from app.routers.health import router as health_router
 import os
 
 
@@ -29,6 +30,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.include_router(health_router)
+
 # if there is environment variable named modules and it contains the string "dogfinder", then load the dogfinder router
 if "dogfinder" in os.environ.get("AI_MODULES", ""):
     app.include_router(dogfinder_router)
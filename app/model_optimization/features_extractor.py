@@ -1,63 +1,131 @@
-from typing import List
+import os
+from typing import List, Union
 from PIL import Image
+import numpy as np
 import torch
 import torchvision.transforms as transforms
+from app.model_optimization.preprocessing import BatchPreprocessor
+
+# Maximum number of images that are stacked into a single forward pass
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+# INT8 quantization mode of the quantized extractor
+DINO_QUANTIZATION_MODE = os.environ.get("DINO_QUANTIZATION_MODE", "dynamic")
+
+def load_dino_model():
+    # Load the DINO model
+    try:
+        return torch.hub.load("facebookresearch/dinov2", "dinov2_vitb14")
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        exit(1)
+
+def create_image_transforms():
+    # The original per-image PIL/torchvision pipeline, kept as the reference of the BatchPreprocessor
+    return transforms.Compose(
+        [
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+    )
 
 class FeatureExtractor:
-    def __init__(self):
+    # Identifies the vectors produced by this extractor, bump the version whenever the output changes
+    model_name = "dinov2_vitb14"
+    model_version = 2
+    precision = "fp32"
+    embedding_dim = 768
+
+    def __init__(self, batch_size: int = EMBEDDING_BATCH_SIZE):
         # Set the device to GPU if available
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = max(1, batch_size)
 
-        # Load the DINO model
-        try:
-            self.dino = torch.hub.load("facebookresearch/dinov2", "dinov2_vitb14")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            exit(1)
-
+        self.dino = load_dino_model()
         self.dino.to(self.device)
         self.dino.eval()
 
-        # Define the image transformations
-        self.image_transforms = transforms.Compose(
-            [
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            ]
-        )
+        self.preprocessor = BatchPreprocessor(self.batch_size)
 
-    from typing import Union
+    @property
+    def model_id(self) -> str:
+        return f"{self.model_name}:{self.precision}:v{self.model_version}"
 
-    def encode(self, pil_images: Union[Image.Image, List[Image.Image]]):
+    def encode(self, pil_images: Union[Image.Image, np.ndarray, List[Union[Image.Image, np.ndarray]]]):
         """
-        Extract features from a PIL image or a list of PIL images using the DINO model.
+        Extract features from an image or a list of images using the DINO model.
 
         Args:
-        pil_images (Union[PIL.Image, List[PIL.Image]]): A PIL image or a list of PIL images.
+        pil_images (Union[PIL.Image, numpy.ndarray, List[Union[PIL.Image, numpy.ndarray]]]): A PIL image or a uint8 RGB array, or a list of them.
 
         Returns:
-        List[torch.Tensor]: Extracted feature tensors.
-        """
-        if isinstance(pil_images, Image.Image):
-            pil_images_list = [pil_images]
-        else:
-            pil_images_list = pil_images
-
-        features_list = []
-        for pil_image in pil_images_list:
-            image = pil_image.convert("RGB")
-            image_tensor = self.image_transforms(image).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                features = self.dino(image_tensor).float()
-
-            # Free GPU memory if used
-            if self.device.type == 'cuda':
-                torch.cuda.empty_cache()
-
-            features_list.append(features[0].tolist())
-
-        if isinstance(pil_images, Image.Image):
-            return features_list[0]
-        else:
-            return features_list
+        Union[List[float], List[List[float]]]: The feature vector of a single image, or a list of feature vectors.
+        """
+        if isinstance(pil_images, (Image.Image, np.ndarray)):
+            return self.encode_batch([pil_images])[0].tolist()
+
+        return self.encode_batch(pil_images).tolist()
+
+    def encode_batch(self, pil_images: List[Union[Image.Image, np.ndarray]], batch_size: int = None) -> np.ndarray:
+        """
+        Extract features from a list of images, running the DINO model over stacked batches
+        instead of one forward pass per image.
+
+        Args:
+        pil_images (List[Union[PIL.Image, numpy.ndarray]]): The PIL images or uint8 RGB arrays to encode.
+        batch_size (int): Maximum number of images per forward pass. Defaults to the extractor batch size.
+
+        Returns:
+        numpy.ndarray: A contiguous float32 array of shape [N, 768], in input order.
+        """
+        # The preprocessing buffer bounds the batch size
+        batch_size = min(max(1, batch_size or self.batch_size), self.preprocessor.max_batch_size)
+        features = np.empty((len(pil_images), self.embedding_dim), dtype=np.float32)
+
+        with torch.inference_mode():
+            for start in range(0, len(pil_images), batch_size):
+                chunk = pil_images[start:start + batch_size]
+                features[start:start + len(chunk)] = self.forward(self.preprocess(chunk))
+
+        # Free GPU memory if used
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+        return features
+
+    def preprocess(self, pil_images: List[Union[Image.Image, np.ndarray]]) -> torch.Tensor:
+        """
+        Preprocess the images into a [N, 3, 224, 224] batch tensor sharing the memory of the preprocessing buffer.
+        """
+        return torch.from_numpy(self.preprocessor(pil_images))
+
+    def forward(self, image_tensors: torch.Tensor) -> np.ndarray:
+        """
+        Run the model over a preprocessed batch and return the [N, 768] float32 features.
+        """
+        return self.dino(image_tensors.to(self.device)).float().cpu().numpy()
+
+class QuantizedFeatureExtractor(FeatureExtractor):
+    def __init__(self, batch_size: int = EMBEDDING_BATCH_SIZE, quantization_mode: str = DINO_QUANTIZATION_MODE):
+        """
+        DINO feature extractor with INT8 linear layers, for CPU-only deployments.
+
+        Only dynamic quantization is supported: the weights of every nn.Linear are quantized ahead of time and the
+        activations are quantized on the fly, so no calibration data is needed.
+
+        Args:
+            batch_size (int, optional): Maximum number of images per forward pass. Defaults to EMBEDDING_BATCH_SIZE.
+            quantization_mode (str, optional): The quantization mode, only "dynamic" is supported. Defaults to DINO_QUANTIZATION_MODE.
+        """
+        if quantization_mode != "dynamic":
+            raise ValueError(f"Unsupported DINO_QUANTIZATION_MODE '{quantization_mode}', only 'dynamic' is supported")
+
+        super().__init__(batch_size)
+
+        # The quantized kernels only run on the CPU
+        self.device = torch.device("cpu")
+        self.dino = torch.ao.quantization.quantize_dynamic(self.dino.to(self.device), {torch.nn.Linear}, dtype=torch.qint8)
+        self.dino.eval()
+
+        # The precision is part of the model id, so int8 vectors are never mixed with fp32 ones
+        self.precision = f"int8-{quantization_mode}"
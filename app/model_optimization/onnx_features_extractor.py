@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import onnxruntime as ort
+import torch
+from app.MyLogger import logger
+from app.model_optimization.features_extractor import EMBEDDING_BATCH_SIZE, FeatureExtractor, load_dino_model
+from app.model_optimization.preprocessing import BatchPreprocessor
+
+# Where the exported model is cached, the export only happens when the file is missing
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH", "app/model_optimization/dinov2_vitb14.onnx")
+# 0 lets ONNX Runtime pick the number of physical cores
+ONNX_INTRA_OP_NUM_THREADS = int(os.environ.get("ONNX_INTRA_OP_NUM_THREADS", 0))
+ONNX_OPSET_VERSION = 17
+
+def export_dino_to_onnx(model_path: str = ONNX_MODEL_PATH) -> str:
+    """
+    Export the DINO backbone to ONNX with a dynamic batch dimension.
+
+    Args:
+        model_path (str, optional): The path of the exported model. Defaults to ONNX_MODEL_PATH.
+
+    Returns:
+        str: The path of the exported model.
+    """
+    logger.info(f"Exporting the DINO model to ONNX at {model_path}")
+
+    dino = load_dino_model()
+    dino.eval()
+
+    model_dir = os.path.dirname(model_path)
+    if model_dir:
+        os.makedirs(model_dir, exist_ok=True)
+
+    # Export to a temporary file first so a crashed export never leaves a truncated model behind
+    tmp_path = f"{model_path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            dino,
+            torch.randn(1, 3, 224, 224),
+            tmp_path,
+            input_names=["pixel_values"],
+            output_names=["embedding"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embedding": {0: "batch"}},
+            opset_version=ONNX_OPSET_VERSION,
+            do_constant_folding=True,
+        )
+    os.replace(tmp_path, model_path)
+
+    logger.info(f"Exported the DINO model to ONNX at {model_path}")
+
+    return model_path
+
+class OnnxFeatureExtractor(FeatureExtractor):
+    def __init__(self, batch_size: int = EMBEDDING_BATCH_SIZE, model_path: str = ONNX_MODEL_PATH, intra_op_num_threads: int = ONNX_INTRA_OP_NUM_THREADS):
+        """
+        DINO feature extractor served by ONNX Runtime on the CPU. The vectors match the PyTorch FeatureExtractor,
+        so both backends share the same model id.
+
+        Args:
+            batch_size (int, optional): Maximum number of images per forward pass. Defaults to EMBEDDING_BATCH_SIZE.
+            model_path (str, optional): The path of the exported model, exported on first use. Defaults to ONNX_MODEL_PATH.
+            intra_op_num_threads (int, optional): The number of threads used by a single inference, 0 for the default. Defaults to ONNX_INTRA_OP_NUM_THREADS.
+        """
+        self.device = torch.device("cpu")
+        self.batch_size = max(1, batch_size)
+        self.preprocessor = BatchPreprocessor(self.batch_size)
+
+        if not os.path.exists(model_path):
+            export_dino_to_onnx(model_path)
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = intra_op_num_threads
+
+        self.session = ort.InferenceSession(model_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        logger.info(f"Loaded the ONNX DINO model from {model_path} with intra_op_num_threads: {intra_op_num_threads}")
+
+    def forward(self, image_tensors: torch.Tensor) -> np.ndarray:
+        return self.session.run(None, {self.input_name: image_tensors.numpy()})[0].astype(np.float32, copy=False)
@@ -0,0 +1,106 @@
+import threading
+from typing import List, Union
+import cv2
+import numpy as np
+from PIL import Image
+
+# Input resolution and ImageNet normalization of the DINO model
+IMAGE_SIZE = 224
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def create_normalization_tables(mean=IMAGENET_MEAN, std=IMAGENET_STD) -> np.ndarray:
+    """
+    Precompute the normalized float32 value of every uint8 intensity for each channel,
+    so scaling to [0, 1] and the mean/std normalization become a single table lookup.
+
+    Returns:
+    numpy.ndarray: A [3, 256] float32 lookup table.
+    """
+    intensities = np.arange(256, dtype=np.float32) / 255.0
+    return np.stack([(intensities - m) / s for m, s in zip(mean, std)]).astype(np.float32)
+
+def to_rgb_array(image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """
+    Return a HxWx3 uint8 RGB array of an image, without copying when the image already is one.
+
+    Args:
+    image (Union[PIL.Image.Image, numpy.ndarray]): A PIL image, or a uint8 RGB (HxWx3), RGBA (HxWx4) or grayscale (HxW) array.
+
+    Returns:
+    numpy.ndarray: The HxWx3 uint8 RGB array.
+    """
+    if isinstance(image, Image.Image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image)
+
+    if image.dtype != np.uint8:
+        raise ValueError(f"Expected a uint8 image array, got {image.dtype}")
+
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+    if image.ndim == 3 and image.shape[2] == 3:
+        return image
+
+    raise ValueError(f"Unsupported image array shape {image.shape}")
+
+class BatchPreprocessor:
+    def __init__(self, max_batch_size: int, image_size: int = IMAGE_SIZE, mean=IMAGENET_MEAN, std=IMAGENET_STD) -> None:
+        """
+        Turn uint8 images into the normalized NCHW float32 batch of the DINO model.
+
+        Every image is resized with cv2, then normalized and transposed to CHW in a single table lookup
+        written straight into a preallocated batch buffer, so no per-image tensors are allocated.
+
+        Args:
+        max_batch_size (int): The largest batch the buffer holds.
+        image_size (int, optional): The square input resolution. Defaults to IMAGE_SIZE.
+        mean (tuple, optional): The per-channel mean. Defaults to IMAGENET_MEAN.
+        std (tuple, optional): The per-channel standard deviation. Defaults to IMAGENET_STD.
+        """
+        self.max_batch_size = max(1, max_batch_size)
+        self.image_size = image_size
+        self.tables = create_normalization_tables(mean, std)
+
+        # Every thread gets its own buffers, the extractor is shared by the inference pool
+        self._local = threading.local()
+
+    def __call__(self, images: List[Union[Image.Image, np.ndarray]]) -> np.ndarray:
+        """
+        Preprocess a list of images.
+
+        Args:
+        images (List[Union[PIL.Image.Image, numpy.ndarray]]): At most max_batch_size PIL images or uint8 arrays.
+
+        Returns:
+        numpy.ndarray: A [N, 3, image_size, image_size] float32 view on the buffer, valid until the next call on the same thread.
+        """
+        if len(images) > self.max_batch_size:
+            raise ValueError(f"Got {len(images)} images, the batch buffer holds {self.max_batch_size}")
+
+        batch, resized = self._buffers()
+        size = (self.image_size, self.image_size)
+
+        for i, image in enumerate(images):
+            rgb = to_rgb_array(image)
+            if rgb.shape[:2] == size:
+                resized[...] = rgb
+            else:
+                # INTER_AREA when shrinking matches the antialiased PIL resize used by torchvision
+                interpolation = cv2.INTER_AREA if rgb.shape[0] > self.image_size or rgb.shape[1] > self.image_size else cv2.INTER_LINEAR
+                cv2.resize(rgb, size, dst=resized, interpolation=interpolation)
+
+            for channel in range(3):
+                np.take(self.tables[channel], resized[:, :, channel], out=batch[i, channel])
+
+        return batch[:len(images)]
+
+    def _buffers(self):
+        if getattr(self._local, "batch", None) is None:
+            self._local.batch = np.empty((self.max_batch_size, 3, self.image_size, self.image_size), dtype=np.float32)
+            self._local.resized = np.empty((self.image_size, self.image_size, 3), dtype=np.uint8)
+
+        return self._local.batch, self._local.resized
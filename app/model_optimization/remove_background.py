@@ -1,11 +1,56 @@
 # Import packages
+import os
+from typing import Literal
 import cv2
 import numpy as np
 from PIL import Image
+from pydantic_settings import BaseSettings, SettingsConfigDict
 import torch
+from ultralytics.utils.ops import scale_image
 from app.MyLogger import logger
-from app.helpers.image_helper import convert_image_to_webp, convert_pil_image_to_webp
+from app.model_optimization.preprocessing import to_rgb_array
 
+# COCO class of the dogs
+DOG_CLASS = 16
+
+class SegmentationSettings(BaseSettings):
+    """
+    Settings of the YOLO background removal, read from the SEGMENTATION_* environment variables.
+    """
+    model_config = SettingsConfigDict(env_prefix="SEGMENTATION_", protected_namespaces=())
+
+    # YOLOv8 segmentation model size, from the fastest (n) to the most accurate (x)
+    model_size: Literal["n", "s", "m", "l", "x"] = "x"
+    model_dir: str = "app/model_optimization"
+    # Inference resolution of the longest image side
+    imgsz: int = 640
+    # "retina" computes the masks at the image resolution, "model" computes them at imgsz and resizes them
+    mask_resolution: Literal["retina", "model"] = "retina"
+    # "mask" keeps the dog pixels, "box" crops the image to the dog bounding boxes
+    mode: Literal["mask", "box"] = "mask"
+
+    @property
+    def model_name(self) -> str:
+        return f"yolov8{self.model_size}-seg"
+
+    @property
+    def model_path(self) -> str:
+        return os.path.join(self.model_dir, f"{self.model_name}.pt")
+
+    @property
+    def settings_id(self) -> str:
+        # Identifies the segmentation settings used before embedding, change it whenever the masked output changes
+        settings_id = f"{self.model_name}:classes={DOG_CLASS}"
+        if self.imgsz != 640:
+            settings_id += f":imgsz={self.imgsz}"
+        settings_id += ":box" if self.mode == "box" else f":{self.mask_resolution}_masks"
+
+        return f"{settings_id}:rgb"
+
+segmentation_settings = SegmentationSettings()
+
+def get_segmentation_settings_id():
+    return segmentation_settings.settings_id
 
 def find_largest_blob_among_masks(mask_list):
     """
@@ -21,17 +66,17 @@ def find_largest_blob_among_masks(mask_list):
     max_size = 0
 
     for boolean_mask in mask_list:
-        # Convert boolean mask to uint8
-        mask_uint8 = np.uint8(boolean_mask) * 255
-
-        # Find connected components
-        num_labels, labels_im = cv2.connectedComponents(mask_uint8)
+        # Find connected components, their sizes come with the labels in a single pass
+        num_labels, labels_im, stats, _ = cv2.connectedComponentsWithStats(np.uint8(boolean_mask))
+        if num_labels < 2:
+            continue
 
-        for i in range(1, num_labels):
-            size = np.sum(labels_im == i)
-            if size > max_size:
-                max_size = size
-                largest_blob_mask = (labels_im == i)
+        # Label 0 is the background
+        largest_label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        size = stats[largest_label, cv2.CC_STAT_AREA]
+        if size > max_size:
+            max_size = size
+            largest_blob_mask = (labels_im == largest_label)
 
     # Handle case where no blobs were found
     if largest_blob_mask is None:
@@ -52,34 +97,50 @@ def create_masked_image(pil_image, boolean_mask, background_color=(0, 0, 0)):
     Returns:
     PIL.Image.Image: The new PIL image with only the masked area.
     """
-    # Convert PIL image to NumPy array
-    image = np.array(pil_image)
+    image = to_rgb_array(pil_image)
 
     if image.shape[:2] != boolean_mask.shape:
         raise ValueError("The dimensions of the image and the mask must match")
 
-    # Convert boolean mask to uint8 binary mask
-    binary_mask = np.uint8(boolean_mask) * 255
+    # Convert back to PIL image
+    result_image = Image.fromarray(apply_mask(image, boolean_mask, background_color))
 
-    # Apply the mask to keep only the masked area
-    masked_area = cv2.bitwise_and(image, image, mask=binary_mask)
+    return result_image
 
-    # Create an inverse mask for the background
-    inverse_mask = cv2.bitwise_not(binary_mask)
+def apply_mask(image, boolean_mask, background_color=(0, 0, 0), out=None):
+    """
+    Keep the pixels of an image inside a mask and paint the rest with the background color, in a single pass.
 
-    # Create a background image with the specified color
-    background = np.full(image.shape, background_color, dtype=np.uint8)
+    Args:
+    image (numpy.ndarray): The HxWx3 uint8 image.
+    boolean_mask (numpy.ndarray): The HxW mask, non-zero inside the masked area.
+    background_color (tuple): The color for the background (outside the mask). Default is black.
+    out (numpy.ndarray, optional): The HxWx3 uint8 output buffer, may be the image itself. Defaults to a new array.
 
-    # Apply the inverse mask to the background image
-    background = cv2.bitwise_and(background, background, mask=inverse_mask)
+    Returns:
+    numpy.ndarray: The masked image.
+    """
+    if out is None:
+        out = np.empty_like(image)
 
-    # Combine the masked area and the background
-    combined_image = cv2.add(masked_area, background)
+    # A 0/1 uint8 view of the mask, without copying the boolean masks, other masks (e.g. 0/255) are normalised to 0/1
+    if boolean_mask.dtype == bool:
+        mask = boolean_mask.view(np.uint8)
+    else:
+        mask = (boolean_mask != 0).view(np.uint8)
 
-    # Convert back to PIL image
-    result_image = Image.fromarray(combined_image)
+    if tuple(background_color) == (0, 0, 0):
+        # Multiplying by the 0/1 mask zeroes the background without any temporary image
+        np.multiply(image, mask[..., None], out=out, casting="unsafe")
+    elif out is not image:
+        # Paint the background color, then copy the masked pixels over it
+        out[:] = background_color
+        cv2.copyTo(image, mask, out)
+    else:
+        # In place the image can't be painted first, only the background pixels are overwritten
+        out[mask == 0] = background_color
 
-    return result_image
+    return out
 
 def process_pil_image(pil_image, text_prompt="a dog", image_segmentation_model=None):
     """
@@ -103,44 +164,102 @@ def process_pil_image(pil_image, text_prompt="a dog", image_segmentation_model=N
     
     return masked_im
 
-def process_pil_image_YOLO(pil_image, image_segmentation_model):
-    # Run inference on the image
-    results = image_segmentation_model(pil_image, retina_masks=True, classes=16)  # Class 16 for dogs in COCO
-    for result in results:
-        if result.masks == None:
-            logger.info(f"No dogs detected in the image.")
-            return pil_image
-        
-        masks = result.masks.data  # get array results
-        boxes = result.boxes.data
-        clss = boxes[:, 5]  # extract classes
-        dog_indices = torch.where(clss == 16)  # indices of dog detections
-        dog_masks = masks[dog_indices]  # relevant masks for dogs
-        dog_mask = torch.any(dog_masks, dim=0).int() * 255  # combine masks
-        dog_mask = dog_mask.squeeze().cpu().numpy()
-        
-        image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        if image.shape[:2] != dog_mask.shape:
-            raise ValueError("The dimensions of the image and the mask must match")
-
-        # Convert dog_mask to uint8 binary mask
-        binary_mask = np.uint8(dog_mask)
-
-        # Apply the mask to keep only the masked area
-        masked_area = cv2.bitwise_and(image, image, mask=binary_mask)
-
-        # Create an inverse mask for the background
-        inverse_mask = cv2.bitwise_not(binary_mask)
-
-        # Create a background image with the specified color
-        background = np.full(image.shape, (0, 0, 0), dtype=np.uint8)
-
-        # Apply the inverse mask to the background image
-        background = cv2.bitwise_and(background, background, mask=inverse_mask)
-
-        # Combine the masked area and the background
-        combined_image = cv2.add(masked_area, background)
-        combined_image = Image.fromarray(cv2.cvtColor(combined_image, cv2.COLOR_BGR2RGB))
-        combined_image = convert_pil_image_to_webp(combined_image)
-        
-        return combined_image
+def process_pil_image_YOLO(pil_image, image_segmentation_model, settings: SegmentationSettings = None):
+    return process_pil_images_YOLO([pil_image], image_segmentation_model, settings)[0]
+
+def process_pil_images_YOLO(pil_images, image_segmentation_model, settings: SegmentationSettings = None):
+    """
+    Remove the background from a list of PIL images with a single YOLO inference call over the whole list.
+
+    Args:
+    pil_images (list of PIL.Image.Image or numpy.ndarray): The PIL images or uint8 RGB arrays to process.
+    image_segmentation_model (YOLO): The YOLO segmentation model.
+    settings (SegmentationSettings, optional): The segmentation settings. Defaults to the settings read from the environment.
+
+    Returns:
+    list of numpy.ndarray: The masked HxWx3 uint8 RGB images, in the same order as the input. Images without a detected dog are returned unmasked.
+    """
+    if len(pil_images) == 0:
+        return []
+
+    settings = settings or segmentation_settings
+
+    # Run inference on all the images at once, results are returned in input order
+    results = image_segmentation_model(
+        # YOLO reads numpy arrays as BGR, the channel flip is a view
+        [pil_image[..., ::-1] if isinstance(pil_image, np.ndarray) else pil_image for pil_image in pil_images],
+        retina_masks=settings.mode == "mask" and settings.mask_resolution == "retina",
+        imgsz=settings.imgsz,
+        classes=DOG_CLASS,
+    )
+
+    if settings.mode == "box":
+        return [crop_dogs_in_YOLO_result(pil_image, result) for pil_image, result in zip(pil_images, results)]
+
+    return [mask_dogs_in_YOLO_result(pil_image, result) for pil_image, result in zip(pil_images, results)]
+
+def crop_dogs_in_YOLO_result(pil_image, result):
+    """
+    Crop an image to the box enclosing all the dogs detected in a single YOLO result.
+
+    Args:
+    pil_image (PIL.Image.Image): The image the result was computed on.
+    result (ultralytics.engine.results.Results): The YOLO result of the image.
+
+    Returns:
+    numpy.ndarray: The cropped HxWx3 uint8 RGB image, or the original image if no dog was detected.
+    """
+    image = to_rgb_array(pil_image)
+
+    boxes = result.boxes.data
+    dog_boxes = boxes[boxes[:, 5] == DOG_CLASS][:, :4]
+    if len(dog_boxes) == 0:
+        logger.info(f"No dogs detected in the image.")
+        return image
+
+    # The boxes are in the original image coordinates
+    x1, y1 = dog_boxes[:, :2].min(dim=0).values.floor().int().tolist()
+    x2, y2 = dog_boxes[:, 2:4].max(dim=0).values.ceil().int().tolist()
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return image
+
+    return np.ascontiguousarray(image[y1:y2, x1:x2])
+
+def mask_dogs_in_YOLO_result(pil_image, result):
+    """
+    Keep only the dogs detected in a single YOLO result and black out the rest of the image.
+
+    Args:
+    pil_image (PIL.Image.Image): The image the result was computed on.
+    result (ultralytics.engine.results.Results): The YOLO result of the image.
+
+    Returns:
+    numpy.ndarray: The masked HxWx3 uint8 RGB image, or the original image if no dog was detected.
+    """
+    if result.masks == None:
+        logger.info(f"No dogs detected in the image.")
+        return to_rgb_array(pil_image)
+    
+    masks = result.masks.data  # get array results
+    boxes = result.boxes.data
+    clss = boxes[:, 5]  # extract classes
+    dog_indices = torch.where(clss == DOG_CLASS)  # indices of dog detections
+    dog_masks = masks[dog_indices]  # relevant masks for dogs
+    dog_mask = torch.any(dog_masks, dim=0)  # combine masks
+    dog_mask = dog_mask.squeeze().cpu().numpy()
+    
+    image = to_rgb_array(pil_image)
+    if dog_mask.shape != image.shape[:2]:
+        # Masks computed at the model resolution are letterboxed, remove the padding and resize them to the image
+        dog_mask = scale_image(np.uint8(dog_mask)[..., None], image.shape)[..., 0]
+
+    if image.shape[:2] != dog_mask.shape:
+        raise ValueError("The dimensions of the image and the mask must match")
+
+    # An image converted from another layout is ours, mask it in place instead of allocating the output
+    out = image if image is not pil_image and image.base is None and image.flags.writeable else None
+
+    # The masked image goes straight to the embedding model, it is never persisted so it is not re-encoded
+    return apply_mask(image, dog_mask, out=out)
@@ -1,33 +1,43 @@
 from http import HTTPStatus
 
 from app.DTO.dog_dto import DogDTO, DogImageDTO, DogType, PossibleDogMatchDTO
-from app.helpers.image_helper import create_pil_images, get_base64
+from app.helpers.image_helper import create_pil_images, get_base64, hash_image
 from app.services.auth import VerifyToken
 from typing import Any, List, Optional
 from app.MyLogger import logger
 from app.services.dog_service import DogWithImagesService
-from app.services.vectordb_indexer import VectorDBIndexer
+from app.services.inference_scheduler import QueryEmbeddingScheduler
+from app.services.component_registry import component_registry
+from app.exceptions.inference_exceptions import InferenceException
+from app.exceptions.search_exceptions import DogNotFoundException, InvalidSearchCursorException, NoStoredEmbeddingException, SearchCursorExpiredException, SearchException
+from app.services.vectordb_indexer import DOG_PROFILE_MODE, VECTORDB_PARTITIONED, VectorDBIndexer, get_dog_class_names
 from app.viewmodels.api_response import APIResponse
-from app.viewmodels.dog_viewmodel import RETURN_PROPERTIES, DogFullDetailsResponse, DogImageResponse, DogAddRequest, DogResolvedRequest, DogResponse, DogSearchRequest, PossibleDogMatchRequest, PossibleDogMatchResponse
+from app.viewmodels.dog_viewmodel import RETURN_PROPERTIES, DogFullDetailsResponse, DogImageResponse, DogAddRequest, DogResolvedRequest, DogResponse, DogSearchRequest, PossibleDogMatchRequest, PossibleDogMatchResponse, SimilarDogSearchRequest
+from app.viewmodels.data_types import GroupScore, SearchMode
 from fastapi import APIRouter, Query, Security, UploadFile
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from app.helpers.model_helper import create_embedding_model, embed_query
+from app.helpers.model_helper import INFERENCE_BACKEND, create_embedding_model, create_inference_client, create_segmentation_model, embed_queries, get_embedding_identity, get_embedding_precision, warm_up_models
+from app.helpers.embedding_cache import EmbeddingCache, create_embedding_cache
+from app.helpers.search_helper import merge_group_results
+from app.helpers.search_cursor_helper import ExpiredCursorError, SearchCursorCodec, create_search_cursor_codec
 from app.helpers.helper import timeit
+from app.helpers.executor_helper import INFERENCE_POOL_SIZE, inference_executor, run_in_indexing_pool, run_in_inference_pool, run_in_io_pool, shutdown_executors
 from app.helpers.image_helper import resize_and_convert
-from app.helpers.weaviate_helper import FilterValueTypes
+from app.helpers.weaviate_helper import DOG_CLASS_NAME, FilterValueTypes, get_dog_class_name, get_dog_profile_class_name, is_dog_profile_class_name
 from weaviate.util import generate_uuid5
 from app.models.predicates import Predicate, Filter, and_, or_
 # from sentence_transformers import SentenceTransformer
+import asyncio
 import os
 from app.services.ivectordb_client import IVectorDBClient
 from app.services.weaviate_vectordb_client import WeaviateVectorDBClient
+from app.services.local_vectordb_client import LocalVectorDBClient, require_single_process
 from automapper import mapper
 from app.DAL.database import Database, get_connection_string
 from app.DAL.repositories import DogWithImagesRepository
 # from lang_sam import LangSAM
-from ultralytics import YOLO
 
 logger.info("Starting up the dogfinder router")
 
@@ -35,13 +45,24 @@ router = APIRouter(prefix="/dogfinder")
 vecotrDBClient: IVectorDBClient
 dogWithImagesRepository: DogWithImagesRepository = None
 dogWithImagesService: DogWithImagesService = None
+vectorDBIndexer: VectorDBIndexer = None
 embedding_model: Any = None
 image_segmentation_model: Any = None
+queryEmbeddingScheduler: QueryEmbeddingScheduler = None
+embeddingCache: Optional[EmbeddingCache] = None
+# Signs the cursors of the paginated searches, which carry their query embedding and filter
+searchCursorCodec: SearchCursorCodec = None
+# The vectordb class of the dog image vectors, depends on the precision of the embedding model
+dogClassName: str = DOG_CLASS_NAME
 db: Database = None
 
 CERTAINTY = os.environ.get("CERTAINTY", 0.6355)
 logger.info(f"CERTAINTY: {CERTAINTY}")
 
+# "weaviate" or "local", the local backend keeps the vectors in process and is rebuilt from the database on startup
+VECTORDB_BACKEND = os.environ.get("VECTORDB_BACKEND", "weaviate")
+logger.info(f"VECTORDB_BACKEND: {VECTORDB_BACKEND}")
+
 # CHANGE THIS TO FALSE ON PRODUCTION
 IS_VERIFIED_FIELD_DEFAULT_VALUE = False
 
@@ -161,22 +182,41 @@ dog_class_definition = {
     }
 
 
+def get_dog_class_definition(class_name: str) -> dict:
+    if is_dog_profile_class_name(class_name):
+        # The profile vectors of a dog are numbered, its medoids
+        return {**dog_class_definition, "class": class_name, "properties": dog_class_definition["properties"] + [
+            {
+                "name": "profileIndex",
+                "dataType": ["int"],
+                "description": "Index of the profile vector of the dog"
+            }
+        ]}
+
+    return {**dog_class_definition, "class": class_name}
+
+
+# Components loaded in the background, the inference endpoints answer 503 until they are ready
+MODEL_COMPONENTS = ("embedding_model", "segmentation_model", "warmup")
+
 @router.on_event("startup")
 async def startup_event():
     """
-    Load all the necessary models and data once the server starts.
+    Connect to the database and the vectordb once the server starts, then load the models in the background
+    so the non-inference endpoints serve traffic while the models load.
     """
     global vecotrDBClient
     global dogWithImagesRepository
     global dogWithImagesService
-    global embedding_model
-    global image_segmentation_model
+    global vectorDBIndexer
+    global dogClassName
+    global searchCursorCodec
     global db
 
-    # Create the vector db client, connecting to the weaviate instance
-    vecotrDBClient = WeaviateVectorDBClient(url=f"{os.getenv('WEAVIATE_HOST', 'http://localhost:8080')}")
-    # Create the schema
-    vecotrDBClient.create_schema(class_name="Dog", class_obj=dog_class_definition)
+    for name in ("database", "vectordb", *MODEL_COMPONENTS):
+        component_registry.register(name)
+    if VECTORDB_BACKEND == "local":
+        component_registry.register("vectordb_index")
 
     # DB variables
     DB_USER = os.environ.get("DB_USER")
@@ -186,23 +226,97 @@ async def startup_event():
     DB_NAME = os.environ.get("DB_NAME", 'dogfinder')
     DB_PROTOCOL = os.environ.get("DB_PROTOCOL", "sqlite")
 
-    db_connection_string = get_connection_string(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, db=DB_NAME, protocol=DB_PROTOCOL)
-    db = Database(db_url=db_connection_string)
-    db.create_tables()
-    
-    # Create the embedding model
-    embedding_model, cache_info = create_embedding_model()
-    
-    # image_segmentation_model = LangSAM(sam_type="vit_b")    
-    image_segmentation_model = YOLO("app/model_optimization/yolov8x-seg.pt")  # Load pretrained YOLOv8x model):
+    def load_database():
+        db_connection_string = get_connection_string(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, db=DB_NAME, protocol=DB_PROTOCOL)
+        database = Database(db_url=db_connection_string)
+        database.create_tables()
+
+        return database
 
-    # Create vectordb indexer
-    vectorDBIndexer = VectorDBIndexer(vecotrDBClient, embedding_model, image_segmentation_model)
+    db = component_registry.load("database", load_database)
+
+    searchCursorCodec = create_search_cursor_codec()
+
+    def load_vectordb():
+        if VECTORDB_BACKEND == "local":
+            # Keep the vectors in process, no weaviate instance needed. uvicorn --workers defaults to WEB_CONCURRENCY
+            require_single_process(int(os.environ.get("WEB_CONCURRENCY", 1)))
+            client = LocalVectorDBClient()
+        elif VECTORDB_BACKEND == "weaviate":
+            # Create the vector db client, connecting to the weaviate instance
+            client = WeaviateVectorDBClient(url=f"{os.getenv('WEAVIATE_HOST', 'http://localhost:8080')}")
+        else:
+            raise ValueError(f"Unknown vectordb backend '{VECTORDB_BACKEND}', expected 'weaviate' or 'local'")
+        # Create the schema, vectors of each embedding precision are kept in their own class (or partitions of it)
+        for class_name in get_dog_class_names(dogClassName, VECTORDB_PARTITIONED, with_profiles=DOG_PROFILE_MODE != "none"):
+            client.create_schema(class_name=class_name, class_obj=get_dog_class_definition(class_name))
+
+        return client
+
+    # The class only depends on the configured precision, so the vectordb is usable before the model is loaded
+    dogClassName = get_dog_class_name(get_embedding_precision())
+    logger.info(f"Using vectordb class '{dogClassName}'")
+    vecotrDBClient = component_registry.load("vectordb", load_vectordb)
+
+    # Create vectordb indexer, it gets the models once they are loaded
+    vectorDBIndexer = VectorDBIndexer(vecotrDBClient, None, None, class_name=dogClassName)
 
     # Create the dogWithImagesRepository with the session_factory
     dogWithImagesRepository = DogWithImagesRepository(session_factory=db.session)
     dogWithImagesService = DogWithImagesService(dogWithImagesRepository, vectorDBIndexer)
 
+    # Load the models on the inference pool without blocking the startup
+    inference_executor.submit(load_models)
+
+def load_models():
+    """
+    Load the embedding and segmentation models, warm them up and wire them into the query pipeline.
+    """
+    global embedding_model
+    global image_segmentation_model
+    global queryEmbeddingScheduler
+    global embeddingCache
+
+    try:
+        if INFERENCE_BACKEND == "remote":
+            # The models live in the inference service, the client stands in for the embedding model
+            embedding_model = component_registry.load("embedding_model", create_inference_client)
+            image_segmentation_model = component_registry.load("segmentation_model", lambda: None)
+        else:
+            # Create the embedding model
+            embedding_model, cache_info = component_registry.load("embedding_model", create_embedding_model)
+
+            # image_segmentation_model = LangSAM(sam_type="vit_b")    
+            image_segmentation_model = component_registry.load("segmentation_model", create_segmentation_model)
+
+        # Cache query embeddings by image content, invalidated whenever the embedding pipeline changes
+        embeddingCache = create_embedding_cache()
+        if embeddingCache is not None:
+            embeddingCache.set_identity(get_embedding_identity(embedding_model))
+
+        # Gather concurrent search queries into micro-batches before embedding them
+        queryEmbeddingScheduler = QueryEmbeddingScheduler(
+            embed_batch=lambda query_images: embed_queries(query_images=query_images, embedding_model=embedding_model, image_segmentation_model=image_segmentation_model),
+            executor=inference_executor,
+            max_concurrent_batches=INFERENCE_POOL_SIZE,
+        )
+
+        vectorDBIndexer.set_models(embedding_model, image_segmentation_model)
+
+        # Pay for the lazy kernel initialization before reporting ready
+        component_registry.load("warmup", lambda: warm_up_models(embedding_model, image_segmentation_model))
+
+        # The local vectordb starts empty, index the dogs of the database into it
+        if VECTORDB_BACKEND == "local":
+            component_registry.load("vectordb_index", dogWithImagesService.index_all_dogs_with_images)
+    except Exception as e:
+        # The failure is reported by the readiness probe
+        logger.exception(f"Error while loading the models: {e}")
+
+@router.on_event("shutdown")
+async def shutdown_event():
+    shutdown_executors()
+
 
 auth = VerifyToken()
 
@@ -229,18 +343,20 @@ auth = VerifyToken()
 @router.post("/search_in_found_dogs", response_model=APIResponse)
 async def search_in_found_dogs(dogSearchRequest: DogSearchRequest):
     try:
-        # Handle the image, resize it and convert it to base64 with webp format and get the content type
-        base64Images, imageContentTypes = zip(*handle_uploaded_images([dogSearchRequest.base64Image]))
-
         # Create QueryRequest
         dogSearchRequest.type = DogType.FOUND
-        dogSearchRequest.base64Image = base64Images[0]
         dogSearchRequest.isVerified = True
 
         # Query the database
-        results = query_vector_db(dogSearchRequest)
-
-        api_response = APIResponse(status_code=200, message=f"Queried {len(results)} results from the vecotrdb", data={ "total": len(results), "results": results })
+        results, cursor = await query_vector_db(dogSearchRequest)
+
+        api_response = APIResponse(status_code=200, message=f"Queried {len(results)} results from the vecotrdb", data={ "total": len(results), "results": results, "cursor": cursor })
+    except InferenceException as e:
+        logger.warning(f"Error while embedding the query image: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail, data={ "total": 0, "results": [] })
+    except SearchException as e:
+        logger.warning(f"Error while paging the search: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail, data={ "total": 0, "results": [] })
     except Exception as e:
         logger.exception(f"Error while querying the vecotrdb: {e}")
         api_response = APIResponse(status_code=500, message=f"Error while querying the vecotrdb: {e}", data={ "total": 0, "results": [] })
@@ -251,19 +367,38 @@ async def search_in_found_dogs(dogSearchRequest: DogSearchRequest):
 @router.post("/search_in_lost_dogs", response_model=APIResponse)
 async def search_in_lost_dogs(dogSearchRequest: DogSearchRequest):
     try:
-        # Handle the image, resize it and convert it to base64 with webp format and get the content type
-        base64Images, imageContentTypes = zip(*handle_uploaded_images([dogSearchRequest.base64Image]))
-
         # Create QueryRequest
         dogSearchRequest.type = DogType.LOST
-        dogSearchRequest.base64Image = base64Images[0]
         dogSearchRequest.isVerified = True
         # queryRequest = QueryRequest(type=DogType.LOST, breed=breed, imageBase64=base64Images[0], top=top, isVerified=True)
 
         # Query the database
-        results = query_vector_db(dogSearchRequest)
+        results, cursor = await query_vector_db(dogSearchRequest)
+
+        api_response = APIResponse(status_code=200, message=f"Queried {len(results)} results from the vecotrdb", data={ "total": len(results), "results": results, "cursor": cursor })
+    except InferenceException as e:
+        logger.warning(f"Error while embedding the query image: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail, data={ "total": 0, "results": [] })
+    except SearchException as e:
+        logger.warning(f"Error while paging the search: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail, data={ "total": 0, "results": [] })
+    except Exception as e:
+        logger.exception(f"Error while querying the vecotrdb: {e}")
+        api_response = APIResponse(status_code=500, message=f"Error while querying the vecotrdb: {e}", data={ "total": 0, "results": [] })
+    finally:
+        # return back a json response and set the status code to api_response.status_code
+        return JSONResponse(content=api_response.to_dict(), status_code=api_response.status_code)
+
+@router.post("/search_similar_dogs", response_model=APIResponse)
+async def search_similar_dogs(similarDogSearchRequest: SimilarDogSearchRequest):
+    try:
+        # Query the database with the stored vectors of the dog, no image upload nor inference
+        results = await query_similar_dogs(similarDogSearchRequest)
 
         api_response = APIResponse(status_code=200, message=f"Queried {len(results)} results from the vecotrdb", data={ "total": len(results), "results": results })
+    except (SearchException, InferenceException) as e:
+        logger.warning(f"Error while searching dogs similar to dog id {similarDogSearchRequest.dogId}: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail, data={ "total": 0, "results": [] })
     except Exception as e:
         logger.exception(f"Error while querying the vecotrdb: {e}")
         api_response = APIResponse(status_code=500, message=f"Error while querying the vecotrdb: {e}", data={ "total": 0, "results": [] })
@@ -275,7 +410,9 @@ async def search_in_lost_dogs(dogSearchRequest: DogSearchRequest):
 async def get_unverified_documents(auth_result: dict = Security(auth.verify, scopes=['read:unverified_documents'])):
     try:
         # Query the database
-        results = vecotrDBClient.query(class_name="Dog", query=None, query_embedding=None, limit=10000, offset=None, filter=and_(*[Predicate(["isVerified"], "Equal", False, FilterValueTypes.valueBoolean)]).to_dict(), properties=RETURN_PROPERTIES)
+        results = []
+        for class_name in vectorDBIndexer.get_class_names(active_only=True):
+            results.extend(await run_in_io_pool(vecotrDBClient.query, class_name=class_name, query_embedding=None, limit=10000, offset=None, filter=and_(*[Predicate(["isVerified"], "Equal", False, FilterValueTypes.valueBoolean)]).to_dict(), properties=RETURN_PROPERTIES))
 
         api_response = APIResponse(status_code=200, message=f"Queried {len(results)} results from the vecotrdb", data={ "total": len(results), "results": results })
     except Exception as e:
@@ -290,7 +427,7 @@ async def get_unverified_documents(auth_result: dict = Security(auth.verify, sco
 async def get_dog_by_id(dogId: int):
     try:
         # Query the database
-        dog = dogWithImagesRepository.get_dog_with_images_by_id(dogId)
+        dog = await run_in_io_pool(dogWithImagesRepository.get_dog_with_images_by_id, dogId)
         
         dogResponse = mapper.to(DogResponse).map(dog, fields_mapping={"images": []})
         dogResponse.images = [mapper.to(DogImageResponse).map(image) for image in dog.images]
@@ -307,7 +444,7 @@ async def get_dog_by_id(dogId: int):
 async def query_by_dog_id(dogId: int, auth_result: dict = Security(auth.verify, scopes=['read:get_dog_by_id_full_details'])):
     try:
         # Query the database
-        dog = dogWithImagesRepository.get_dog_with_images_by_id(dogId)
+        dog = await run_in_io_pool(dogWithImagesRepository.get_dog_with_images_by_id, dogId)
         
         dogFullDetailsResponse = mapper.to(DogFullDetailsResponse).map(dog, fields_mapping={"images": []})
         dogFullDetailsResponse.images = [mapper.to(DogImageResponse).map(image) for image in dog.images]
@@ -330,7 +467,7 @@ async def add_possible_dog_match(possibleDogMatchRequest: PossibleDogMatchReques
         possibleDogMatchDTO = mapper.to(PossibleDogMatchDTO).map(possibleDogMatchRequest)
 
         # Add the possible dog match to the database
-        dogWithImagesService.add_possible_dog_match(possibleDogMatchDTO)
+        await run_in_io_pool(dogWithImagesService.add_possible_dog_match, possibleDogMatchDTO)
 
         api_response = APIResponse(status_code=200, message=f"Added possible dog match to the database")
     except Exception as e:
@@ -346,7 +483,7 @@ async def get_dogs_by_reporter_id(page: int = Query(1, ge=1), page_size: int = Q
     try:
         logger.info(f"Getting dogs by reporter ID {auth_result['sub']}")
 
-        dogs, total_count = dogWithImagesService.get_all_dogs_with_images_by_reporter_id(auth_result["sub"], page=page, page_size=page_size)
+        dogs, total_count = await run_in_io_pool(dogWithImagesService.get_all_dogs_with_images_by_reporter_id, auth_result["sub"], page=page, page_size=page_size)
         
         dogFullDetailsResponses = [mapper.to(DogFullDetailsResponse).map(dog, fields_mapping={"images": []}) for dog in dogs]
         for dog, dogResponse in zip(dogs, dogFullDetailsResponses):
@@ -365,7 +502,7 @@ async def get_possible_dog_matches_count():
     try:
         logger.info(f"Getting total possible dog matches count")
 
-        total_count = dogWithImagesService.get_possible_dog_matches_count()
+        total_count = await run_in_io_pool(dogWithImagesService.get_possible_dog_matches_count)
 
         api_response = total_count
     except Exception as e:
@@ -381,7 +518,7 @@ async def get_possible_dog_matches(dogId: Optional[int] = None, page: int = Quer
     try:
         logger.info(f"Getting possible dog matches for dog with id {dogId}")
 
-        possibleDogMatches, total_count = dogWithImagesService.get_possible_dog_matches(dog_id=dogId, page=page, page_size=page_size)
+        possibleDogMatches, total_count = await run_in_io_pool(dogWithImagesService.get_possible_dog_matches, dog_id=dogId, page=page, page_size=page_size)
 
         possibleDogMatchResponses = [mapper.to(PossibleDogMatchResponse).map(possibleDogMatch, fields_mapping={ "dog": None, "possibleMatch": None }) for possibleDogMatch in possibleDogMatches]
         for possibleDogMatch, possibleDogMatchResponse in zip(possibleDogMatches, possibleDogMatchResponses):
@@ -403,9 +540,12 @@ async def add_document(dogRequest: DogAddRequest, auth_result: dict = Security(a
     # logger.info(f"Document Request: {documentRequest}")
 
     try:
+        # Adding a dog embeds its images, refuse it until the models are loaded
+        component_registry.require(*MODEL_COMPONENTS)
+
         # Handle the image, resize it and convert it to base64 with webp format and get the content type
         # Unzip the array of tuples coming back from handle_uploaded_images
-        base64Images = handle_uploaded_images(dogRequest.base64Images)
+        base64Images = await run_in_inference_pool(handle_uploaded_images, dogRequest.base64Images)
 
         # Create DogDocument
         # Map the DogRequest to DogDTO
@@ -414,9 +554,13 @@ async def add_document(dogRequest: DogAddRequest, auth_result: dict = Security(a
         })
         dogDTO.images = [DogImageDTO(base64Image=base64Image[0], imageContentType=base64Image[1]) for base64Image in base64Images]
 
-        dogDTO, result = dogWithImagesService.add_dog_with_images(dogDTO)
+        # Segmentation and embedding dominate adding a dog, so it runs on the inference pool
+        dogDTO, result = await run_in_inference_pool(dogWithImagesService.add_dog_with_images, dogDTO)
 
         api_response = APIResponse(status_code=200, message=f"Added documents to the vecotrdb", data=dogDTO.model_dump(), meta=result)
+    except InferenceException as e:
+        logger.warning(f"Error while adding documents to the vecotrdb: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail)
     except Exception as e:
         logger.exception(f"Error while adding documents to the vecotrdb: {e}")
         api_response = APIResponse(status_code=500, message=f"Error while adding documents to the vecotrdb: {e}")
@@ -432,9 +576,18 @@ async def verify_document(dogId: int, auth_result: str = Security(auth.verify, s
     try:
         # Add the documents to the database
         logger.info(f"Verify document")
-        result = vecotrDBClient.update_document("Dog", dogId, {
+        class_name = dogClassName
+        if vectorDBIndexer.partitioned:
+            dogDTO = await run_in_io_pool(dogWithImagesService.get_dog_with_images_by_id, dogId)
+            class_name = vectorDBIndexer.get_class_name(dogDTO.type, dogDTO.isResolved)
+        result = await run_in_io_pool(vecotrDBClient.update_document, class_name, dogId, {
             "isVerified": True,
         })
+        # The profile vectors of the dog carry the flag as well, dog-mode searches return them
+        if vectorDBIndexer.profiles_enabled:
+            await run_in_io_pool(vecotrDBClient.update_document, get_dog_profile_class_name(class_name), dogId, {
+                "isVerified": True,
+            })
 
         api_response = APIResponse(status_code=200, message=f"Verified document in the vecotrdb", data=result)
     except Exception as e:
@@ -444,19 +597,34 @@ async def verify_document(dogId: int, auth_result: str = Security(auth.verify, s
         # return back a json response and set the status code to api_response.status_code
         return JSONResponse(content=api_response.to_dict(), status_code=api_response.status_code)
 
+@router.get("/inference_metrics", response_model=APIResponse)
+async def get_inference_metrics():
+    api_response = APIResponse(status_code=200, message="Query embedding metrics", data={
+        "scheduler": queryEmbeddingScheduler.metrics() if queryEmbeddingScheduler is not None else None,
+        "embedding_cache": embeddingCache.stats() if embeddingCache is not None else None,
+    })
+
+    return JSONResponse(content=api_response.to_dict(), status_code=api_response.status_code)
+
 @router.get("/get_schema")
 async def get_schema(class_name: str):
-    return vecotrDBClient.get_schema(class_name)
+    return await run_in_io_pool(vecotrDBClient.get_schema, class_name)
 
 # reindex all dogs with images
 @router.get("/reindex_all_dogs_with_images", response_model=APIResponse)
 async def reindex_all_dogs_with_images(auth_result: str = Security(auth.verify, scopes=['write:reindex_all_dogs_with_images'])):
     try:
+        component_registry.require(*MODEL_COMPONENTS)
+
         # Reindex all dogs with images
-        result = dogWithImagesService.index_all_dogs_with_images()
+        # The reindex runs for minutes, the model calls it makes wait for the model locks like any other
+        result = await run_in_indexing_pool(dogWithImagesService.index_all_dogs_with_images)
 
         logger.info(f"Reindexed all dogs with images in the vecotrdb {result}")
         api_response = APIResponse(status_code=200, message=f"Reindexed all dogs with images in the vecotrdb", meta=result)
+    except InferenceException as e:
+        logger.warning(f"Error while reindexing all dogs with images in the vecotrdb: {e.detail}")
+        api_response = APIResponse(status_code=e.status_code, message=e.detail)
     except Exception as e:
         logger.exception(f"Error while reindexing all dogs with images in the vecotrdb: {e}")
         api_response = APIResponse(status_code=500, message=f"Error while reindexing all dogs with images in the vecotrdb: {e}")
@@ -471,11 +639,12 @@ async def clean_all(recreate_db: bool = False, auth_result: str = Security(auth.
         logger.info(f"Deleting all documents from the vectordb. recreate_db: {recreate_db}")
 
         # Delete all objects from the database
-        vecotrDBClient.clean_all("Dog", dog_class_definition)
+        for class_name in vectorDBIndexer.get_class_names(with_profiles=True):
+            await run_in_io_pool(vecotrDBClient.clean_all, class_name, get_dog_class_definition(class_name))
 
         # Recreate the database
         if recreate_db:
-            db.recreate_database()
+            await run_in_io_pool(db.recreate_database)
             message = "All documents were deleted from the vectordb and the database was recreated"
         else:
             message = "All documents were deleted from the vectordb"
@@ -502,7 +671,7 @@ async def delete_dog_by_id(dogId: int, auth_result: str = Security(auth.verify,
 
     try:
         # Delete the dog from the database
-        dogWithImagesService.delete_dog_with_images_by_id(dogId)
+        await run_in_io_pool(dogWithImagesService.delete_dog_with_images_by_id, dogId)
 
         api_response = APIResponse(status_code=200, message=f"Deleted dog with id {dogId} from the database")
     except Exception as e:
@@ -571,7 +740,7 @@ async def delete_possible_dog_match(id: int, auth_result: str = Security(auth.ve
     try:
         logger.info(f"Deleting possible dog match with id {id}")
 
-        dogWithImagesService.delete_possible_dog_match(id)
+        await run_in_io_pool(dogWithImagesService.delete_possible_dog_match, id)
 
         api_response = APIResponse(status_code=200, message=f"Deleted possible dog match with id {id}")
     except Exception as e:
@@ -585,7 +754,7 @@ async def dog_resolved(dogResolvedRequest: DogResolvedRequest, auth_result: str
     try:
         logger.info(f"Marking dogs ids {dogResolvedRequest.dogId}, {dogResolvedRequest.possibleMatchId} as resolved")
 
-        dogWithImagesService.update_dog_is_resolved(dogResolvedRequest.dogId, dogResolvedRequest.possibleMatchId, True)
+        await run_in_io_pool(dogWithImagesService.update_dog_is_resolved, dogResolvedRequest.dogId, dogResolvedRequest.possibleMatchId, True)
 
         api_response = APIResponse(status_code=200, message=f"Dogs ids {dogResolvedRequest.dogId}, {dogResolvedRequest.possibleMatchId} marked as resolved")
     except Exception as e:
@@ -596,14 +765,14 @@ async def dog_resolved(dogResolvedRequest: DogResolvedRequest, auth_result: str
 
 # build a predicate for the properties, breed, type, if they are not None with and_ between them
 @timeit
-def build_filter(dogSearchRequest: DogSearchRequest) -> Optional[Filter]:
+def build_filter(dogSearchRequest: DogSearchRequest, partitioned: bool = False) -> Optional[Filter]:
     logger.info(f"Building the filter for queryRequest: {dogSearchRequest}")
 
     # create a list of predicates
     predicates = []
 
-    # add type predicate
-    if dogSearchRequest.type is not None:
+    # add type predicate, a partition only holds dogs of its type
+    if dogSearchRequest.type is not None and not partitioned:
         predicates.append(Predicate(["type"], "Equal", dogSearchRequest.type.value, FilterValueTypes.valueText))
 
     # add breed predicate
@@ -643,8 +812,9 @@ def build_filter(dogSearchRequest: DogSearchRequest) -> Optional[Filter]:
     # if queryRequest.isVerified is not None:
     #     predicates.append(Predicate(["isVerified"], "Equal", queryRequest.isVerified, FilterValueTypes.valueBoolean))
 
-    # add isResolved predicate, we only want to return dogs that are not resolved
-    predicates.append(Predicate(["isResolved"], "Equal", False, FilterValueTypes.valueBoolean))
+    # add isResolved predicate, we only want to return dogs that are not resolved (the only ones in the hot partitions)
+    if not partitioned:
+        predicates.append(Predicate(["isResolved"], "Equal", False, FilterValueTypes.valueBoolean))
 
     # if there are predicates return and_ between them
     if (len(predicates) > 0):
@@ -653,21 +823,139 @@ def build_filter(dogSearchRequest: DogSearchRequest) -> Optional[Filter]:
     # if there are no predicates return None
     return None
 
-def query_vector_db(dogSearchRequest: DogSearchRequest):
-    # Open the image from the base64 string to PIL Image
-    query_image = create_pil_images([dogSearchRequest.base64Image])[0]
+async def embed_search_image(base64Image: str) -> List[float]:
+    # The models are loaded in the background after startup
+    component_registry.require(*MODEL_COMPONENTS)
+
+    # Identical images (re-submitted photos, frontend retries) are served from the cache without decoding or inference
+    image_hash = hash_image(base64Image)
+    if embeddingCache is not None:
+        # A miss in memory reads the disk tier
+        query_embedding = await run_in_io_pool(embeddingCache.get, image_hash)
+        if query_embedding is not None:
+            logger.info(f"Query embedding cache hit for image {image_hash}")
+            return query_embedding
+
+    # Handle the image, resize it and convert it to base64 with webp format, then open it as a PIL Image
+    base64Images, imageContentTypes = zip(*await run_in_inference_pool(handle_uploaded_images, [base64Image]))
+    query_image = (await run_in_inference_pool(create_pil_images, [base64Images[0]]))[0]
+
+    # Embed the query image, batched together with other concurrent queries
+    query_embedding = await queryEmbeddingScheduler.embed(query_image)
+
+    if embeddingCache is not None:
+        await run_in_io_pool(embeddingCache.put, image_hash, query_embedding)
+
+    return query_embedding
+
+async def query_vector_db(dogSearchRequest: DogSearchRequest):
+    """
+    Search the dogs matching the query image, one page at a time.
+
+    A request with base64Image starts a new search: the image is embedded, and the cursor of the next page carries the
+    embedding and the filter of the search. A request with that cursor queries the next page with them, on any worker and
+    without any inference, the other fields of the request are ignored.
+
+    Returns:
+        tuple: The results of the page and the cursor of the next page, None if there are no more results.
+    """
+    if dogSearchRequest.cursor is not None:
+        search, offset = get_search_page(dogSearchRequest.cursor, dogSearchRequest.type)
+    else:
+        search = await start_search(dogSearchRequest)
+        offset = 0
+
+    results, has_more = await query_search_page(search, offset)
+
+    cursor = searchCursorCodec.encode(search, offset + search["top"]) if has_more else None
+    return results, cursor
 
+async def start_search(dogSearchRequest: DogSearchRequest) -> dict:
     # Embed the query image
-    query_embedding = embed_query(query_image=query_image, embedding_model=embedding_model, image_segmentation_model=image_segmentation_model)
+    query_embedding = await embed_search_image(dogSearchRequest.base64Image)
 
-    # Build the filter with conditions to query the vector db
-    filter = build_filter(dogSearchRequest)
+    # Build the filter with conditions to query the vector db, with partitions the type and the resolution state are implied by the class
+    filter = build_filter(dogSearchRequest, partitioned=vectorDBIndexer.partitioned)
+    class_name = vectorDBIndexer.get_class_name(dogSearchRequest.type)
 
-    # Query the database
-    logger.info(f"Querying the database")
-    results = vecotrDBClient.query(class_name="Dog", query_embedding=query_embedding, limit=dogSearchRequest.top, offset=None, filter=filter.to_dict(), certainty=CERTAINTY, properties=dogSearchRequest.return_properties)
+    search_mode = dogSearchRequest.searchMode
+    if search_mode == SearchMode.DOG:
+        if vectorDBIndexer.profiles_enabled:
+            class_name = get_dog_profile_class_name(class_name)
+        else:
+            logger.warning("Dog-level search requested but DOG_PROFILE_MODE is 'none', grouping the image matches by dog instead")
+            search_mode = SearchMode.GROUPED
+
+    return {
+        "type": dogSearchRequest.type.value,
+        "query_embedding": query_embedding,
+        "class_name": class_name,
+        "filter": filter.to_dict() if filter is not None else None,
+        "properties": dogSearchRequest.return_properties,
+        "top": dogSearchRequest.top,
+        "search_mode": search_mode.value,
+        "aggregate": (dogSearchRequest.groupScore or GroupScore.MAX).value,
+    }
+
+def get_search_page(cursor: str, dog_type: DogType) -> tuple:
+    try:
+        search, offset = searchCursorCodec.decode(cursor)
+    except ExpiredCursorError:
+        raise SearchCursorExpiredException()
+    except ValueError as e:
+        raise InvalidSearchCursorException(str(e))
+
+    # A cursor only pages the search of the endpoint that issued it, e.g. not the found dogs on the lost dogs endpoint
+    if search.get("type") != dog_type.value:
+        raise InvalidSearchCursorException(f"The search cursor was not issued by the search in {dog_type.value} dogs")
+
+    return search, offset
+
+async def query_search_page(search: dict, offset: int) -> tuple:
+    """
+    Query a page of a search.
+
+    Args:
+        search (dict): The search, see start_search.
+        offset (int): The number of results of the previous pages.
+
+    Returns:
+        tuple: The results of the page and whether there may be more results.
+    """
+    top = search["top"]
+    class_name = search["class_name"]
+
+    if search["search_mode"] == SearchMode.GROUPED:
+        # The top dogs of the image matches, grouped by the vectordb (or over-fetched until there are enough of them).
+        # The pages are pages of the ranking by max score, which a larger query only extends, with the mean aggregate
+        # each page is then re-ranked by mean score, as a single page search would rank it (see app/helpers/search_helper.py)
+        logger.info(f"Querying the database class '{class_name}' grouped by dogId, offset: {offset}")
+        groups = await run_in_io_pool(vecotrDBClient.query_grouped, class_name=class_name, query_embedding=search["query_embedding"], group_by="dogId", groups=offset + top, filter=search["filter"], certainty=CERTAINTY, properties=search["properties"], aggregate=GroupScore.MAX.value)
+
+        page = groups[offset:]
+        if search["aggregate"] == GroupScore.MEAN.value:
+            page = sorted(page, key=lambda group: group["meanScore"], reverse=True)
+            for group in page:
+                group["score"] = group["meanScore"]
+
+        return page, len(groups) == offset + top
+
+    if search["search_mode"] == SearchMode.DOG:
+        # A dog has at most max_profile_vectors profile vectors, so these many hits hold the top dogs up to this page
+        limit = (offset + top) * vectorDBIndexer.max_profile_vectors
+        logger.info(f"Querying the database class '{class_name}', offset: {offset}")
+        results = await run_in_io_pool(vecotrDBClient.query, class_name=class_name, query_embedding=search["query_embedding"], limit=limit, offset=None, filter=search["filter"], certainty=CERTAINTY, properties=search["properties"])
 
+        unique_results = remove_duplicate_dogs(results)
+        return unique_results[offset:offset + top], len(unique_results) > offset + top or len(results) == limit
 
+    # Query the database, the pages of an image search are pages of image matches
+    logger.info(f"Querying the database class '{class_name}', offset: {offset}")
+    results = await run_in_io_pool(vecotrDBClient.query, class_name=class_name, query_embedding=search["query_embedding"], limit=top, offset=offset, filter=search["filter"], certainty=CERTAINTY, properties=search["properties"])
+
+    return remove_duplicate_dogs(results)[:top], len(results) == top
+
+def remove_duplicate_dogs(results: List[dict]) -> List[dict]:
     # results may contain the same dog id multiple times, so we need to remove the duplicates and keep the one with the highest score
     # The results are sorted by score in descending order, so we can loop over the results and keep the first result with the dog id
     # and remove the rest of the results with the same dog id
@@ -676,11 +964,38 @@ def query_vector_db(dogSearchRequest: DogSearchRequest):
     for result in results:
         if result["dogId"] not in unique_results:
             unique_results[result["dogId"]] = result
-    # If you need the results as a list
-    unique_results = list(unique_results.values())
 
-    # return the unique results
-    return unique_results
+    return list(unique_results.values())
+
+async def query_similar_dogs(similarDogSearchRequest: SimilarDogSearchRequest) -> List[dict]:
+    """
+    Search the dogs of the opposite type similar to an indexed dog, with the stored embeddings of its images.
+    Each image is searched on its own, grouped by dog, and the dogs matched by several images are merged into one ranking.
+    """
+    # The stored embeddings are only comparable once the embedding model tells which of them are up to date
+    component_registry.require("embedding_model")
+
+    dog = await run_in_io_pool(dogWithImagesService.get_dog_with_images_by_id, similarDogSearchRequest.dogId)
+    if dog is None:
+        raise DogNotFoundException(f"Dog id {similarDogSearchRequest.dogId} was not found")
+
+    stored_embeddings = vectorDBIndexer.get_stored_embeddings(dog, similarDogSearchRequest.dogImageId)
+    if not stored_embeddings:
+        raise NoStoredEmbeddingException()
+
+    # A lost dog is searched among the found dogs and the other way around, the same filter as search_in_*_dogs
+    search_type = DogType.FOUND if dog.type == DogType.LOST else DogType.LOST
+    filter = build_filter(DogSearchRequest.model_construct(type=search_type), partitioned=vectorDBIndexer.partitioned)
+    class_name = vectorDBIndexer.get_class_name(search_type)
+    aggregate = (similarDogSearchRequest.groupScore or GroupScore.MAX).value
+
+    logger.info(f"Querying the database class '{class_name}' with {len(stored_embeddings)} stored image embeddings of dog id {dog.id}")
+    group_results = await asyncio.gather(*[
+        run_in_io_pool(vecotrDBClient.query_grouped, class_name=class_name, query_embedding=embedding.tolist(), group_by="dogId", groups=similarDogSearchRequest.top, filter=filter.to_dict() if filter is not None else None, certainty=CERTAINTY, properties=similarDogSearchRequest.return_properties, aggregate=aggregate)
+        for _, embedding in stored_embeddings
+    ])
+
+    return merge_group_results(group_results, "dogId", similarDogSearchRequest.top)
 
 def handle_uploaded_images(imgs):
     """
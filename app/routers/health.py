@@ -0,0 +1,29 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.services.component_registry import component_registry
+from app.viewmodels.api_response import APIResponse
+
+router = APIRouter(prefix="/health")
+
+@router.get("/live", response_model=APIResponse)
+async def live():
+    """
+    Liveness probe, the process is up and serving requests.
+    """
+    api_response = APIResponse(status_code=200, message="Alive", data={ "uptime_seconds": component_registry.status()["uptime_seconds"] })
+
+    return JSONResponse(content=api_response.to_dict(), status_code=api_response.status_code)
+
+@router.get("/ready", response_model=APIResponse)
+async def ready():
+    """
+    Readiness probe, returns 503 until every required component (database, vectordb, models and their warm-up) is loaded.
+    """
+    status = component_registry.status()
+
+    if status["ready"]:
+        api_response = APIResponse(status_code=200, message="Ready", data=status)
+    else:
+        api_response = APIResponse(status_code=503, message="Not ready", data=status)
+
+    return JSONResponse(content=api_response.to_dict(), status_code=api_response.status_code)
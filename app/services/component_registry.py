@@ -0,0 +1,120 @@
+# ComponentRegistry tracks the load state of the components the app depends on (database, vectordb, models)
+# so requests and the readiness probe can tell what is available while the models load in the background
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, Optional
+from app.exceptions.inference_exceptions import ComponentNotReadyException
+from app.MyLogger import logger
+
+class ComponentState(str, Enum):
+    PENDING = "pending"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+class ComponentStatus:
+    def __init__(self, name: str, required: bool) -> None:
+        self.name = name
+        self.required = required
+        self.state = ComponentState.PENDING
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        duration_ms = None
+        if self.started_at is not None:
+            duration_ms = round(((self.finished_at or time.time()) - self.started_at) * 1000, 1)
+
+        return {
+            "state": self.state.value,
+            "required": self.required,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_ms": duration_ms,
+            "error": self.error,
+        }
+
+class ComponentRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._components: Dict[str, ComponentStatus] = {}
+        self.created_at = time.time()
+
+    def register(self, name: str, required: bool = True) -> None:
+        """
+        Register a component, required components must be ready before the app reports itself as ready.
+        """
+        with self._lock:
+            self._components[name] = ComponentStatus(name, required)
+
+    def load(self, name: str, load_component: Callable[[], Any]) -> Any:
+        """
+        Run the loader of a component, recording its state and timings.
+
+        Args:
+            name (str): The registered name of the component.
+            load_component (Callable[[], Any]): Loads the component and returns it.
+
+        Returns:
+            Any: The loaded component.
+
+        Raises:
+            Exception: The loader error, after the component is marked as failed.
+        """
+        with self._lock:
+            status = self._components.setdefault(name, ComponentStatus(name, True))
+            status.state = ComponentState.LOADING
+            status.started_at = time.time()
+            status.finished_at = None
+            status.error = None
+
+        logger.info(f"Loading component '{name}'")
+
+        try:
+            component = load_component()
+        except Exception as e:
+            with self._lock:
+                status.state = ComponentState.FAILED
+                status.finished_at = time.time()
+                status.error = str(e)
+            logger.exception(f"Error while loading component '{name}': {e}")
+            raise
+
+        with self._lock:
+            status.state = ComponentState.READY
+            status.finished_at = time.time()
+
+        logger.info(f"Loaded component '{name}' in {status.to_dict()['duration_ms']} ms")
+
+        return component
+
+    def is_ready(self, *names: str) -> bool:
+        """
+        Whether the given components, or all the required components when no name is given, are ready.
+        """
+        with self._lock:
+            if names:
+                statuses = [self._components.get(name) for name in names]
+            else:
+                statuses = [status for status in self._components.values() if status.required]
+
+            return all(status is not None and status.state == ComponentState.READY for status in statuses)
+
+    def require(self, *names: str) -> None:
+        """
+        Raise a ComponentNotReadyException (HTTP 503) unless the given components are ready.
+        """
+        if not self.is_ready(*names):
+            raise ComponentNotReadyException(f"The service is still starting up ({', '.join(names)} not ready), please try again later")
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "ready": all(status.state == ComponentState.READY for status in self._components.values() if status.required),
+                "uptime_seconds": round(time.time() - self.created_at, 1),
+                "components": {name: status.to_dict() for name, status in self._components.items()},
+            }
+
+component_registry = ComponentRegistry()
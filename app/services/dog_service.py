@@ -17,28 +17,42 @@ class DogWithImagesService:
             newDogDTO = self.repository.add_dog_with_images(dogDTO)
 
             # Add the dog to the vector database
-            result = self.vectordbIndexer.index_dogs_with_images([newDogDTO])
+            result = self.index_dogs_with_images([newDogDTO])
 
             return newDogDTO, result
         except Exception as e:
             logger.exception(f"Error while adding dog with images: {e}")
             raise e
 
+    # Compute and store the missing or stale image embeddings, then push the stored embeddings to the vector database
+    def index_dogs_with_images(self, dogDTOs: list[DogDTO]) -> dict:
+        updated_images = self.vectordbIndexer.ensure_embeddings(dogDTOs)
+
+        if len(updated_images) > 0:
+            try:
+                self.repository.update_dog_images_embeddings(updated_images)
+            except Exception as e:
+                # The embeddings are still pushed to the vector database, they will be computed again on the next reindex
+                logger.exception(f"Error while storing {len(updated_images)} image embeddings: {e}")
+
+        return self.vectordbIndexer.index_dogs_with_images(dogDTOs)
+
     # index all dogs with images
     def index_all_dogs_with_images(self) -> dict:
         try:
-            # Get dogs total count
+            # Get dogs total count, the resolved dogs have their own partitions when the vectordb is partitioned
             final_result = None
-            _, total_count = self.repository.get_all_dogs_with_images(type=None, is_resolved=False, page=1, page_size=1)
+            is_resolved = None if self.vectordbIndexer.partitioned else False
+            _, total_count = self.repository.get_all_dogs_with_images(type=None, is_resolved=is_resolved, page=1, page_size=1)
 
             # Calculate total pages
             total_pages = (total_count + 99) // 100
 
             # Loop over the total pages and index the dogs with images in the vector database
             for i in range(1, total_pages + 1):
-                dogDTOs, _ = self.repository.get_all_dogs_with_images(type=None, is_resolved=False, page=i, page_size=100)
+                dogDTOs, _ = self.repository.get_all_dogs_with_images(type=None, is_resolved=is_resolved, page=i, page_size=100)
 
-                result = self.vectordbIndexer.index_dogs_with_images(dogDTOs)
+                result = self.index_dogs_with_images(dogDTOs)
 
                 # Aggregate the result and return the final result
                 if final_result is None:
@@ -96,8 +110,12 @@ class DogWithImagesService:
             self.repository.update_dog_is_resolved(possibleMatchId, is_resolved)
             self.repository.delete_possible_dog_matches(possibleMatchId)
 
-            self.vectordbIndexer.delete_dogs_with_images([Dog(id=dog_id)])
-            self.vectordbIndexer.delete_dogs_with_images([Dog(id=possibleMatchId)])
+            if is_resolved:
+                # Move the vectors out of the hot partitions searches go to
+                self.vectordbIndexer.move_dogs_to_resolved([self.repository.get_dog_with_images_by_id(id) for id in (dog_id, possibleMatchId)])
+            else:
+                self.vectordbIndexer.delete_dogs_with_images([Dog(id=dog_id)])
+                self.vectordbIndexer.delete_dogs_with_images([Dog(id=possibleMatchId)])
         except Exception as e:
             logger.exception(f"Error while updating dog isResolved field: {e}")
             raise e
@@ -0,0 +1,89 @@
+# InferenceClient embeds images through the inference service (app/services/inference_service.py)
+# instead of holding the models in the HTTP worker process
+import os
+import time
+from multiprocessing.connection import Client
+from typing import List
+from app.exceptions.inference_exceptions import InferenceServiceUnavailableException
+from app.helpers.shared_memory_helper import write_images_to_shared_memory
+from app.MyLogger import logger
+
+INFERENCE_SOCKET_PATH = os.environ.get("INFERENCE_SOCKET_PATH", "/tmp/dogfinder/inference.sock")
+INFERENCE_TIMEOUT_SECONDS = float(os.environ.get("INFERENCE_TIMEOUT_SECONDS", 60))
+# How long the client waits for the inference service to come up
+INFERENCE_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("INFERENCE_CONNECT_TIMEOUT_SECONDS", 600))
+
+class InferenceClient:
+    def __init__(self, socket_path: str = INFERENCE_SOCKET_PATH, timeout: float = INFERENCE_TIMEOUT_SECONDS, connect_timeout: float = INFERENCE_CONNECT_TIMEOUT_SECONDS) -> None:
+        """
+        Connect to the inference service, waiting for it to come up, and read the identity of its models.
+
+        Args:
+            socket_path (str, optional): The Unix socket of the inference service. Defaults to INFERENCE_SOCKET_PATH.
+            timeout (float, optional): How long a request may take. Defaults to INFERENCE_TIMEOUT_SECONDS.
+            connect_timeout (float, optional): How long to wait for the service to come up. Defaults to INFERENCE_CONNECT_TIMEOUT_SECONDS.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+        info = self._wait_for_service(connect_timeout)
+        self.model_id: str = info["model_id"]
+        self.precision: str = info["precision"]
+        self.segmentation_settings_id: str = info["segmentation_settings_id"]
+        self.identity: str = info["identity"]
+
+        logger.info(f"Connected to the inference service on {socket_path}, identity: {self.identity}")
+
+    def embed_queries(self, query_images) -> List[List[float]]:
+        return self._embed("embed_queries", query_images)
+
+    def embed_documents(self, documents) -> List[List[float]]:
+        return self._embed("embed_documents", documents)
+
+    def info(self) -> dict:
+        return self._call({ "op": "info" })
+
+    def _embed(self, op: str, images) -> List[List[float]]:
+        if len(images) == 0:
+            return []
+
+        # Only the name and the layout of the shared memory block go over the socket
+        shm, image_refs = write_images_to_shared_memory(images)
+        try:
+            embeddings = self._call({ "op": op, "shm": shm.name, "images": image_refs })
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return embeddings.tolist()
+
+    def _call(self, request: dict):
+        try:
+            conn = Client(self.socket_path, family="AF_UNIX")
+        except (FileNotFoundError, ConnectionError) as e:
+            raise InferenceServiceUnavailableException(f"The inference service is unavailable: {e}")
+
+        with conn:
+            conn.send(request)
+            if not conn.poll(self.timeout):
+                raise InferenceServiceUnavailableException(f"The inference service did not answer within {self.timeout} seconds")
+            try:
+                response = conn.recv()
+            except (EOFError, ConnectionError) as e:
+                raise InferenceServiceUnavailableException(f"The inference service closed the connection: {e}")
+
+        if "error" in response:
+            raise RuntimeError(f"Inference service error: {response['error']}")
+
+        return response["result"]
+
+    def _wait_for_service(self, connect_timeout: float) -> dict:
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                return self.info()
+            except InferenceServiceUnavailableException as e:
+                if time.monotonic() > deadline:
+                    raise
+                logger.info(f"Waiting for the inference service: {e.detail}")
+                time.sleep(1)
@@ -0,0 +1,189 @@
+# QueryEmbeddingScheduler gathers concurrent search query images into micro-batches
+# and embeds every batch with a single segmentation + DINO call
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, List, Optional
+from app.exceptions.inference_exceptions import InferenceQueueFullException
+from app.MyLogger import logger
+
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", 8))
+QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", 10))
+QUERY_BATCH_QUEUE_DEPTH = int(os.environ.get("QUERY_BATCH_QUEUE_DEPTH", 64))
+
+# Number of recent queue wait samples kept for the percentiles
+QUEUE_WAIT_SAMPLES = 1000
+
+class _QueryRequest:
+    def __init__(self, image: Any) -> None:
+        self.image = image
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+class QueryEmbeddingScheduler:
+    def __init__(self, embed_batch: Callable[[List[Any]], List[List[float]]], max_batch_size: int = QUERY_BATCH_MAX_SIZE, max_wait_ms: float = QUERY_BATCH_MAX_WAIT_MS, max_queue_size: int = QUERY_BATCH_QUEUE_DEPTH, executor: Optional[Executor] = None, max_concurrent_batches: int = 1) -> None:
+        """
+        Initialize the scheduler and start its batching thread.
+
+        Args:
+            embed_batch (Callable[[List[Any]], List[List[float]]]): Embeds a list of query images, returning one vector per image in input order.
+            max_batch_size (int, optional): The maximum number of queries embedded together. Defaults to QUERY_BATCH_MAX_SIZE.
+            max_wait_ms (float, optional): How long the first query of a batch waits for more queries to arrive. Defaults to QUERY_BATCH_MAX_WAIT_MS.
+            max_queue_size (int, optional): The maximum number of pending queries, new queries are rejected above it. Defaults to QUERY_BATCH_QUEUE_DEPTH.
+            executor (Optional[Executor], optional): The executor the batches run on. Defaults to None, running them on the scheduler thread.
+            max_concurrent_batches (int, optional): The maximum number of batches running on the executor at once. Defaults to 1.
+        """
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue_size = max_queue_size
+        self.executor = executor
+
+        # A new batch is only collected once a slot is free, so queries keep accumulating while all the slots are busy
+        self._batch_slots = threading.Semaphore(max(1, max_concurrent_batches))
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._metrics_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+        self._total_queries = 0
+        self._rejected_queries = 0
+        self._total_queue_wait = 0.0
+        self._max_queue_wait = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="query-embedding-scheduler", daemon=True)
+        self._thread.start()
+
+        logger.info(f"Query embedding scheduler started with max_batch_size: {self.max_batch_size}, max_wait_ms: {max_wait_ms}, max_queue_size: {max_queue_size}")
+
+    def submit(self, image: Any) -> Future:
+        """
+        Queue a query image for embedding.
+
+        Args:
+            image (Any): The query image.
+
+        Returns:
+            Future: A future resolved with the embedding of the image.
+
+        Raises:
+            InferenceQueueFullException: If the queue already holds max_queue_size pending queries.
+        """
+        request = _QueryRequest(image)
+
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._metrics_lock:
+                self._rejected_queries += 1
+            logger.warning(f"Query embedding queue is full ({self.max_queue_size} pending queries), rejecting query")
+            raise InferenceQueueFullException()
+
+        return request.future
+
+    async def embed(self, image: Any) -> List[float]:
+        """
+        Queue a query image for embedding and wait for its vector without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(image))
+
+    def metrics(self) -> dict:
+        """
+        Return the batch size distribution and the queue wait statistics (in milliseconds).
+        """
+        with self._metrics_lock:
+            waits = sorted(self._queue_waits)
+            total_batches = sum(self._batch_sizes.values())
+
+            def percentile(p: float) -> float:
+                if not waits:
+                    return 0.0
+                return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3)
+
+            return {
+                "config": { "max_batch_size": self.max_batch_size, "max_wait_ms": self.max_wait * 1000, "max_queue_size": self.max_queue_size },
+                "queue_size": self._queue.qsize(),
+                "total_queries": self._total_queries,
+                "rejected_queries": self._rejected_queries,
+                "total_batches": total_batches,
+                "mean_batch_size": round(self._total_queries / total_batches, 3) if total_batches else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "queue_wait_ms": {
+                    "mean": round(self._total_queue_wait / self._total_queries * 1000, 3) if self._total_queries else 0.0,
+                    "max": round(self._max_queue_wait * 1000, 3),
+                    "p50": percentile(0.50),
+                    "p95": percentile(0.95),
+                    "p99": percentile(0.99),
+                },
+            }
+
+    def _collect_batch(self) -> List[_QueryRequest]:
+        # Block until the first query arrives, then keep collecting until the batch is full or the window closes
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            self._batch_slots.acquire()
+            batch = self._collect_batch()
+
+            if self.executor is None:
+                self._process_batch(batch)
+            else:
+                try:
+                    self.executor.submit(self._process_batch, batch)
+                except RuntimeError as e:
+                    # The executor was shut down
+                    logger.error(f"Could not schedule a batch of {len(batch)} queries: {e}")
+                    self._batch_slots.release()
+                    for request in batch:
+                        if request.future.set_running_or_notify_cancel():
+                            request.future.set_exception(e)
+
+    def _process_batch(self, batch: List[_QueryRequest]) -> None:
+        try:
+            # Drop the queries whose callers gave up while waiting in the queue
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                return
+
+            self._record_batch(batch)
+
+            try:
+                embeddings = self.embed_batch([request.image for request in batch])
+
+                for request, embedding in zip(batch, embeddings):
+                    request.future.set_result(embedding)
+            except Exception as e:
+                logger.exception(f"Error while embedding a batch of {len(batch)} queries: {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+        finally:
+            self._batch_slots.release()
+
+    def _record_batch(self, batch: List[_QueryRequest]) -> None:
+        now = time.monotonic()
+        with self._metrics_lock:
+            self._batch_sizes[len(batch)] += 1
+            self._total_queries += len(batch)
+            for request in batch:
+                wait = now - request.enqueued_at
+                self._queue_waits.append(wait)
+                self._total_queue_wait += wait
+                self._max_queue_wait = max(self._max_queue_wait, wait)
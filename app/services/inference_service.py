@@ -0,0 +1,162 @@
+# Inference service holding the segmentation and embedding models for all the HTTP workers of a deployment.
+# The HTTP workers (INFERENCE_BACKEND=remote) connect over a Unix socket and only send metadata,
+# the decoded images travel through shared memory.
+#
+# Run with:
+#     python -m app.services.inference_service
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import Listener
+import numpy as np
+from app.MyLogger import logger
+from app.helpers.model_helper import create_embedding_model, create_segmentation_model, embed_documents, embed_queries, get_embedding_identity, get_embedding_model_id, get_embedding_precision, warm_up_models
+from app.helpers.shared_memory_helper import attach_images_from_shared_memory
+from app.model_optimization.remove_background import get_segmentation_settings_id
+
+INFERENCE_SOCKET_PATH = os.environ.get("INFERENCE_SOCKET_PATH", "/tmp/dogfinder/inference.sock")
+# Number of model-holding worker processes
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 2))
+INFERENCE_SOCKET_BACKLOG = int(os.environ.get("INFERENCE_SOCKET_BACKLOG", 128))
+
+class InferenceWorker:
+    def __init__(self, worker_id: int) -> None:
+        """
+        Load the models of a worker process and warm them up.
+        """
+        self.worker_id = worker_id
+        self.embedding_model, _ = create_embedding_model()
+        self.image_segmentation_model = create_segmentation_model()
+        warm_up_models(self.embedding_model, self.image_segmentation_model)
+
+        logger.info(f"Inference worker {worker_id} (pid {os.getpid()}) is ready")
+
+    def info(self) -> dict:
+        return {
+            "model_id": get_embedding_model_id(self.embedding_model),
+            "precision": get_embedding_precision(self.embedding_model),
+            "segmentation_settings_id": get_segmentation_settings_id(),
+            "identity": get_embedding_identity(self.embedding_model),
+        }
+
+    def handle(self, request: dict) -> dict:
+        """
+        Run a single request.
+
+        Args:
+            request (dict): {"op": "info"} or {"op": "embed_queries" | "embed_documents", "shm": <block name>, "images": [{"offset", "shape"}]}.
+
+        Returns:
+            dict: {"result": ...} or {"error": <message>}.
+        """
+        op = request.get("op")
+
+        if op == "info":
+            return { "result": self.info() }
+
+        if op not in ("embed_queries", "embed_documents"):
+            return { "error": f"Unknown op '{op}'" }
+
+        shm, images = attach_images_from_shared_memory(request["shm"], request["images"])
+        try:
+            if op == "embed_queries":
+                embeddings = embed_queries(query_images=images, embedding_model=self.embedding_model, image_segmentation_model=self.image_segmentation_model)
+            else:
+                embeddings = embed_documents(images, self.embedding_model, image_segmentation_model=self.image_segmentation_model)
+
+            return { "result": np.asarray(embeddings, dtype=np.float32) }
+        finally:
+            # The views must be released before the block can be closed
+            images = None
+            try:
+                shm.close()
+            except BufferError:
+                logger.warning(f"Shared memory block {request['shm']} is still referenced, leaving it to the garbage collector")
+
+    def serve(self, listener: Listener) -> None:
+        # Every worker accepts on the shared listener, an idle worker picks up the next connection
+        while True:
+            try:
+                with listener.accept() as conn:
+                    request = conn.recv()
+                    try:
+                        response = self.handle(request)
+                    except Exception as e:
+                        logger.exception(f"Error while handling inference request '{request.get('op')}': {e}")
+                        response = { "error": str(e) }
+                    conn.send(response)
+            except (EOFError, ConnectionError) as e:
+                logger.warning(f"Inference client disconnected: {e}")
+
+def run_worker(listener: Listener, worker_id: int) -> None:
+    # The master handles the shutdown signals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    InferenceWorker(worker_id).serve(listener)
+
+def create_listener(socket_path: str = INFERENCE_SOCKET_PATH) -> Listener:
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir:
+        os.makedirs(socket_dir, exist_ok=True)
+
+    # Remove the socket left behind by a previous run
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    # Only processes of the same user or group may submit images. The socket is created with these permissions,
+    # it accepts connections as soon as it is bound so a chmod afterwards would leave a window open
+    previous_umask = os.umask(0o117)
+    try:
+        listener = Listener(socket_path, family="AF_UNIX", backlog=INFERENCE_SOCKET_BACKLOG)
+    finally:
+        os.umask(previous_umask)
+
+    return listener
+
+def main(socket_path: str = INFERENCE_SOCKET_PATH, worker_count: int = INFERENCE_WORKERS) -> None:
+    """
+    Listen on the Unix socket and keep worker_count model-holding worker processes running.
+    """
+    listener = create_listener(socket_path)
+    # The workers inherit the listening socket
+    context = multiprocessing.get_context("fork")
+    workers = {}
+
+    def start_worker(worker_id: int) -> None:
+        worker = context.Process(target=run_worker, args=(listener, worker_id), name=f"inference-worker-{worker_id}", daemon=True)
+        worker.start()
+        workers[worker_id] = worker
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Starting {worker_count} inference workers on {socket_path}")
+    for worker_id in range(worker_count):
+        start_worker(worker_id)
+
+    try:
+        while not stopping:
+            # Replace the workers that died
+            for worker_id, worker in list(workers.items()):
+                if not worker.is_alive():
+                    logger.error(f"Inference worker {worker_id} exited with code {worker.exitcode}, restarting it")
+                    start_worker(worker_id)
+            time.sleep(1)
+    finally:
+        logger.info("Stopping the inference workers")
+        for worker in workers.values():
+            worker.terminate()
+        for worker in workers.values():
+            worker.join(timeout=10)
+        listener.close()
+
+if __name__ == "__main__":
+    main()
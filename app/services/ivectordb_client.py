@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List
 from app.DTO.dog_dto import DogDTO
+from app.helpers.search_helper import query_grouped_by_overfetch
 
 class IVectorDBClient(ABC):
     @abstractmethod
@@ -19,6 +20,10 @@ class IVectorDBClient(ABC):
     def query(self, class_name: str, query_embedding: List[float], limit: int = None, offset: int = None, filter: Dict[str, Any] = None, certainty = 0.0, properties: List[str] = None) -> dict:
         pass
 
+    def query_grouped(self, class_name: str, query_embedding: List[float], group_by: str, groups: int, filter: Dict[str, Any] = None, certainty = 0.0, properties: List[str] = None, aggregate: str = "max") -> List[dict]:
+        # Backends without server-side grouping over-fetch in rounds, see app/helpers/search_helper.py
+        return query_grouped_by_overfetch(self.query, group_by, groups, aggregate, class_name=class_name, query_embedding=query_embedding, filter=filter, certainty=certainty, properties=properties)
+
     @abstractmethod
     def create_schema(self, class_name: str, properties: dict) -> None:
         pass
@@ -0,0 +1,455 @@
+# LocalVectorDBClient keeps the vectors in process, for tests and small deployments without a Weaviate container.
+# The vectors of a class live in one contiguous float32 matrix, the properties in column arrays next to it,
+# so a query is a single matrix-vector product over the rows passing the filter.
+# Single process only: every process would rebuild its own copy of the index and apply the writes it serves on its own,
+# so the same search would return different results on different workers.
+import fnmatch
+import os
+import re
+import threading
+import uuid as uuid_lib
+from typing import Any, Dict, List, Optional
+import numpy as np
+from app.helpers.helper import timeit
+from app.helpers.search_helper import GROUP_SCORE_AGGREGATES, aggregate_group_scores, set_group_scores
+from app.services.ivectordb_client import IVectorDBClient
+from app.MyLogger import logger
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Classes with at least this many vectors are searched through an HNSW index when hnswlib is installed
+LOCAL_VECTORDB_HNSW_THRESHOLD = int(os.environ.get("LOCAL_VECTORDB_HNSW_THRESHOLD", 50000))
+LOCAL_VECTORDB_HNSW_M = int(os.environ.get("LOCAL_VECTORDB_HNSW_M", 16))
+LOCAL_VECTORDB_HNSW_EF_CONSTRUCTION = int(os.environ.get("LOCAL_VECTORDB_HNSW_EF_CONSTRUCTION", 200))
+LOCAL_VECTORDB_HNSW_EF_SEARCH = int(os.environ.get("LOCAL_VECTORDB_HNSW_EF_SEARCH", 128))
+# The HNSW candidates are filtered afterwards, fetch this many times the limit
+LOCAL_VECTORDB_HNSW_OVERSAMPLE = int(os.environ.get("LOCAL_VECTORDB_HNSW_OVERSAMPLE", 10))
+
+NUMBER_DATA_TYPES = ("number", "int")
+TEXT_DATA_TYPES = ("text",)
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def is_not_none(column: np.ndarray) -> np.ndarray:
+    return np.not_equal(column, None).astype(bool)
+
+class LocalVectorClass:
+    def __init__(self, class_obj: dict) -> None:
+        """
+        The vectors and properties of a single class.
+        """
+        self.class_obj = class_obj
+        self.data_types = {prop["name"]: prop["dataType"][0] for prop in class_obj.get("properties", [])}
+
+        self.size = 0
+        self.dim: Optional[int] = None
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.uuids = np.empty(0, dtype=object)
+        self.columns: Dict[str, np.ndarray] = {}
+        # Lowercased copies of the text columns, built on first use and dropped on every write
+        self.lower_columns: Dict[str, np.ndarray] = {}
+        self.rows_by_uuid: Dict[str, int] = {}
+
+        self.hnsw_index = None
+        self.hnsw_dirty = True
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self.columns:
+            if self.data_types.get(name) in NUMBER_DATA_TYPES:
+                self.columns[name] = np.full(len(self.uuids), np.nan, dtype=np.float64)
+            else:
+                self.columns[name] = np.full(len(self.uuids), None, dtype=object)
+
+        return self.columns[name]
+
+    def reserve(self, capacity: int) -> None:
+        # Grow geometrically so appending stays amortized O(1)
+        if capacity <= len(self.uuids):
+            return
+
+        capacity = max(capacity, 2 * len(self.uuids), 64)
+
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+
+        uuids = np.full(capacity, None, dtype=object)
+        uuids[:self.size] = self.uuids[:self.size]
+        self.uuids = uuids
+
+        for name, column in self.columns.items():
+            grown = np.full(capacity, np.nan if column.dtype == np.float64 else None, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def upsert(self, uuid: str, vector: np.ndarray, properties: dict) -> None:
+        if self.dim is None:
+            self.dim = len(vector)
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+        elif len(vector) != self.dim:
+            raise ValueError(f"Vector dimension {len(vector)} does not match the class dimension {self.dim}")
+
+        row = self.rows_by_uuid.get(uuid)
+        if row is None:
+            self.reserve(self.size + 1)
+            row = self.size
+            self.size += 1
+            self.rows_by_uuid[uuid] = row
+            self.uuids[row] = uuid
+            self.add_to_hnsw(row, vector)
+        else:
+            # A replaced vector can't be updated in place in the HNSW graph
+            self.hnsw_dirty = True
+
+        self.vectors[row] = vector
+        self.lower_columns.clear()
+        for name in self.columns:
+            self.columns[name][row] = np.nan if self.columns[name].dtype == np.float64 else None
+        for name, value in properties.items():
+            column = self.column(name)
+            column[row] = (np.nan if value is None else float(value)) if column.dtype == np.float64 else value
+
+    def update(self, rows: np.ndarray, properties: dict) -> None:
+        self.lower_columns.clear()
+        for name, value in properties.items():
+            column = self.column(name)
+            column[rows] = (np.nan if value is None else float(value)) if column.dtype == np.float64 else value
+
+    def delete(self, keep: np.ndarray) -> int:
+        # Compact the live rows, deletes are rare compared to queries
+        deleted = self.size - int(keep.sum())
+        if deleted == 0:
+            return 0
+
+        self.vectors = self.vectors[:self.size][keep]
+        self.uuids = self.uuids[:self.size][keep]
+        for name, column in self.columns.items():
+            self.columns[name] = column[:self.size][keep]
+        self.size = len(self.uuids)
+        self.lower_columns.clear()
+        self.rows_by_uuid = {uuid: row for row, uuid in enumerate(self.uuids)}
+        self.hnsw_dirty = True
+
+        return deleted
+
+    def add_to_hnsw(self, row: int, vector: np.ndarray) -> None:
+        if self.hnsw_index is None or self.hnsw_dirty:
+            return
+
+        if row >= self.hnsw_index.get_max_elements():
+            self.hnsw_index.resize_index(max(row + 1, 2 * self.hnsw_index.get_max_elements()))
+        self.hnsw_index.add_items(vector[None, :], np.array([row]))
+
+    def get_hnsw_index(self):
+        if hnswlib is None or self.size < LOCAL_VECTORDB_HNSW_THRESHOLD:
+            return None
+
+        if self.hnsw_index is None or self.hnsw_dirty:
+            logger.info(f"Building the HNSW index of class '{self.class_obj.get('class')}' over {self.size} vectors")
+            index = hnswlib.Index(space="ip", dim=self.dim)
+            index.init_index(max_elements=max(self.size, 1), ef_construction=LOCAL_VECTORDB_HNSW_EF_CONSTRUCTION, M=LOCAL_VECTORDB_HNSW_M)
+            index.add_items(self.vectors[:self.size], np.arange(self.size))
+            index.set_ef(LOCAL_VECTORDB_HNSW_EF_SEARCH)
+            self.hnsw_index = index
+            self.hnsw_dirty = False
+
+        return self.hnsw_index
+
+    def evaluate_filter(self, filter: Optional[Dict[str, Any]]) -> np.ndarray:
+        """
+        Evaluate a Predicate/Filter dict (see app/models/predicates.py) over all the rows at once.
+        """
+        if not filter:
+            return np.ones(self.size, dtype=bool)
+
+        if "operands" in filter:
+            masks = [self.evaluate_filter(operand) for operand in filter["operands"]]
+            if not masks:
+                return np.ones(self.size, dtype=bool)
+            if filter["operator"] == "And":
+                return np.logical_and.reduce(masks)
+            if filter["operator"] == "Or":
+                return np.logical_or.reduce(masks)
+            raise ValueError(f"Unsupported filter operator '{filter['operator']}'")
+
+        name = filter["path"][0]
+        operator = filter["operator"]
+        value_type, value = next((key, val) for key, val in filter.items() if key.startswith("value"))
+        column = self.column(name)[:self.size]
+
+        if operator == "IsNull":
+            is_null = np.isnan(column) if column.dtype == np.float64 else ~is_not_none(column)
+            return is_null if value else ~is_null
+
+        if column.dtype == np.float64:
+            present = ~np.isnan(column)
+            values = column
+        else:
+            present = is_not_none(column)
+            values = column[present]
+            # Text properties are matched case-insensitively, like the word tokenization of Weaviate
+            if value_type == "valueText" or self.data_types.get(name) in TEXT_DATA_TYPES:
+                values = self.lower_column(name)[present]
+                value = str(value).lower() if isinstance(value, str) else value
+
+        if operator == "Like":
+            pattern = re.compile(fnmatch.translate(value), re.IGNORECASE)
+            matches = np.fromiter((isinstance(v, str) and pattern.match(v) is not None for v in values), dtype=bool, count=len(values))
+        elif operator == "Equal":
+            matches = np.equal(values, value)
+        elif operator == "NotEqual":
+            matches = np.not_equal(values, value)
+        elif operator == "GreaterThan":
+            matches = np.greater(values, value)
+        elif operator == "GreaterThanEqual":
+            matches = np.greater_equal(values, value)
+        elif operator == "LessThan":
+            matches = np.less(values, value)
+        elif operator == "LessThanEqual":
+            matches = np.less_equal(values, value)
+        else:
+            raise ValueError(f"Unsupported predicate operator '{operator}'")
+
+        matches = np.asarray(matches, dtype=bool)
+        if column.dtype == np.float64:
+            return matches & present
+
+        mask = np.zeros(self.size, dtype=bool)
+        mask[present] = matches
+        # NotEqual also matches the rows without a value
+        if operator == "NotEqual":
+            mask[~present] = True
+
+        return mask
+
+    def lower_column(self, name: str) -> np.ndarray:
+        if name not in self.lower_columns:
+            self.lower_columns[name] = np.array([None if v is None else str(v).lower() for v in self.columns[name][:self.size]], dtype=object)
+
+        return self.lower_columns[name]
+
+    def to_document(self, row: int, properties: Optional[List[str]]) -> dict:
+        names = properties if properties is not None else list(self.columns)
+        document = {}
+        for name in names:
+            if name in self.columns:
+                value = self.columns[name][row]
+                if self.columns[name].dtype == np.float64:
+                    # Return plain Python numbers, as the Weaviate client does
+                    value = None if np.isnan(value) else int(value) if self.data_types.get(name) == "int" else float(value)
+                document[name] = value
+            else:
+                document[name] = None
+
+        return document
+
+def require_single_process(worker_count: int) -> None:
+    """
+    Refuse to serve the local backend from several worker processes, see the note at the top of the module.
+    """
+    if worker_count > 1:
+        raise ValueError(f"VECTORDB_BACKEND=local keeps the vectors in process and needs a single worker, got {worker_count} workers, use VECTORDB_BACKEND=weaviate or WEB_CONCURRENCY=1")
+
+class LocalVectorDBClient(IVectorDBClient):
+    def __init__(self) -> None:
+        self.classes: Dict[str, LocalVectorClass] = {}
+        self._lock = threading.RLock()
+
+        logger.info(f"Created local vectordb client, hnswlib available: {hnswlib is not None}, HNSW threshold: {LOCAL_VECTORDB_HNSW_THRESHOLD}")
+
+    def _get_class(self, class_name: str) -> LocalVectorClass:
+        if class_name not in self.classes:
+            raise ValueError(f"Class '{class_name}' does not exist in the vectordb")
+
+        return self.classes[class_name]
+
+    @timeit
+    def add_documents_batch(self, class_name: str, documents: list[dict]) -> None:
+        """
+        Adds a batch of documents to the vectordb, documents with an existing uuid replace it.
+        """
+        logger.info(f"Adding {len(documents)} documents of class '{class_name}' to the vectordb")
+
+        success = 0
+        errors = []
+
+        with self._lock:
+            vector_class = self.classes.setdefault(class_name, LocalVectorClass({ "class": class_name }))
+
+            for i, document in enumerate(documents):
+                data_properties = dict(document)
+                try:
+                    uuid = str(data_properties.pop("uuid5", None) or uuid_lib.uuid4())
+                    vector = normalize_rows(np.asarray(data_properties.pop("document_embedding"), dtype=np.float32))
+                    vector_class.upsert(uuid, vector, data_properties)
+                    success += 1
+                except Exception as e:
+                    logger.error(f"Error adding document {i+1} of {len(documents)} to the database: {e}")
+                    errors.append({"error": [{ "message": f"{e}"}], "properties": data_properties})
+
+        logger.info(f"Added {success} documents to the database")
+
+        return { "successful": success, "failed": len(errors), "failed_objects": errors }
+
+    @timeit
+    def delete_by_ids(self, class_name: str, field_name: str, ids: list[int]) -> None:
+        """
+        Deletes the documents whose field_name is one of the ids.
+        """
+        try:
+            with self._lock:
+                vector_class = self._get_class(class_name)
+                column = vector_class.column(field_name)[:vector_class.size]
+                keep = ~np.isin(column, np.asarray(list(set(ids)), dtype=column.dtype))
+                deleted = vector_class.delete(keep)
+
+            logger.info(f"Deleted {deleted} documents of '{class_name}' class from the vectordb")
+
+            return { "success": True, "results": { "matches": deleted, "successful": deleted, "failed": 0 } }
+        except Exception as e:
+            logger.error(f"Error deleting documents of '{class_name}' class and ids {ids} from the vectordb: {e}")
+            return { "success": False, "message": f"Error deleting documents of '{class_name}' class and ids {ids} from the vectordb" }
+
+    @timeit
+    def clean_all(self, class_name: str, class_obj: dict) -> None:
+        with self._lock:
+            self.classes.pop(class_name, None)
+            self.create_schema(class_name, class_obj)
+
+        logger.info(f"All documents of '{class_name}' class were deleted from the vectordb")
+
+    @timeit
+    def query(self, class_name: str, query_embedding: List[float], limit: int = None, offset: int = None, filter: Dict[str, Any] = None, certainty = 0.0, properties: List[str] = None):
+        """
+        Queries the vectordb with a given query and returns best matches, in the format of the Weaviate client.
+        The certainty of a match is (1 + cosine similarity) / 2, as in Weaviate.
+        """
+        logger.info(f"Querying the local vector db with query_embedding length: {len(query_embedding) if query_embedding is not None else None}, filter: {filter}, limit: {limit}, offset: {offset}, properties: {properties}")
+
+        offset = offset or 0
+
+        with self._lock:
+            vector_class = self._get_class(class_name)
+            if vector_class.size == 0:
+                return []
+
+            mask = vector_class.evaluate_filter(filter)
+
+            if query_embedding is None:
+                rows = np.flatnonzero(mask)[offset:]
+                rows = rows[:limit] if limit is not None else rows
+                return [{ **vector_class.to_document(row, properties), "_additional": { "id": vector_class.uuids[row] } } for row in rows]
+
+            query_vector = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+            wanted = (limit if limit is not None else vector_class.size) + offset
+            rows, similarities = self._search(vector_class, query_vector, mask, float(certainty or 0.0), wanted)
+
+            results = []
+            for row, similarity in zip(rows[offset:], similarities[offset:]):
+                row_certainty = float((1 + similarity) / 2)
+                document = vector_class.to_document(row, properties)
+                document["_additional"] = { "distance": float(1 - similarity), "certainty": row_certainty, "id": vector_class.uuids[row] }
+                document["score"] = round(row_certainty, 4)
+                results.append(document)
+
+        return results
+
+    @timeit
+    def query_grouped(self, class_name: str, query_embedding: List[float], group_by: str, groups: int, filter: Dict[str, Any] = None, certainty = 0.0, properties: List[str] = None, aggregate: str = "max") -> List[dict]:
+        """
+        Returns the top groups (e.g. dogs) of the matches, grouping every match above the certainty in place of over-fetching.
+        See app/helpers/search_helper.py for the group scores.
+        """
+        if aggregate not in GROUP_SCORE_AGGREGATES:
+            raise ValueError(f"Unsupported group score aggregate '{aggregate}', expected one of {GROUP_SCORE_AGGREGATES}")
+
+        with self._lock:
+            vector_class = self._get_class(class_name)
+            if vector_class.size == 0:
+                return []
+
+            candidates = np.flatnonzero(vector_class.evaluate_filter(filter))
+            similarities = vector_class.vectors[candidates] @ normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+            keep = similarities >= 2 * float(certainty or 0.0) - 1
+            order = np.argsort(-similarities[keep], kind="stable")
+            candidates, similarities = candidates[keep][order], similarities[keep][order]
+
+            scores = np.round((1 + similarities.astype(np.float64)) / 2, 4)
+            top_groups = aggregate_group_scores(vector_class.column(group_by)[candidates], scores, groups, aggregate)
+
+            results = []
+            for best_hit, *group_scores in top_groups:
+                row, similarity = candidates[best_hit], similarities[best_hit]
+                document = vector_class.to_document(row, properties)
+                document["_additional"] = { "distance": float(1 - similarity), "certainty": float((1 + similarity) / 2), "id": vector_class.uuids[row] }
+                results.append(set_group_scores(document, *group_scores))
+
+        return results
+
+    def _search(self, vector_class: LocalVectorClass, query_vector: np.ndarray, mask: np.ndarray, certainty: float, wanted: int):
+        # certainty >= c  <=>  cosine similarity >= 2c - 1
+        min_similarity = 2 * certainty - 1
+
+        hnsw_index = vector_class.get_hnsw_index()
+        if hnsw_index is not None:
+            k = min(vector_class.size, max(wanted * LOCAL_VECTORDB_HNSW_OVERSAMPLE, 100))
+            labels, distances = hnsw_index.knn_query(query_vector, k=k)
+            rows, similarities = labels[0].astype(np.int64), 1 - distances[0]
+            keep = mask[rows] & (similarities >= min_similarity)
+            rows, similarities = rows[keep], similarities[keep]
+            # Enough matches, or the candidates already covered every row
+            if len(rows) >= wanted or k == vector_class.size:
+                return rows[:wanted], similarities[:wanted]
+
+        # Brute force over the rows passing the filter
+        candidates = np.flatnonzero(mask)
+        similarities = vector_class.vectors[candidates] @ query_vector
+        keep = similarities >= min_similarity
+        candidates, similarities = candidates[keep], similarities[keep]
+
+        if len(candidates) > wanted:
+            top = np.argpartition(-similarities, wanted - 1)[:wanted]
+            candidates, similarities = candidates[top], similarities[top]
+
+        order = np.argsort(-similarities, kind="stable")
+
+        return candidates[order], similarities[order]
+
+    @timeit
+    def create_schema(self, class_name: str, class_obj: dict):
+        with self._lock:
+            if class_name in self.classes and self.classes[class_name].size > 0:
+                logger.info(f"Schema for class '{class_name}' already exists in the vectordb")
+            else:
+                self.classes[class_name] = LocalVectorClass(class_obj)
+                logger.info(f"Schema for class '{class_name}' was created in the vectordb")
+
+        return { "success": True, "message": f"Schema for class '{class_name}' with schema {class_obj} was created in the vectordb" }
+
+    @timeit
+    def get_schema(self, class_name: str):
+        with self._lock:
+            return self._get_class(class_name).class_obj
+
+    @timeit
+    def update_document(self, class_name, dog_id, data:Dict):
+        """
+        Update the properties of the document with the uuid dog_id, or of all the documents of the dog dog_id.
+        """
+        with self._lock:
+            vector_class = self._get_class(class_name)
+            row = vector_class.rows_by_uuid.get(str(dog_id))
+            if row is not None:
+                rows = np.array([row])
+            else:
+                rows = np.flatnonzero(vector_class.column("dogId")[:vector_class.size] == float(dog_id))
+
+            vector_class.update(rows, data)
+
+        return { "updated": len(rows) }
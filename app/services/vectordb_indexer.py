@@ -1,4 +1,5 @@
 # Add function that will index all dogs with images
+import os
 from datetime import datetime
 from typing import Any, List
 from app.DAL.models import Dog, DogImage
@@ -7,60 +8,265 @@ from app.DTO.dog_dto import DogDTO, DogImageDTO
 from app.helpers.image_helper import create_pil_images
 from app.services.ivectordb_client import IVectorDBClient
 from app.MyLogger import logger
-from app.helpers.model_helper import embed_documents, embed_query
+from app.helpers.model_helper import embed_documents, embed_query, get_embedding_model_id
+from app.helpers.embedding_helper import EMBEDDING_STORAGE_DTYPE, compute_dog_profile, deserialize_embedding, is_embedding_fresh, serialize_embedding
+from app.model_optimization.remove_background import get_segmentation_settings_id
+from app.helpers.weaviate_helper import DOG_CLASS_NAME, get_dog_partition_class_name, get_dog_profile_class_name
+from app.viewmodels.data_types import DogType
 from weaviate.util import generate_uuid5
 
+# Keep the vectors in one class per (dog type, active/resolved) instead of a single class filtered on every search.
+# Switching it on requires a reindex (reindex_all_dogs_with_images) to fill the partitions.
+VECTORDB_PARTITIONED = os.environ.get("VECTORDB_PARTITIONED", "false").lower() == "true"
+
+# Also keep per-dog profile vectors, in a "<class>Profile" class next to each class of image vectors, for dog-level search:
+# "none", "centroid" (one vector per dog) or "medoids" (up to DOG_PROFILE_MAX_MEDOIDS of the dog's image vectors)
+DOG_PROFILE_MODE = os.environ.get("DOG_PROFILE_MODE", "none")
+DOG_PROFILE_MAX_MEDOIDS = int(os.environ.get("DOG_PROFILE_MAX_MEDOIDS", 3))
+
 class VectorDBIndexer:
-    def __init__(self, vecotrDBClient: IVectorDBClient, embedding_model, image_segmentation_model) -> None:
+    def __init__(self, vecotrDBClient: IVectorDBClient, embedding_model, image_segmentation_model, class_name: str = DOG_CLASS_NAME, partitioned: bool = VECTORDB_PARTITIONED, profile_mode: str = DOG_PROFILE_MODE, max_medoids: int = DOG_PROFILE_MAX_MEDOIDS) -> None:
         self.vecotrDBClient = vecotrDBClient
+        self.class_name = class_name
+        self.partitioned = partitioned
+        self.profile_mode = profile_mode
+        self.max_medoids = max_medoids
         self.embedding_model = embedding_model
         self.image_segmentation_model = image_segmentation_model
 
-    def index_dogs_with_images(self, dogDTOs: list[DogDTO]) -> None:
-        # Add the document to the database
-        documents = []
-        failed_objects = []
+    @property
+    def profiles_enabled(self) -> bool:
+        return self.profile_mode != "none"
+
+    @property
+    def max_profile_vectors(self) -> int:
+        # The most profile vectors a dog has, fetching top * max_profile_vectors hits always yields the top dogs
+        return self.max_medoids if self.profile_mode == "medoids" else 1
+
+    def get_class_names(self, active_only: bool = False, with_profiles: bool = False) -> list[str]:
+        """
+        The vectordb classes the dog vectors are stored in, see get_dog_class_names.
+        """
+        return get_dog_class_names(self.class_name, self.partitioned, active_only, with_profiles and self.profiles_enabled)
+
+    def get_class_name(self, dog_type: DogType, is_resolved: bool = False) -> str:
+        """
+        The vectordb class of the vectors of a dog, the hot partition of its type when it is active.
+        """
+        if not self.partitioned:
+            return self.class_name
+
+        return get_dog_partition_class_name(self.class_name, dog_type, bool(is_resolved))
+
+    def set_models(self, embedding_model, image_segmentation_model) -> None:
+        # The models are loaded in the background, after the indexer is created
+        self.embedding_model = embedding_model
+        self.image_segmentation_model = image_segmentation_model
+
+    def ensure_embeddings(self, dogDTOs: list[DogDTO]) -> list[DogImageDTO]:
+        """
+        Compute the embeddings of the dog images that have no stored embedding, or whose stored embedding
+        was computed by another model or with other segmentation settings.
+
+        Args:
+            dogDTOs (list[DogDTO]): The dogs with their images. The embedding fields of the images are updated in place.
+
+        Returns:
+            list[DogImageDTO]: The images whose embedding was (re)computed and should be persisted.
+        """
+        model_id = get_embedding_model_id(self.embedding_model)
+        settings_id = get_segmentation_settings_id()
+        updated_images = []
 
-        # iterate over dogs and each image for each dog and create a list of data_properties, add them to documents. Add the documents to the database
         for dogDTO in dogDTOs:
+            stale_images = [image for image in dogDTO.images if not is_embedding_fresh(image.embedding, image.embeddingModel, image.embeddingSettings, model_id, settings_id)]
+            if not stale_images:
+                continue
+
             try:
+                logger.info(f"Computing {len(stale_images)} of {len(dogDTO.images)} image embeddings of dog id {dogDTO.id}")
+
                 # Create a list of PIL images from the base64 images
-                pilImages = create_pil_images([image.base64Image for image in dogDTO.images])
+                pilImages = create_pil_images([image.base64Image for image in stale_images])
 
-                # Embed the document image
+                # Embed the document images
                 dog_images_embedding = embed_documents(pilImages, self.embedding_model, image_segmentation_model=self.image_segmentation_model)
-            
-                for i, dogImage in enumerate(dogDTO.images):
-                    try:
-                        logger.info(f"Adding document {dogDTO.id} with image id {dogImage.id} to VectorDB")
-                        data_properties = create_data_properties(dogDTO, dogImage)
-                        data_properties["uuid5"] = generate_uuid5({"dogId": dogDTO.id, "imageId": dogImage.id })
-                        data_properties["document_embedding"] = dog_images_embedding[i]
-                        documents.append(data_properties)
-                    except Exception as e:
-                        logger.exception(f"Error while creating document for dog id {dogDTO.id} and image id {dogImage.id}: {e}")
-                        failed_objects.append({"dogId": dogDTO.id, "imageId": dogImage.id})
+
+                for dogImage, embedding in zip(stale_images, dog_images_embedding):
+                    dogImage.embedding = serialize_embedding(embedding, EMBEDDING_STORAGE_DTYPE)
+                    dogImage.embeddingDtype = EMBEDDING_STORAGE_DTYPE
+                    dogImage.embeddingModel = model_id
+                    dogImage.embeddingSettings = settings_id
+                    updated_images.append(dogImage)
             except Exception as e:
-                logger.exception(f"Error while indexing dog id {dogDTO.id}: {e}")
-                failed_objects.extend([{"dogId": dogDTO.id, "imageId": dogImage.id} for dogImage in dogDTO.images])
+                logger.exception(f"Error while computing the image embeddings of dog id {dogDTO.id}: {e}")
+
+        return updated_images
+
+    def get_stored_embeddings(self, dogDTO: DogDTO, dog_image_id: int = None) -> list[tuple]:
+        """
+        The stored embeddings of the images of a dog, the vectors it is indexed with, without running any inference.
+        The embeddings computed by another model or with other segmentation settings are skipped, so the embedding model must be loaded.
+
+        Args:
+            dogDTO (DogDTO): The dog with its images.
+            dog_image_id (int, optional): Only return the embedding of this image. Defaults to all the images of the dog.
+
+        Returns:
+            list[tuple]: The image id and the float32 embedding of each image with an up to date stored embedding.
+
+        Raises:
+            ValueError: If the embedding model is not loaded yet.
+        """
+        if self.embedding_model is None:
+            # Without the model there is no telling which stored embeddings live in the space of the indexed vectors
+            raise ValueError("The embedding model is not loaded, the stored embeddings cannot be checked")
+
+        model_id = get_embedding_model_id(self.embedding_model)
+        settings_id = get_segmentation_settings_id()
+        images = [image for image in dogDTO.images if (dog_image_id is None or image.id == dog_image_id) and is_embedding_fresh(image.embedding, image.embeddingModel, image.embeddingSettings, model_id, settings_id)]
+
+        return [(image.id, deserialize_embedding(image.embedding, image.embeddingDtype)) for image in images]
 
-        result = self.vecotrDBClient.add_documents_batch("Dog", documents)
+    def index_dogs_with_images(self, dogDTOs: list[DogDTO]) -> None:
+        """
+        Push the stored embeddings of the dog images to the vectordb. Run ensure_embeddings first,
+        images without an up to date embedding are reported as failed.
+        """
+        # Add the document to the database, grouped by the class (partition) of each dog
+        documents_by_class = {}
+        profile_documents_by_class = {}
+        failed_objects = []
+        model_id = get_embedding_model_id(self.embedding_model)
+        settings_id = get_segmentation_settings_id()
+
+        # iterate over dogs and each image for each dog and create a list of data_properties, add them to documents. Add the documents to the database
+        for dogDTO in dogDTOs:
+            indexed_images = []
+            for dogImage in dogDTO.images:
+                try:
+                    if not is_embedding_fresh(dogImage.embedding, dogImage.embeddingModel, dogImage.embeddingSettings, model_id, settings_id):
+                        raise ValueError("The image has no up to date embedding")
+
+                    logger.info(f"Adding document {dogDTO.id} with image id {dogImage.id} to VectorDB")
+                    data_properties = create_data_properties(dogDTO, dogImage)
+                    data_properties["uuid5"] = generate_uuid5({"dogId": dogDTO.id, "imageId": dogImage.id })
+                    data_properties["document_embedding"] = deserialize_embedding(dogImage.embedding, dogImage.embeddingDtype).tolist()
+                    documents_by_class.setdefault(self.get_class_name(dogDTO.type, dogDTO.isResolved), []).append(data_properties)
+                    indexed_images.append((dogImage, data_properties["document_embedding"]))
+                except Exception as e:
+                    logger.exception(f"Error while creating document for dog id {dogDTO.id} and image id {dogImage.id}: {e}")
+                    failed_objects.append({"dogId": dogDTO.id, "imageId": dogImage.id})
+
+            if self.profiles_enabled and indexed_images:
+                profile_class_name = get_dog_profile_class_name(self.get_class_name(dogDTO.type, dogDTO.isResolved))
+                profile_documents_by_class.setdefault(profile_class_name, []).extend(self.create_profile_documents(dogDTO, indexed_images))
+
+        result = { "successful": 0, "failed": 0, "failed_objects": [] }
+        for class_name, documents in documents_by_class.items():
+            class_result = self.vecotrDBClient.add_documents_batch(class_name, documents)
+            result["successful"] += class_result["successful"]
+            result["failed"] += class_result["failed"]
+            result["failed_objects"].extend(class_result["failed_objects"])
 
         result["failed"] += len(failed_objects)
         result["failed_objects"].extend(failed_objects)
+
+        if self.profiles_enabled:
+            result["profiles"] = self.index_profiles(profile_documents_by_class)
         
         return result
-    
-    def delete_dogs_with_images(self, dogs: List[Dog]) -> None:
-        # Delete the documents from the database
 
-        result = self.vecotrDBClient.delete_by_ids(
-            class_name='Dog',
-            field_name='dogId',
-            ids=[dog.id for dog in dogs]
-        )
+    def create_profile_documents(self, dogDTO: DogDTO, indexed_images: list[tuple]) -> list[dict[str, Any]]:
+        """
+        Create the profile documents of a dog from the vectors of its indexed images.
+
+        Args:
+            dogDTO (DogDTO): The dog.
+            indexed_images (list[tuple]): The (DogImageDTO, embedding) of its images.
+        """
+        documents = []
+        profile = compute_dog_profile([embedding for _, embedding in indexed_images], self.profile_mode, self.max_medoids)
+        for profile_index, (image_index, vector) in enumerate(profile):
+            # The profile shows the image closest to it
+            data_properties = create_data_properties(dogDTO, indexed_images[image_index][0])
+            data_properties["profileIndex"] = profile_index
+            data_properties["uuid5"] = generate_uuid5({"dogId": dogDTO.id, "profileIndex": profile_index })
+            data_properties["document_embedding"] = vector.tolist()
+            documents.append(data_properties)
+
+        return documents
+
+    def index_profiles(self, profile_documents_by_class: dict[str, list[dict]]) -> dict:
+        # Replace the previous profile vectors of the dogs, a dog may now have fewer medoids
+        result = { "successful": 0, "failed": 0, "failed_objects": [] }
+        for class_name, documents in profile_documents_by_class.items():
+            self.vecotrDBClient.delete_by_ids(class_name=class_name, field_name='dogId', ids=list({ document["dogId"] for document in documents }))
+            class_result = self.vecotrDBClient.add_documents_batch(class_name, documents)
+            result["successful"] += class_result["successful"]
+            result["failed"] += class_result["failed"]
+            result["failed_objects"].extend(class_result["failed_objects"])
 
         return result
+    
+    def delete_dogs_with_images(self, dogs: List[Dog], class_names: List[str] = None) -> None:
+        # Delete the documents from the database, from every partition (and its profiles) unless told where the dogs are
+        results = [
+            self.vecotrDBClient.delete_by_ids(
+                class_name=class_name,
+                field_name='dogId',
+                ids=[dog.id for dog in dogs]
+            )
+            for class_name in (class_names or self.get_class_names(with_profiles=True))
+        ]
+
+        if len(results) == 1:
+            return results[0]
+
+        return { "success": all(result.get("success") for result in results), "results": results }
+
+    def move_dogs_to_resolved(self, dogDTOs: list[DogDTO]) -> dict:
+        """
+        Move the vectors of resolved dogs out of the hot partition of their type into its resolved partition.
+        The stored embeddings are pushed again, nothing is embedded. Without partitions the vectors are deleted.
+
+        Args:
+            dogDTOs (list[DogDTO]): The dogs with their images, already marked as resolved.
+        """
+        active_class_names = list({ self.get_class_name(dogDTO.type, False) for dogDTO in dogDTOs })
+        if self.profiles_enabled:
+            active_class_names += [get_dog_profile_class_name(class_name) for class_name in active_class_names]
+        result = self.delete_dogs_with_images([Dog(id=dogDTO.id) for dogDTO in dogDTOs], class_names=active_class_names)
+
+        if not self.partitioned:
+            return result
+
+        if self.embedding_model is None:
+            logger.warning(f"The models are not loaded, the vectors of dog ids {[dogDTO.id for dogDTO in dogDTOs]} will be moved to the resolved partition on the next reindex")
+            return result
+
+        return self.index_dogs_with_images(dogDTOs)
+
+def get_dog_class_names(class_name: str = DOG_CLASS_NAME, partitioned: bool = VECTORDB_PARTITIONED, active_only: bool = False, with_profiles: bool = False) -> list[str]:
+    """
+    The vectordb classes the dog vectors are stored in: the class itself, or its partitions when partitioned.
+
+    Args:
+        class_name (str, optional): The class of the embedding precision. Defaults to DOG_CLASS_NAME.
+        partitioned (bool, optional): Whether the vectors are partitioned. Defaults to VECTORDB_PARTITIONED.
+        active_only (bool, optional): Only the partitions of the active dogs. Defaults to False.
+        with_profiles (bool, optional): Also the profile class of each class. Defaults to False.
+    """
+    if not partitioned:
+        class_names = [class_name]
+    else:
+        states = (False,) if active_only else (False, True)
+        class_names = [get_dog_partition_class_name(class_name, dog_type, is_resolved) for dog_type in DogType for is_resolved in states]
+
+    if with_profiles:
+        class_names += [get_dog_profile_class_name(name) for name in class_names]
+
+    return class_names
 
 def create_data_properties(dog: DogDTO, dogImage: DogImageDTO) -> dict[str, Any]:
     # Transform document to dictionary
@@ -2,6 +2,7 @@ from typing import Any, Dict, List
 
 from fastapi import HTTPException
 from app.helpers.helper import timeit
+from app.helpers.search_helper import GROUP_SCORE_MAX_HITS, group_hits
 from app.helpers.weaviate_helper import FilterValueTypes
 from app.models.predicates import Predicate, or_
 from app.services.ivectordb_client import IVectorDBClient
@@ -141,25 +142,27 @@ class WeaviateVectorDBClient(IVectorDBClient):
         
         # Query the database
         logger.info(f"Querying the database")
+        query = self.client.query.get(class_name, properties)
+        # A search in a partition may need no filter at all
+        if filter:
+            query = query.with_where(filter)
+        if offset:
+            query = query.with_offset(offset)
+
         if query_embedding is None:
             results = (
-                self.client.query
-                .get(class_name, properties)
-                .with_where(filter)
+                query
                 .with_limit(limit)
                 .with_additional(["id"])
-                # .with_offset(offset)
                 .do()
             )
         else:
             results = (
-                self.client.query
-                .get(class_name, properties)
+                query
                 .with_near_vector({
                     "vector": query_embedding,
                     "certainty": certainty,
                 })
-                .with_where(filter)
                 .with_limit(limit)
                 .with_additional(["distance","certainty","id"])
                 .do()
@@ -189,6 +192,54 @@ class WeaviateVectorDBClient(IVectorDBClient):
         
         return results
 
+    @timeit
+    def query_grouped(self, class_name: str, query_embedding: List[float], group_by: str, groups: int, filter: Dict[str, Any] = None, certainty = 0.0, properties: List[str] = None, aggregate: str = "max"):
+        """
+        Queries the vectordb grouping the matches by a property on the server (Weaviate 1.22+ groupBy),
+        falls back to over-fetching in rounds when the server doesn't support it.
+        """
+        logger.info(f"Querying the vector db grouped by {group_by}, groups: {groups}, filter: {filter}, properties: {properties}")
+
+        hit_properties = list(properties or [])
+        if group_by not in hit_properties:
+            hit_properties.append(group_by)
+
+        try:
+            query = self.client.query.get(class_name, [])
+            if filter:
+                query = query.with_where(filter)
+
+            results = (
+                query
+                .with_near_vector({
+                    "vector": query_embedding,
+                    "certainty": certainty,
+                })
+                # The group scores cover the best GROUP_SCORE_MAX_HITS hits of a group, as on the other backends
+                .with_group_by([group_by], groups, GROUP_SCORE_MAX_HITS)
+                .with_additional({ "group": ["id", "count", "maxDistance", "minDistance", f"hits {{ {' '.join(hit_properties)} _additional {{ id distance }} }}"] })
+                .do()
+            )
+
+            if results.get("errors"):
+                raise Exception(f"{results['errors']}")
+        except Exception as e:
+            logger.warning(f"Server-side grouping failed, over-fetching instead: {e}")
+            return super().query_grouped(class_name, query_embedding, group_by, groups, filter, certainty, properties, aggregate)
+
+        # Flatten the hits of all the groups, then score the groups as any other backend
+        hits = []
+        for group in results["data"]["Get"][class_name]:
+            for hit in group["_additional"]["group"]["hits"]:
+                # certainty = 1 - distance / 2 for the cosine distance
+                hit["_additional"]["certainty"] = 1 - hit["_additional"]["distance"] / 2
+                hit["score"] = round(hit["_additional"]["certainty"], 4)
+                hits.append(hit)
+
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+
+        return group_hits(hits, group_by, groups, aggregate)
+
     @timeit
     def create_schema(self, class_name: str, class_obj: dict):
         """
@@ -11,4 +11,17 @@ class DogType(str, Enum):
 class DogAgeGroup(str, Enum):
     PUPPY: str = "puppy"
     ADULT: str = "adult"
-    SENIOR: str = "senior"
\ No newline at end of file
+    SENIOR: str = "senior"
+
+class SearchMode(str, Enum):
+    # One hit per dog image, several images of a dog may take several slots
+    IMAGE: str = "image"
+    # One hit per dog, through its profile vectors (DOG_PROFILE_MODE)
+    DOG: str = "dog"
+    # One hit per dog, the image matches grouped by dog
+    GROUPED: str = "grouped"
+
+class GroupScore(str, Enum):
+    # The score of a dog in a grouped search, from the scores of its matching images
+    MAX: str = "max"
+    MEAN: str = "mean"
\ No newline at end of file
@@ -1,9 +1,9 @@
 from datetime import date
 from enum import Enum
 from typing import List, Optional
-from pydantic import BaseModel, field_serializer, validator
+from pydantic import BaseModel, field_serializer, model_validator, validator
 
-from app.viewmodels.data_types import DogAgeGroup, DogSex, DogType
+from app.viewmodels.data_types import DogAgeGroup, DogSex, DogType, GroupScore, SearchMode
 
 
 RETURN_PROPERTIES = [
@@ -43,9 +43,13 @@ class DogResolvedRequest(BaseModel):
 class DogSearchRequest(BaseModel):
     top: Optional[int] = 10
     type: Optional[DogType] = None
-    base64Image: str
+    # The query image of a new search, or the cursor of the next page of a previous search
+    base64Image: Optional[str] = None
+    cursor: Optional[str] = None
     isResolved: Optional[bool] = False
     isVerified: Optional[bool] = True
+    searchMode: Optional[SearchMode] = SearchMode.IMAGE
+    groupScore: Optional[GroupScore] = GroupScore.MAX
 
     name: Optional[str] = None
     breed: Optional[str] = None
@@ -58,6 +62,22 @@ class DogSearchRequest(BaseModel):
 
     return_properties: Optional[List[str]] = RETURN_PROPERTIES
 
+    @model_validator(mode="after")
+    def image_or_cursor(self):
+        if self.base64Image is None and self.cursor is None:
+            raise ValueError("Either base64Image or cursor is required")
+        return self
+
+class SimilarDogSearchRequest(BaseModel):
+    # The indexed dog to find candidates for, among the dogs of the opposite type
+    dogId: int
+    # Only search with this image of the dog, all of its images by default
+    dogImageId: Optional[int] = None
+    top: Optional[int] = 10
+    groupScore: Optional[GroupScore] = GroupScore.MAX
+
+    return_properties: Optional[List[str]] = RETURN_PROPERTIES
+
 class DogAddRequest(BaseModel):
     base64Images: List[str]
     type: DogType
@@ -0,0 +1,111 @@
+"""
+Micro-benchmarks of the mask post-processing kernels of remove_background on 1024x1024 inputs,
+against inline copies of the previous implementations.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_mask_kernels --size 1024 --repeats 20
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app.model_optimization.remove_background import apply_mask, find_largest_blob_among_masks
+
+
+def legacy_find_largest_blob_among_masks(mask_list):
+    largest_blob_mask = None
+    max_size = 0
+
+    for boolean_mask in mask_list:
+        mask_uint8 = np.uint8(boolean_mask) * 255
+        num_labels, labels_im = cv2.connectedComponents(mask_uint8)
+
+        for i in range(1, num_labels):
+            size = np.sum(labels_im == i)
+            if size > max_size:
+                max_size = size
+                largest_blob_mask = (labels_im == i)
+
+    return largest_blob_mask
+
+
+def legacy_mask_image(image, boolean_mask, background_color=(0, 0, 0)):
+    binary_mask = np.uint8(boolean_mask) * 255
+    masked_area = cv2.bitwise_and(image, image, mask=binary_mask)
+    inverse_mask = cv2.bitwise_not(binary_mask)
+    background = np.full(image.shape, background_color, dtype=np.uint8)
+    background = cv2.bitwise_and(background, background, mask=inverse_mask)
+
+    return cv2.add(masked_area, background)
+
+
+def legacy_mask_dogs(image, dog_mask):
+    # The previous tail of mask_dogs_in_YOLO_result, with its BGR round-trip
+    bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    combined_image = legacy_mask_image(bgr_image, dog_mask)
+
+    return cv2.cvtColor(combined_image, cv2.COLOR_BGR2RGB)
+
+
+def create_masks(size, count, blobs, seed=0):
+    # Masks made of many small blobs plus one large one, the worst case of the per-component loop
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(count):
+        mask = np.zeros((size, size), dtype=np.uint8)
+        for _ in range(blobs):
+            center = tuple(int(value) for value in rng.integers(0, size, 2))
+            cv2.circle(mask, center, int(rng.integers(2, size // 40)), 1, -1)
+        cv2.circle(mask, (size // 2, size // 2), size // 4, 1, -1)
+        masks.append(mask.astype(bool))
+
+    return masks
+
+
+def best_of(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+def report(name, legacy_ms, new_ms):
+    print(f"{name:<28}{legacy_ms:>12.2f}{new_ms:>12.2f}{legacy_ms / new_ms:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--masks", type=int, default=3)
+    parser.add_argument("--blobs", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(args.size, args.size, 3), dtype=np.uint8)
+    masks = create_masks(args.size, args.masks, args.blobs)
+    out = np.empty_like(image)
+
+    # Parity
+    assert np.array_equal(legacy_find_largest_blob_among_masks(masks), find_largest_blob_among_masks(masks))
+    assert np.array_equal(legacy_mask_image(image, masks[0], (255, 0, 0)), apply_mask(image, masks[0], (255, 0, 0)))
+    assert np.array_equal(legacy_mask_dogs(image, masks[0]), apply_mask(image, masks[0]))
+    in_place = image.copy()
+    assert np.array_equal(legacy_mask_image(image, masks[0], (255, 0, 0)), apply_mask(in_place, masks[0], (255, 0, 0), out=in_place))
+
+    print(f"{args.size}x{args.size}, {args.masks} masks of ~{args.blobs} blobs, best of {args.repeats}")
+    print(f"{'kernel':<28}{'legacy ms':>12}{'new ms':>12}{'speedup':>10}")
+    report("largest blob", best_of(lambda: legacy_find_largest_blob_among_masks(masks), args.repeats), best_of(lambda: find_largest_blob_among_masks(masks), args.repeats))
+    report("mask, colored background", best_of(lambda: legacy_mask_image(image, masks[0], (255, 0, 0)), args.repeats), best_of(lambda: apply_mask(image, masks[0], (255, 0, 0)), args.repeats))
+    report("mask dogs (YOLO path)", best_of(lambda: legacy_mask_dogs(image, masks[0]), args.repeats), best_of(lambda: apply_mask(image, masks[0]), args.repeats))
+    report("mask dogs, reused buffer", best_of(lambda: legacy_mask_dogs(image, masks[0]), args.repeats), best_of(lambda: apply_mask(image, masks[0], out=out), args.repeats))
+    report("colored, reused buffer", best_of(lambda: legacy_mask_image(image, masks[0], (255, 0, 0)), args.repeats), best_of(lambda: apply_mask(image, masks[0], (255, 0, 0), out=out), args.repeats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Parity check and latency benchmark of the ONNX Runtime DINO backend against the PyTorch backend on CPU.
+
+The script exits with a non-zero status when the cosine similarity between the two backends drops below
+--min-cosine (0.999 by default), so it can be used as a parity test.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_onnx_backend --images 32 --batch-sizes 1 8 32
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+
+from app.model_optimization.features_extractor import FeatureExtractor
+from app.model_optimization.onnx_features_extractor import OnnxFeatureExtractor
+from benchmarks.benchmark_features_extractor import create_synthetic_images
+
+
+def measure(feature_extractor, pil_images, batch_size, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        feature_extractor.encode_batch(pil_images, batch_size=batch_size)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.999)
+    args = parser.parse_args()
+
+    torch_extractor = FeatureExtractor()
+    torch_extractor.device = torch.device("cpu")
+    torch_extractor.dino.to(torch_extractor.device)
+    onnx_extractor = OnnxFeatureExtractor()
+
+    pil_images = create_synthetic_images(args.images)
+
+    # Parity
+    torch_features = torch_extractor.encode_batch(pil_images)
+    onnx_features = onnx_extractor.encode_batch(pil_images)
+    cosine = (torch_features * onnx_features).sum(axis=1) / (np.linalg.norm(torch_features, axis=1) * np.linalg.norm(onnx_features, axis=1))
+    print(f"Parity: min_cosine={cosine.min():.6f} mean_cosine={cosine.mean():.6f} max_abs_diff={np.abs(torch_features - onnx_features).max():.2e}")
+
+    # Latency
+    print(f"{'batch size':<12}{'torch ms/img':>14}{'onnx ms/img':>14}{'speedup':>10}")
+    for batch_size in args.batch_sizes:
+        torch_time = measure(torch_extractor, pil_images, batch_size, args.repeats)
+        onnx_time = measure(onnx_extractor, pil_images, batch_size, args.repeats)
+        print(f"{batch_size:<12}{torch_time / args.images * 1000:>14.2f}{onnx_time / args.images * 1000:>14.2f}{torch_time / onnx_time:>9.2f}x")
+
+    if cosine.min() < args.min_cosine:
+        print(f"FAILED: min cosine similarity {cosine.min():.6f} is below {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark the search latency of a single dog class filtered on type and isResolved, as build_filter does,
+against a search in the hot partition (VECTORDB_PARTITIONED=true), on the in-process vector backend
+(app/services/local_vectordb_client.py). Brute force below LOCAL_VECTORDB_HNSW_THRESHOLD vectors, HNSW above it
+when hnswlib is installed.
+
+Most stored vectors belong to resolved dogs or to the other type, --resolved-fraction sets how many are resolved.
+The 1M images run needs about 2 * 1M * dim * 4 bytes of memory (both layouts are held at once).
+
+Run from the repository root:
+    python -m benchmarks.benchmark_partitioned_search --sizes 10000,100000,1000000 --dim 384
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.helpers.weaviate_helper import DOG_CLASS_NAME, FilterValueTypes, get_dog_partition_class_name
+from app.models.predicates import Predicate, and_
+from app.services.local_vectordb_client import LocalVectorDBClient
+
+DOG_PROPERTIES = [
+    { "name": "dogId", "dataType": ["int"] },
+    { "name": "type", "dataType": ["text"] },
+    { "name": "isResolved", "dataType": ["boolean"] },
+]
+
+
+def create_documents(count, dim, resolved_fraction, rng):
+    vectors = rng.standard_normal((count, dim), dtype=np.float32)
+    types = rng.choice(["lost", "found"], size=count)
+    resolved = rng.random(count) < resolved_fraction
+
+    return [
+        { "uuid5": str(i), "document_embedding": vectors[i], "dogId": i, "type": str(types[i]), "isResolved": bool(resolved[i]) }
+        for i in range(count)
+    ]
+
+
+def time_queries(search, queries, repeats):
+    search(queries[0])
+    timings = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            timings.append(time.perf_counter() - start)
+
+    return np.median(timings) * 1000, np.percentile(timings, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--resolved-fraction", type=float, default=0.7)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    hot_class_name = get_dog_partition_class_name(DOG_CLASS_NAME, "lost", False)
+    search_filter = and_(
+        Predicate(["type"], "Equal", "lost", FilterValueTypes.valueText),
+        Predicate(["isResolved"], "Equal", False, FilterValueTypes.valueBoolean),
+    ).to_dict()
+
+    print(f"{'images':>10}{'hot':>10}{'filtered p50 ms':>18}{'p95':>8}{'partition p50 ms':>19}{'p95':>8}{'speedup':>9}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        documents = create_documents(size, args.dim, args.resolved_fraction, rng)
+        queries = [rng.standard_normal(args.dim, dtype=np.float32) for _ in range(args.queries)]
+
+        client = LocalVectorDBClient()
+        client.create_schema(DOG_CLASS_NAME, { "class": DOG_CLASS_NAME, "properties": DOG_PROPERTIES })
+        client.add_documents_batch(DOG_CLASS_NAME, documents)
+
+        partitions = {}
+        for document in documents:
+            partitions.setdefault(get_dog_partition_class_name(DOG_CLASS_NAME, document["type"], document["isResolved"]), []).append(document)
+        for class_name, class_documents in partitions.items():
+            client.create_schema(class_name, { "class": class_name, "properties": DOG_PROPERTIES })
+            client.add_documents_batch(class_name, class_documents)
+
+        filtered = time_queries(lambda query: client.query(DOG_CLASS_NAME, query, limit=args.top, filter=search_filter), queries, args.repeats)
+        partitioned = time_queries(lambda query: client.query(hot_class_name, query, limit=args.top), queries, args.repeats)
+
+        print(f"{size:>10}{len(partitions.get(hot_class_name, [])):>10}{filtered[0]:>18.2f}{filtered[1]:>8.2f}{partitioned[0]:>19.2f}{partitioned[1]:>8.2f}{filtered[0] / partitioned[0]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark the DINO preprocessing: the per-image PIL/torchvision transforms vs the cv2 BatchPreprocessor.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_preprocessing --images 64 --batch-size 32
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from app.model_optimization.features_extractor import create_image_transforms
+from app.model_optimization.preprocessing import BatchPreprocessor
+from benchmarks.benchmark_features_extractor import create_synthetic_images
+
+
+def preprocess_torchvision(image_transforms, pil_images):
+    return torch.stack([image_transforms(pil_image.convert("RGB")) for pil_image in pil_images])
+
+
+def best_of(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    pil_images = create_synthetic_images(args.images)
+    arrays = [np.asarray(pil_image) for pil_image in pil_images]
+    batches = [arrays[start:start + args.batch_size] for start in range(0, len(arrays), args.batch_size)]
+
+    image_transforms = create_image_transforms()
+    preprocessor = BatchPreprocessor(args.batch_size)
+
+    # Numerical difference, mostly caused by the resize kernels
+    reference = preprocess_torchvision(image_transforms, pil_images[:args.batch_size]).numpy()
+    batched = preprocessor(arrays[:args.batch_size])
+    print(f"Difference to torchvision: mean_abs={np.abs(reference - batched).mean():.4f} max_abs={np.abs(reference - batched).max():.4f}")
+
+    torchvision_time = best_of(lambda: preprocess_torchvision(image_transforms, pil_images), args.repeats)
+    batched_time = best_of(lambda: [preprocessor(batch) for batch in batches], args.repeats)
+
+    print(f"torchvision per image : {torchvision_time / args.images * 1000:8.3f} ms/img")
+    print(f"cv2 batch preprocessor: {batched_time / args.images * 1000:8.3f} ms/img ({torchvision_time / batched_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
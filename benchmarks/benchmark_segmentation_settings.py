@@ -0,0 +1,92 @@
+"""
+Segmentation latency and retrieval recall per segmentation setting, to choose an operating point for CPU pods.
+
+The images folder holds one sub folder per dog (images-dir/<dog>/<photo>). Every photo is used once as a
+query against all the other photos; recall@k is the share of queries with another photo of the same dog
+in their top k. Every setting is written as <model size>:<imgsz>:<mask resolution>:<mode>.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_segmentation_settings --images-dir path/to/dogs \\
+        --settings x:640:retina:mask s:640:model:mask n:320:model:mask n:320:model:box
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from ultralytics import YOLO
+
+from app.model_optimization.features_extractor import FeatureExtractor
+from app.model_optimization.remove_background import SegmentationSettings, process_pil_images_YOLO
+from benchmarks.evaluate_quantized_recall import IMAGE_EXTENSIONS, nearest_neighbours
+
+
+def load_labelled_images(images_dir, max_images):
+    pil_images, labels = [], []
+    for label in sorted(os.listdir(images_dir)):
+        label_dir = os.path.join(images_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and len(pil_images) < max_images:
+                pil_images.append(Image.open(os.path.join(label_dir, name)).convert("RGB"))
+                labels.append(label)
+
+    return pil_images, np.array(labels)
+
+
+def parse_settings(value):
+    model_size, imgsz, mask_resolution, mode = value.split(":")
+    return SegmentationSettings(model_size=model_size, imgsz=int(imgsz), mask_resolution=mask_resolution, mode=mode)
+
+
+def identity_recall_at_k(features, labels, k):
+    neighbours = nearest_neighbours(features, k)
+    return float(np.mean([(labels[row] == labels[i]).any() for i, row in enumerate(neighbours)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images-dir", required=True)
+    parser.add_argument("--max-images", type=int, default=500)
+    parser.add_argument("--settings", nargs="+", default=["x:640:retina:mask", "m:640:model:mask", "s:640:model:mask", "n:640:model:mask", "n:320:model:mask", "n:320:model:box"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    pil_images, labels = load_labelled_images(args.images_dir, args.max_images)
+    if len(set(labels)) < 2:
+        print(f"Need photos of at least 2 dogs in sub folders of {args.images_dir}")
+        sys.exit(2)
+
+    feature_extractor = FeatureExtractor()
+    feature_extractor.device = torch.device("cpu")
+    feature_extractor.dino.to(feature_extractor.device)
+
+    print(f"Images: {len(pil_images)} of {len(set(labels))} dogs")
+    print(f"{'setting':<22}{'segment ms/img':>16}" + "".join(f"{f'recall@{k}':>11}" for k in args.k))
+
+    for value in args.settings:
+        settings = parse_settings(value)
+        segmentation_model = YOLO(settings.model_path)
+
+        # Warm up
+        process_pil_images_YOLO(pil_images[:1], segmentation_model, settings)
+
+        segmented_images = []
+        start = time.perf_counter()
+        for batch_start in range(0, len(pil_images), args.batch_size):
+            segmented_images.extend(process_pil_images_YOLO(pil_images[batch_start:batch_start + args.batch_size], segmentation_model, settings))
+        segment_time = (time.perf_counter() - start) / len(pil_images) * 1000
+
+        features = feature_extractor.encode_batch(segmented_images)
+        recalls = [identity_recall_at_k(features, labels, k) for k in args.k]
+
+        print(f"{value:<22}{segment_time:>16.1f}" + "".join(f"{recall:>11.4f}" for recall in recalls))
+
+
+if __name__ == "__main__":
+    main()
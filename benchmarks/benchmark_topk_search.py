@@ -0,0 +1,65 @@
+"""
+Benchmark the top-k gallery search of find_closest_dog: the per-pair loop with a heap vs the chunked matrix form,
+on random VGG-16 sized features, and check that both return the same neighbours.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_topk_search --gallery 100000 --queries 16 --k 5
+"""
+import argparse
+import heapq
+import time
+
+import torch
+
+from vgg_processing import find_top_k, get_l2_vgg_features
+
+
+def legacy_find_top_k(query_features, gallery_features_list, k):
+    closest_heap = []
+    for index, gallery_features in enumerate(gallery_features_list):
+        dist = get_l2_vgg_features(query_features, gallery_features)
+        if len(closest_heap) < k:
+            heapq.heappush(closest_heap, (-dist, index))
+        else:
+            heapq.heappushpop(closest_heap, (-dist, index))
+
+    return [index for _, index in sorted(closest_heap, reverse=True)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gallery", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--legacy-queries", type=int, default=2, help="The per-pair loop is slow, only time this many queries")
+    args = parser.parse_args()
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    generator = torch.Generator().manual_seed(0)
+    gallery_features = torch.randn(args.gallery, args.dim, generator=generator).to(device)
+    query_features = torch.randn(args.queries, args.dim, generator=generator).to(device)
+    gallery_features_list = [features.unsqueeze(0) for features in gallery_features]
+
+    start = time.perf_counter()
+    legacy_indices = [legacy_find_top_k(query_features[i:i + 1], gallery_features_list, args.k) for i in range(args.legacy_queries)]
+    legacy_seconds = (time.perf_counter() - start) / args.legacy_queries
+
+    find_top_k(query_features[:1], gallery_features, args.k)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    _, indices = find_top_k(query_features, gallery_features, args.k)
+    indices = indices.tolist()
+    matrix_seconds = (time.perf_counter() - start) / args.queries
+
+    mismatches = sum(legacy_indices[i] != indices[i] for i in range(args.legacy_queries))
+
+    print(f"gallery: {args.gallery} x {args.dim}, device: {device}, k: {args.k}")
+    print(f"per-pair loop: {legacy_seconds * 1000:10.1f} ms/query")
+    print(f"matrix top-k:  {matrix_seconds * 1000:10.1f} ms/query ({args.queries} queries per call)")
+    print(f"speedup: {legacy_seconds / matrix_seconds:.0f}x, mismatching queries: {mismatches}/{args.legacy_queries}")
+
+
+if __name__ == "__main__":
+    main()
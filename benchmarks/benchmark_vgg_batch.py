@@ -0,0 +1,64 @@
+"""
+Benchmark the VGG-16 feature extraction of vgg_processing: get_vgg_features image by image vs get_vgg_features_batch
+at each truncation point, on synthetic variable-size images, and check the batched logits match.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_vgg_batch --images 64 --batch-size 32
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from utils import to_vgg_input
+from vgg_processing import VGG_TRUNCATIONS, get_vgg_features, get_vgg_features_batch
+
+
+def create_variable_size_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(200, 800, size=(count, 2))
+    return [rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8) for height, width in sizes]
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    vgg16 = torch.hub.load('pytorch/vision:v0.10.0', 'vgg16', pretrained=True).eval().to(device)
+    images = create_variable_size_images(args.images)
+
+    # Warm up the kernels
+    get_vgg_features_batch(images[:2], vgg16, device=device)
+
+    synchronize(device)
+    start = time.perf_counter()
+    with torch.no_grad():
+        per_image = torch.cat([get_vgg_features(to_vgg_input(image).to(device), vgg16) for image in images])
+    synchronize(device)
+    per_image_seconds = time.perf_counter() - start
+    print(f"device: {device}, images: {args.images}, batch size: {args.batch_size}")
+    print(f"{'per image (logits)':<24}{per_image_seconds / args.images * 1000:>10.1f} ms/img  dim {per_image.shape[1]}")
+
+    for truncation in VGG_TRUNCATIONS:
+        synchronize(device)
+        start = time.perf_counter()
+        features = get_vgg_features_batch(images, vgg16, truncation=truncation, batch_size=args.batch_size, device=device)
+        synchronize(device)
+        seconds = time.perf_counter() - start
+        print(f"{'batch (' + truncation + ')':<24}{seconds / args.images * 1000:>10.1f} ms/img  dim {features.shape[1]}")
+
+        if truncation == "logits":
+            print(f"{'':<24}max abs diff vs per image: {(features - per_image).abs().max().item():.2e}")
+
+
+if __name__ == "__main__":
+    main()
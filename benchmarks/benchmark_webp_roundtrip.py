@@ -0,0 +1,63 @@
+"""
+Measure what the WEBP encode/decode round-trip that used to end the segmentation stage cost per image,
+and how far the decoded pixels drifted from the masked image that is now embedded directly.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_webp_roundtrip --images 32 --sizes 640x480 1024x1024 1920x1080
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.helpers.image_helper import convert_pil_image_to_webp
+
+
+def create_masked_images(count, width, height, seed=0):
+    # Smooth gradients with a black background around a centered blob, close to a masked photo
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    blob = ((x - width / 2) / (width / 3)) ** 2 + ((y - height / 2) / (height / 3)) ** 2 <= 1
+
+    images = []
+    for _ in range(count):
+        image = np.stack([(x * rng.uniform(0.1, 0.3) + y * rng.uniform(0.1, 0.3)) % 256] * 3, axis=-1)
+        image = (image + rng.normal(0, 8, image.shape)).clip(0, 255).astype(np.uint8)
+        image[~blob] = 0
+        images.append(image)
+
+    return images
+
+
+def webp_roundtrip(masked_image):
+    # The previous tail of process_pil_image_YOLO
+    return np.asarray(convert_pil_image_to_webp(Image.fromarray(masked_image)).convert("RGB"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1024x1024", "1920x1080"])
+    args = parser.parse_args()
+
+    print(f"{'size':<12}{'webp ms/img':>14}{'array ms/img':>14}{'saved ms/img':>14}{'mean abs px diff':>18}")
+    for size in args.sizes:
+        width, height = (int(value) for value in size.split("x"))
+        masked_images = create_masked_images(args.images, width, height)
+
+        start = time.perf_counter()
+        decoded_images = [webp_roundtrip(masked_image) for masked_image in masked_images]
+        webp_time = (time.perf_counter() - start) / args.images * 1000
+
+        # The array is handed to the embedder as is
+        start = time.perf_counter()
+        arrays = [np.ascontiguousarray(masked_image) for masked_image in masked_images]
+        array_time = (time.perf_counter() - start) / args.images * 1000
+
+        difference = np.mean([np.abs(decoded.astype(np.int16) - array).mean() for decoded, array in zip(decoded_images, arrays)])
+        print(f"{size:<12}{webp_time:>14.2f}{array_time:>14.3f}{webp_time - array_time:>14.2f}{difference:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Recall@k, model size and latency of the INT8 quantized DINO extractor against the fp32 extractor on CPU.
+
+Every image of the folder is used once as a query against the gallery formed by the other images. The fp32
+neighbours are the ground truth, recall@k is the share of them the INT8 model also returns in its top k.
+The script exits with a non-zero status when recall@k drops below --min-recall.
+
+Run from the repository root:
+    python -m benchmarks.evaluate_quantized_recall --images-dir path/to/dog/photos --k 1 5 10
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from app.model_optimization.features_extractor import FeatureExtractor, QuantizedFeatureExtractor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_images(images_dir, max_images):
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(images_dir)
+        for name in files
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:max_images]
+
+    return [Image.open(path).convert("RGB") for path in paths]
+
+
+def model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+
+def nearest_neighbours(features, k):
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    similarities = normalized @ normalized.T
+    # An image is never its own neighbour
+    np.fill_diagonal(similarities, -np.inf)
+    return np.argsort(-similarities, axis=1)[:, :k]
+
+
+def recall_at_k(reference_neighbours, neighbours, k):
+    hits = [len(set(reference[:k]) & set(candidate[:k])) for reference, candidate in zip(reference_neighbours, neighbours)]
+    return sum(hits) / (len(hits) * k)
+
+
+def measure(feature_extractor, pil_images, batch_size):
+    start = time.perf_counter()
+    features = feature_extractor.encode_batch(pil_images, batch_size=batch_size)
+    return features, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images-dir", required=True)
+    parser.add_argument("--max-images", type=int, default=1000)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    pil_images = load_images(args.images_dir, args.max_images)
+    if len(pil_images) <= max(args.k):
+        print(f"Need more than {max(args.k)} images, found {len(pil_images)} in {args.images_dir}")
+        sys.exit(2)
+
+    fp32_extractor = FeatureExtractor()
+    fp32_extractor.device = torch.device("cpu")
+    fp32_extractor.dino.to(fp32_extractor.device)
+    int8_extractor = QuantizedFeatureExtractor()
+
+    fp32_features, fp32_time = measure(fp32_extractor, pil_images, args.batch_size)
+    int8_features, int8_time = measure(int8_extractor, pil_images, args.batch_size)
+
+    print(f"Images: {len(pil_images)}")
+    print(f"{'model':<32}{'size MB':>10}{'ms/img':>10}")
+    print(f"{fp32_extractor.model_id:<32}{model_size_mb(fp32_extractor.dino):>10.1f}{fp32_time / len(pil_images) * 1000:>10.2f}")
+    print(f"{int8_extractor.model_id:<32}{model_size_mb(int8_extractor.dino):>10.1f}{int8_time / len(pil_images) * 1000:>10.2f}")
+
+    cosine = (fp32_features * int8_features).sum(axis=1) / (np.linalg.norm(fp32_features, axis=1) * np.linalg.norm(int8_features, axis=1))
+    print(f"Cosine fp32 vs int8: min={cosine.min():.4f} mean={cosine.mean():.4f}")
+
+    max_k = max(args.k)
+    fp32_neighbours = nearest_neighbours(fp32_features, max_k)
+    int8_neighbours = nearest_neighbours(int8_features, max_k)
+
+    failed = False
+    for k in sorted(args.k):
+        recall = recall_at_k(fp32_neighbours, int8_neighbours, k)
+        print(f"recall@{k}: {recall:.4f}")
+        failed = failed or recall < args.min_recall
+
+    if failed:
+        print(f"FAILED: recall below {args.min_recall}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
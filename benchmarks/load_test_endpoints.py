@@ -0,0 +1,79 @@
+"""
+Load test: measure the latency of a cheap endpoint (get_dog_by_id) while searches saturate the CPU.
+
+The script first measures the cheap endpoint alone, then again while `--search-concurrency` clients
+keep posting searches, and prints p50/p95/p99 for both runs.
+
+Run from the repository root against a running server:
+    python -m benchmarks.load_test_endpoints --url http://localhost:8000 --image dog.jpg --dog-id 1
+"""
+import argparse
+import base64
+import json
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def timed_request(request):
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    pick = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    return f"n={len(latencies):<5} p50={pick(0.50):8.1f}ms p95={pick(0.95):8.1f}ms p99={pick(0.99):8.1f}ms max={latencies[-1] * 1000:8.1f}ms"
+
+
+def measure_cheap_endpoint(url, dog_id, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda _: timed_request(f"{url}/dogfinder/get_dog_by_id?dogId={dog_id}"), range(requests)))
+
+
+def search_loop(url, payload, stop_event, latencies):
+    while not stop_event.is_set():
+        request = urllib.request.Request(f"{url}/dogfinder/search_in_found_dogs", data=payload, headers={"Content-Type": "application/json"})
+        latencies.append(timed_request(request))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--image", required=True, help="Path of the image used for the searches")
+    parser.add_argument("--dog-id", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=500, help="Number of cheap requests per run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent cheap clients")
+    parser.add_argument("--search-concurrency", type=int, default=8, help="Concurrent search clients")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        payload = json.dumps({"base64Image": base64.b64encode(f.read()).decode("utf-8"), "top": 10}).encode("utf-8")
+
+    print("get_dog_by_id, idle server       :", percentiles(measure_cheap_endpoint(args.url, args.dog_id, args.requests, args.concurrency)))
+
+    stop_event = threading.Event()
+    search_latencies = []
+    search_threads = [threading.Thread(target=search_loop, args=(args.url, payload, stop_event, search_latencies), daemon=True) for _ in range(args.search_concurrency)]
+    for thread in search_threads:
+        thread.start()
+
+    # Let the searches saturate the inference pool before measuring
+    time.sleep(2)
+    loaded = measure_cheap_endpoint(args.url, args.dog_id, args.requests, args.concurrency)
+
+    stop_event.set()
+    for thread in search_threads:
+        thread.join()
+
+    print("get_dog_by_id, under search load :", percentiles(loaded))
+    if search_latencies:
+        print("search_in_found_dogs             :", percentiles(search_latencies), f"mean={statistics.mean(search_latencies) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
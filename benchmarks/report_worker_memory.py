@@ -0,0 +1,102 @@
+"""
+Report the RSS, PSS and USS of a server master process and its workers, from /proc/<pid>/smaps_rollup (Linux only).
+
+PSS splits every shared page between the processes mapping it, so the PSS total is the real memory footprint
+of the deployment. USS is the memory private to a process, the memory freed if it exited. Run it against the
+plain uvicorn/gunicorn deployment and the preload mode (gunicorn -c app/gunicorn_conf.py app.main:app), after
+sending a few requests so every worker has run inference, and compare the totals.
+
+Run from the repository root:
+    python -m benchmarks.report_worker_memory --pid <master pid>
+    python -m benchmarks.report_worker_memory --pattern "gunicorn"
+"""
+import argparse
+import os
+import sys
+
+
+def read_smaps_rollup(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+    }
+
+
+def read_cmdline(pid):
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+
+
+def find_children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent pid is the 2nd field after the parenthesized command name
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+
+    return sorted(children)
+
+
+def find_by_pattern(pattern):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit() and int(entry) != os.getpid():
+            try:
+                if pattern in read_cmdline(entry):
+                    pids.append(int(entry))
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+
+    return sorted(pids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--pid", type=int, help="The master process, its child processes are the workers")
+    group.add_argument("--pattern", help="Report every process whose command line contains the pattern")
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("/proc/<pid>/smaps_rollup is not available, Linux 4.14+ is required")
+        sys.exit(2)
+
+    pids = [args.pid] + find_children(args.pid) if args.pid else find_by_pattern(args.pattern)
+
+    totals = {"rss": 0, "pss": 0, "uss": 0, "shared": 0}
+    print(f"{'pid':>8}{'role':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'shared MB':>11}  command")
+    for pid in pids:
+        try:
+            memory = read_smaps_rollup(pid)
+            command = read_cmdline(pid)
+        except (FileNotFoundError, ProcessLookupError, PermissionError) as e:
+            print(f"{pid:>8}  skipped: {e}")
+            continue
+
+        for key in totals:
+            totals[key] += memory[key]
+
+        role = "master" if args.pid and pid == args.pid else "worker"
+        print(f"{pid:>8}{role:>8}{memory['rss'] / 1024:>10.1f}{memory['pss'] / 1024:>10.1f}{memory['uss'] / 1024:>10.1f}{memory['shared'] / 1024:>11.1f}  {command[:60]}")
+
+    print(f"{'total':>16}{totals['rss'] / 1024:>10.1f}{totals['pss'] / 1024:>10.1f}{totals['uss'] / 1024:>10.1f}{totals['shared'] / 1024:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,50 @@
 import os
 import torch
 import cv2
-import heapq
 from utils import to_vgg_input
-from vgg_processing import get_vgg_features, get_l2_vgg_features, get_cosine_similarity
+from gallery_builder import Gallery, GalleryBuilder
+from vgg_processing import find_top_k, get_vgg_features, get_vgg_features_batch, get_l2_vgg_features, get_cosine_similarity, stack_vgg_features
+
+# The pairwise similarity functions and the metric of their matrix form
+SIMILARITY_FUNC_METRICS = {
+    get_l2_vgg_features: "l2",
+    get_cosine_similarity: "cosine",
+}
 
 class DogSimilarityFinder:
-    def __init__(self, device, vgg_model):
+    def __init__(self, device, vgg_model, truncation="logits"):
         """
         Initializes the DogSimilarityFinder with a specified device and VGG model.
         
         Args:
             device (torch.device): The device to use for computations (CPU or CUDA).
             vgg_model (torch.nn.Module): The pretrained VGG model to use for feature extraction.
+            truncation (str): The VGG-16 layer the query and gallery features are taken from, one of vgg_processing.VGG_TRUNCATIONS.
+                The dictionaries of create_lost_dict always hold the logits.
         """
         self.device = device
         self.vgg_model = vgg_model
+        self.truncation = truncation
+
+    def stack_gallery(self, vgg_features_dict):
+        """
+        Stacks the VGG-16 features of a dictionary created by create_lost_dict into a single [N, D] matrix.
+        A dictionary may change between two queries so it is stacked on every call, repeated queries against
+        the same gallery should use a Gallery, which already holds the stacked matrix.
+
+        Args:
+            vgg_features_dict (dict or Gallery): A dictionary containing dog images and their corresponding VGG-16 features, or a Gallery.
+
+        Returns:
+            tuple: The keys of the dictionary and the [N, D] matrix of their features, in the same order.
+        """
+        if isinstance(vgg_features_dict, Gallery):
+            return list(range(len(vgg_features_dict))), vgg_features_dict.features
+
+        keys = list(vgg_features_dict.keys())
+        gallery_features = stack_vgg_features([vgg_features_dict[key][1] for key in keys]).to(self.device)
+
+        return keys, gallery_features
 
     def find_k_closest_dogs(self, img, vgg_features_dict, k, similarity_func=get_l2_vgg_features):
         """
@@ -25,24 +54,50 @@ class DogSimilarityFinder:
             img (ndarray): The input image of a dog.
             vgg_features_dict (dict): A dictionary containing dog images and their corresponding VGG-16 features.
             k (int): The number of most similar dogs to find.
-            similarity_func (callable): The function to use for computing similarity (distance) between feature vectors.
+            similarity_func (callable): get_l2_vgg_features or get_cosine_similarity, selects the distance between feature vectors.
         
         Returns:
-            list: A list of tuples containing the negative distance, VGG-16 features, and image of one of the k most similar dogs.
+            list: A list of tuples containing the distance, VGG-16 features, and image of one of the k most similar dogs, closest first.
+        """
+        return self.find_k_closest_dogs_batch([img], vgg_features_dict, k, similarity_func)[0]
+
+    def find_k_closest_dogs_batch(self, imgs, vgg_features_dict, k, similarity_func=get_l2_vgg_features):
         """
-        img_tensor = to_vgg_input(img)
-        img_vgg_features = get_vgg_features(img_tensor, self.vgg_model)
-        closest_dogs_heap = []
-        for _, value in vgg_features_dict.items():
-            dog_imgs, dog_features = value
-            vgg_dist = similarity_func(img_vgg_features, dog_features)
-            if len(closest_dogs_heap) < k:
-                heapq.heappush(closest_dogs_heap, (-vgg_dist, dog_features, dog_imgs))
-            else:
-                heapq.heappushpop(closest_dogs_heap, (-vgg_dist, dog_features, dog_imgs))
-        closest_dogs_list = [(-dist, dog_features, dog_img) for dist, dog_features, dog_img in closest_dogs_heap]
-        closest_dogs_list.sort(key=lambda x: x[0])
-        return closest_dogs_list
+        Identifies the k most similar dogs to each of the given images, scoring all the queries against the
+        whole gallery with a single matrix product per gallery chunk.
+
+        Args:
+            imgs (list of ndarray): The input images of dogs.
+            vgg_features_dict (dict or Gallery): A dictionary containing dog images and their corresponding VGG-16 features, or a Gallery.
+            k (int): The number of most similar dogs to find per image.
+            similarity_func (callable): get_l2_vgg_features or get_cosine_similarity, selects the distance between feature vectors.
+
+        Returns:
+            list: For each input image, a list of tuples containing the distance, VGG-16 features, and image of one of the k most similar dogs, closest first.
+                For a Gallery the image is its file path, read it with Gallery.load_image when needed.
+        """
+        if similarity_func not in SIMILARITY_FUNC_METRICS:
+            raise ValueError(f"Unsupported similarity function {similarity_func}, expected one of {[func.__name__ for func in SIMILARITY_FUNC_METRICS]}")
+
+        keys, gallery_features = self.stack_gallery(vgg_features_dict)
+        truncation = self.truncation if isinstance(vgg_features_dict, Gallery) else "logits"
+        query_features = get_vgg_features_batch(imgs, self.vgg_model, truncation=truncation, device=self.device)
+
+        distances, indices = find_top_k(query_features, gallery_features, k, metric=SIMILARITY_FUNC_METRICS[similarity_func])
+
+        # A single transfer of the [Q, k] results instead of a sync per distance
+        closest_dogs_lists = []
+        for query_distances, query_indices in zip(distances.tolist(), indices.tolist()):
+            closest_dogs_list = []
+            for dist, index in zip(query_distances, query_indices):
+                if isinstance(vgg_features_dict, Gallery):
+                    dog_img, dog_features = vgg_features_dict.paths[index], gallery_features[index]
+                else:
+                    dog_img, dog_features = vgg_features_dict[keys[index]]
+                closest_dogs_list.append((dist, dog_features, dog_img))
+            closest_dogs_lists.append(closest_dogs_list)
+
+        return closest_dogs_lists
 
     def add_to_dict(self, img, img_features_dict):
         """
@@ -72,12 +127,28 @@ class DogSimilarityFinder:
             self.add_to_dict(img, img_features_dict_lost)
         return img_features_dict_lost
 
+    def create_lost_gallery(self, lost_dir, batch_size=32, num_workers=4):
+        """
+        Creates a Gallery of the VGG-16 features of the images in the specified directory. Unlike create_lost_dict
+        the images are decoded in parallel, embedded in batches and not kept in memory, and their features are
+        cached on disk so an unchanged directory is not embedded again.
+
+        Args:
+            lost_dir (str): The directory path containing the images.
+            batch_size (int): The number of images embedded at once.
+            num_workers (int): The number of image loader threads.
+
+        Returns:
+            Gallery: The features and file paths of the images.
+        """
+        return GalleryBuilder(self.vgg_model, self.device, batch_size=batch_size, num_workers=num_workers, truncation=self.truncation).build(lost_dir)
+
 def main():
     """
     Entry point of the script to find the k most similar dogs for a given image based on their VGG-16 features.
 
     - Define the directories for found, lost, and mixed lost dog images.
-    - Create a dictionary of images and their VGG-16 features for the mixed lost dog images.
+    - Create a gallery of the VGG-16 features of the mixed lost dog images.
     - Load the found dog images.
     - Read the first found dog image and find the k most similar dogs among the mixed lost dog images.
     - Extract and list the images of the k most similar dogs.
@@ -91,8 +162,8 @@ def main():
     images_lost_dir = 'C:\\Users\\N7\\Downloads\\images\\Images\\n02085620-Chihuahua\\lost'
     mix_lost_dir = 'C:\\Users\\N7\\Downloads\\images\\Images\\n02085620-Chihuahua\\mix_lost'
 
-    # Create a dictionary of images and their VGG-16 features for the mixed lost dog images
-    img_features_dict_lost = dog_similarity_finder.create_lost_dict(mix_lost_dir)
+    # Create a gallery of the VGG-16 features of the mixed lost dog images
+    gallery_lost = dog_similarity_finder.create_lost_gallery(mix_lost_dir)
 
     # Load the found dog images
     images_found = os.listdir(images_found_dir)
@@ -104,10 +175,10 @@ def main():
     num_closest_dogs = 5
 
     # Find the k most similar dogs among the mixed lost dog images
-    closest_dogs_list = dog_similarity_finder.find_k_closest_dogs(first_found, img_features_dict_lost, k=num_closest_dogs)
+    closest_dogs_list = dog_similarity_finder.find_k_closest_dogs(first_found, gallery_lost, k=num_closest_dogs)
 
     # Extract and list the images of the k most similar dogs
-    closest_images_list = [dog_img for _, _, dog_img in closest_dogs_list]
+    closest_images_list = [cv2.imread(dog_img_path) for _, _, dog_img_path in closest_dogs_list]
     print("")
 
 if __name__ == '__main__':
@@ -0,0 +1,234 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import cv2
+import numpy as np
+import torch
+from utils import to_vgg_input
+from app.helpers.embedding_store import EmbeddingStore
+from vgg_processing import prepare_vgg_input, run_vgg
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class Gallery:
+    def __init__(self, paths, features):
+        """
+        The VGG-16 features of a directory of dog images, the images themselves stay on disk.
+
+        Args:
+            paths (list of str): The image file paths.
+            features (torch.Tensor): The [N, D] VGG-16 features, row i belongs to paths[i].
+        """
+        self.paths = paths
+        self.features = features
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load_image(self, index):
+        """
+        Reads the image of a gallery entry from disk, only when it is needed.
+
+        Args:
+            index (int): The row of the entry.
+
+        Returns:
+            ndarray: The BGR image, as cv2.imread returns it.
+        """
+        return cv2.imread(self.paths[index])
+
+
+def list_images(directory):
+    """
+    Lists the image files of a directory, in a stable order.
+
+    Args:
+        directory (str): The directory path containing the images.
+
+    Returns:
+        list: The absolute paths of the images.
+    """
+    return sorted(
+        os.path.abspath(os.path.join(directory, name))
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def load_vgg_input(path):
+    """
+    Reads an image and prepares its VGG-16 input. Runs on the loader threads, cv2 and torch release the GIL.
+
+    Args:
+        path (str): The image file path.
+
+    Returns:
+        torch.Tensor: The [1, 3, 256, 256] VGG-16 input, or None if the image can't be read.
+    """
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    return prepare_vgg_input(to_vgg_input(img))
+
+
+def prefetch(func, items, num_workers, prefetch_count):
+    """
+    Maps func over items on a thread pool, keeping at most prefetch_count results in flight, in order.
+
+    Args:
+        func (callable): The function to apply.
+        items (list): The inputs.
+        num_workers (int): The number of loader threads.
+        prefetch_count (int): The number of results computed ahead of the consumer.
+
+    Yields:
+        tuple: Each input and its result.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= prefetch_count:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            next_item = next(items, None)
+            if next_item is not None:
+                pending.append((next_item, executor.submit(func, next_item)))
+            yield item, future.result()
+
+
+class GalleryBuilder:
+    def __init__(self, vgg_model, device, batch_size=32, num_workers=4, cache_dir=None, truncation="logits", model_name=None):
+        """
+        Builds galleries of VGG-16 features: decodes the images on a prefetching thread pool, embeds them in
+        batches and caches the features on disk by file path and modification time.
+
+        Args:
+            vgg_model (torch.nn.Module): The pretrained VGG model to use for feature extraction.
+            device (torch.device): The device to use for computations (CPU or CUDA).
+            batch_size (int): The number of images embedded at once.
+            num_workers (int): The number of image loader threads.
+            cache_dir (str): The directory of the feature cache, an EmbeddingStore (see app/helpers/embedding_store.py).
+                Defaults to '.vgg_features' inside the gallery directory.
+            truncation (str): The VGG-16 layer the features are taken from, one of vgg_processing.VGG_TRUNCATIONS.
+            model_name (str): The identity of vgg_model, a cache of another model is rebuilt. Defaults to 'vgg16:<truncation>'.
+        """
+        self.vgg_model = vgg_model
+        self.device = device
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.cache_dir = cache_dir
+        self.truncation = truncation
+        self.model_name = model_name or f"vgg16:{truncation}"
+
+    def build(self, directory, use_cache=True):
+        """
+        Creates the gallery of a directory. Images whose path and modification time are in the cache are not
+        read nor embedded again, so re-running over an unchanged directory skips the extraction entirely and
+        maps the cached features instead of loading them.
+
+        Args:
+            directory (str): The directory path containing the images.
+            use_cache (bool): Whether to read and update the on-disk feature cache.
+
+        Returns:
+            Gallery: The features and paths of the readable images of the directory.
+        """
+        paths = list_images(directory)
+        mtimes = {path: os.stat(path).st_mtime_ns for path in paths}
+
+        if not use_cache:
+            new_paths, new_features = self.embed_all(paths)
+            features = torch.from_numpy(new_features) if new_paths else torch.empty((0, 0))
+            return Gallery(new_paths, features.to(self.device))
+
+        cache_dir = self.cache_dir or os.path.join(directory, ".vgg_features")
+        store = self.open_cache(cache_dir)
+
+        # The cached rows still matching their image on disk
+        valid_rows = [] if store is None else [
+            row for row, (path, row_metadata) in enumerate(zip(store.ids, store.metadata))
+            if mtimes.get(path) == row_metadata["mtime_ns"]
+        ]
+        cached_paths = {store.ids[row] for row in valid_rows}
+        missing_paths = [path for path in paths if path not in cached_paths]
+
+        print(f"Gallery {directory}: {len(cached_paths)} cached, {len(missing_paths)} to embed")
+
+        new_paths, new_features = self.embed_all(missing_paths)
+
+        if store is not None and len(valid_rows) == len(store):
+            # Only new images, append them to the cache
+            store.append(new_features, new_paths, [{ "mtime_ns": mtimes[path] } for path in new_paths])
+        elif len(valid_rows) + len(new_paths) > 0:
+            # Images were changed or removed, rewrite the cache with the rows still valid
+            kept_features = np.asarray(store.vectors[valid_rows]) if valid_rows else None
+            kept_paths = [store.ids[row] for row in valid_rows]
+            dim = kept_features.shape[1] if kept_features is not None else new_features.shape[1]
+            store = EmbeddingStore.create(cache_dir, model=self.model_name, dim=dim, overwrite=True)
+            if kept_features is not None:
+                store.append(kept_features, kept_paths, [{ "mtime_ns": mtimes[path] } for path in kept_paths])
+            store.append(new_features, new_paths, [{ "mtime_ns": mtimes[path] } for path in new_paths])
+        else:
+            return Gallery([], torch.empty((0, 0)).to(self.device))
+
+        # Zero-copy on the CPU, the rows stay in the page cache
+        return Gallery(list(store.ids), store.as_tensor().to(self.device))
+
+    def open_cache(self, cache_dir):
+        try:
+            return EmbeddingStore.open(cache_dir, model=self.model_name)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f"Rebuilding the feature cache {cache_dir}: {e}")
+            return None
+
+    def embed_all(self, paths):
+        """
+        Embeds images, see embed_paths.
+
+        Returns:
+            tuple: The paths of the readable images and their [N, D] features as a float32 ndarray.
+        """
+        embedded_paths = []
+        embedded_features = []
+        for batch_paths, batch_features in self.embed_paths(paths):
+            embedded_paths.extend(batch_paths)
+            embedded_features.append(batch_features)
+
+        return embedded_paths, np.concatenate(embedded_features) if embedded_features else np.empty((0, 0), dtype=np.float32)
+
+    def embed_paths(self, paths):
+        """
+        Embeds images in batches while the loader threads decode the next ones.
+
+        Args:
+            paths (list of str): The image file paths.
+
+        Yields:
+            tuple: The paths of a batch and their [B, D] features as a float32 ndarray.
+        """
+        batch_paths = []
+        batch_inputs = []
+        for path, vgg_input in prefetch(load_vgg_input, paths, self.num_workers, 2 * self.batch_size):
+            if vgg_input is None:
+                print(f"Skipping unreadable image {path}")
+                continue
+            batch_paths.append(path)
+            batch_inputs.append(vgg_input)
+            if len(batch_inputs) == self.batch_size:
+                yield batch_paths, self.embed_batch(batch_inputs)
+                batch_paths, batch_inputs = [], []
+
+        if batch_inputs:
+            yield batch_paths, self.embed_batch(batch_inputs)
+
+    def embed_batch(self, vgg_inputs):
+        with torch.inference_mode():
+            batch = torch.cat(vgg_inputs).to(self.device)
+            return run_vgg(batch, self.vgg_model, self.truncation).reshape(len(vgg_inputs), -1).float().cpu().numpy()
@@ -21,12 +21,94 @@ def get_vgg_features(im, vgg16):
         2. Resizes the image tensor to 256x256 using area interpolation.
         3. Feeds the processed image tensor through the VGG-16 model to extract its features.
     """
-    im = (im + 1) * (255 / 2)  # Scale the image tensor from [-1, 1] to [0, 255]
-    im = F.interpolate(im, size=(256, 256), mode='area')  # Resize the image tensor to 256x256
+    im = prepare_vgg_input(im)
     im_features = vgg16(im)  # Extract VGG-16 features
     return im_features
 
 
+def prepare_vgg_input(im):
+    """
+    Scales and resizes an image tensor as get_vgg_features does before feeding it to the VGG-16 model.
+
+    Args:
+        im (torch.Tensor): The input image tensor.
+
+    Returns:
+        torch.Tensor: The [1, 3, 256, 256] VGG-16 input, inputs of several images can be concatenated into a batch.
+    """
+    im = (im + 1) * (255 / 2)  # Scale the image tensor from [-1, 1] to [0, 255]
+    im = F.interpolate(im, size=(256, 256), mode='area')  # Resize the image tensor to 256x256
+    return im
+
+
+# The output of get_vgg_features_batch: the 1000 classifier logits, the 4096-d penultimate FC layer,
+# or the 512-d globally average-pooled conv features
+VGG_TRUNCATIONS = ("logits", "fc7", "pool")
+
+
+def run_vgg(im, vgg16, truncation="logits"):
+    """
+    Runs a batch of VGG-16 inputs through the model up to the truncation point.
+
+    Args:
+        im (torch.Tensor): The [B, 3, 256, 256] VGG-16 inputs, see prepare_vgg_input.
+        vgg16 (torch.nn.Module): The torchvision VGG-16 model, in eval mode.
+        truncation (str): One of VGG_TRUNCATIONS.
+
+    Returns:
+        torch.Tensor: The [B, D] features.
+    """
+    if truncation == "logits":
+        return vgg16(im)
+
+    conv_features = vgg16.features(im)
+    if truncation == "pool":
+        return conv_features.mean(dim=(2, 3))
+    if truncation == "fc7":
+        # The classifier head without its last Linear layer, the dropouts are no-ops in eval mode
+        return vgg16.classifier[:-1](torch.flatten(vgg16.avgpool(conv_features), 1))
+
+    raise ValueError(f"Unknown truncation '{truncation}', expected one of {VGG_TRUNCATIONS}")
+
+
+def get_vgg_features_batch(images, vgg16, truncation="logits", batch_size=32, device=None):
+    """
+    Extracts the VGG-16 features of a list of variable-size images, in batches.
+
+    Args:
+        images (list): The images, HxWx3 ndarrays as cv2.imread returns them or [1, 3, H, W] tensors as utils.to_vgg_input returns them.
+        vgg16 (torch.nn.Module): The torchvision VGG-16 model, in eval mode.
+        truncation (str): One of VGG_TRUNCATIONS, "pool" and "fc7" skip the classifier head, or part of it.
+        batch_size (int): The number of images run through the model at once.
+        device (torch.device): The device of the model. Defaults to the device of its parameters.
+
+    Returns:
+        torch.Tensor: The [N, D] features, on the device.
+
+    Each image is moved to the device as is, then scaled and resized to 256x256 there as in get_vgg_features,
+    so the uniform batch is assembled without a round-trip to the CPU. For "logits" the features match
+    get_vgg_features image by image.
+    """
+    if truncation not in VGG_TRUNCATIONS:
+        raise ValueError(f"Unknown truncation '{truncation}', expected one of {VGG_TRUNCATIONS}")
+    if device is None:
+        device = next(vgg16.parameters()).device
+
+    batches = []
+    with torch.inference_mode():
+        for start in range(0, len(images), batch_size):
+            batch_inputs = []
+            for image in images[start:start + batch_size]:
+                im = image if torch.is_tensor(image) else torch.from_numpy(image).permute(2, 0, 1).unsqueeze(0)
+                batch_inputs.append(prepare_vgg_input(im.to(device, non_blocking=True)))
+            batches.append(run_vgg(torch.cat(batch_inputs), vgg16, truncation))
+
+    if not batches:
+        return torch.empty((0, 0), device=device)
+
+    return torch.cat(batches)
+
+
 def get_l2_vgg_features(vgg_features1, vgg_features2):
     """
     Computes the L2 distance between the VGG-16 features of two images.
@@ -67,6 +149,98 @@ def get_cosine_similarity(vgg_features1, vgg_features2):
     return cosine_similarity
 
 
+def stack_vgg_features(vgg_features_list):
+    """
+    Stacks the VGG features of several images into a single [N, D] matrix.
+
+    Args:
+        vgg_features_list (list of torch.Tensor): The VGG features of each image, of any shape with D elements.
+
+    Returns:
+        torch.Tensor: The [N, D] matrix of the flattened features.
+    """
+    return torch.stack([vgg_features.detach().reshape(-1) for vgg_features in vgg_features_list])
+
+
+def get_l2_vgg_features_matrix(query_features, gallery_features):
+    """
+    Computes the L2 distance, as in get_l2_vgg_features, between every query and every gallery image at once.
+
+    Args:
+        query_features (torch.Tensor): The [Q, D] VGG features of the queries.
+        gallery_features (torch.Tensor): The [N, D] VGG features of the gallery.
+
+    Returns:
+        torch.Tensor: The [Q, N] squared L2 distances.
+
+    ||q - g||^2 is expanded to ||q||^2 + ||g||^2 - 2 q.g so the whole block is a single matmul.
+    """
+    distances = query_features.square().sum(dim=1, keepdim=True) + gallery_features.square().sum(dim=1) - 2 * (query_features @ gallery_features.T)
+    # The expansion can go slightly negative for identical vectors
+    return distances.clamp_(min=0)
+
+
+def get_cosine_similarity_matrix(query_features, gallery_features):
+    """
+    Computes the cosine similarity between every query and every gallery image at once.
+
+    Args:
+        query_features (torch.Tensor): The [Q, D] VGG features of the queries.
+        gallery_features (torch.Tensor): The [N, D] VGG features of the gallery.
+
+    Returns:
+        torch.Tensor: The [Q, N] cosine similarities.
+    """
+    return F.normalize(query_features, dim=1) @ F.normalize(gallery_features, dim=1).T
+
+
+def find_top_k(query_features, gallery_features, k, metric="l2", chunk_size=16384):
+    """
+    Finds the k closest gallery images of every query.
+
+    Args:
+        query_features (torch.Tensor): The [Q, D] (or [D]) VGG features of the queries.
+        gallery_features (torch.Tensor): The [N, D] VGG features of the gallery.
+        k (int): The number of closest gallery images to return.
+        metric (str): "l2" for the squared L2 distance, or "cosine" for the cosine distance (1 - cosine similarity).
+        chunk_size (int): The number of gallery images scored at once, bounds the [Q, chunk_size] distance block.
+
+    Returns:
+        tuple: The [Q, k] distances, closest first, and the [Q, k] gallery indices.
+
+    The gallery is scored chunk by chunk and the running top-k is merged with the top-k of each chunk,
+    so a 100k images gallery never materializes the full [Q, N] matrix.
+    """
+    if metric == "l2":
+        distance_func = get_l2_vgg_features_matrix
+    elif metric == "cosine":
+        distance_func = lambda query, gallery: 1 - get_cosine_similarity_matrix(query, gallery)
+    else:
+        raise ValueError(f"Unknown metric '{metric}', expected 'l2' or 'cosine'")
+
+    if query_features.dim() == 1:
+        query_features = query_features.unsqueeze(0)
+    query_features = query_features.to(gallery_features.device, gallery_features.dtype)
+    k = min(k, gallery_features.shape[0])
+    if k == 0:
+        empty = torch.empty((query_features.shape[0], 0), device=gallery_features.device)
+        return empty, empty.long()
 
+    best_distances = None
+    best_indices = None
+    with torch.inference_mode():
+        for start in range(0, gallery_features.shape[0], chunk_size):
+            distances = distance_func(query_features, gallery_features[start:start + chunk_size])
+            chunk_distances, chunk_indices = distances.topk(min(k, distances.shape[1]), dim=1, largest=False)
+            chunk_indices += start
 
+            if best_distances is None:
+                best_distances, best_indices = chunk_distances, chunk_indices
+            else:
+                merged_distances = torch.cat([best_distances, chunk_distances], dim=1)
+                merged_indices = torch.cat([best_indices, chunk_indices], dim=1)
+                best_distances, order = merged_distances.topk(k, dim=1, largest=False)
+                best_indices = merged_indices.gather(1, order)
 
+    # topk of a single chunk is sorted, the merges keep it sorted
+    return best_distances, best_indices